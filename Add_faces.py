@@ -1,10 +1,12 @@
 import streamlit as st
 import cv2
-import pickle
-import numpy as np
-import os
-import time
-from PIL import Image
+import detection
+import enrollment
+import gallery_admin
+import metrics
+import model_store
+import preview
+import resources
 
 def record_faces():
     """
@@ -24,7 +26,9 @@ def record_faces():
             frame_placeholder = st.empty()
             
             
-            cap = cv2.VideoCapture(0)
+            # Shared with the other pages; kept open between runs of this page
+            # so recording starts from a camera that is already streaming
+            cap = resources.open_camera(0)
             
             
             if not cap.isOpened():
@@ -33,97 +37,99 @@ def record_faces():
             
             
             try:
-                facedetect = cv2.CascadeClassifier('Data/haarcascade_frontalface_default.xml')
-                if facedetect.empty():
-                    st.error("Error: Face detection model not found or invalid")
-                    st.info("Please make sure 'haarcascade_frontalface_default.xml' is in the Data folder")
-                    cap.release()
-                    return
+                facedetect = detection.FaceDetector(downscale=0.5)
+            except IOError:
+                st.error("Error: Face detection model not found or invalid")
+                st.info("Please make sure 'haarcascade_frontalface_default.xml' is in the Data folder")
+                cap.release()
+                return
             except Exception as e:
                 st.error(f"Error loading face detection model: {e}")
                 cap.release()
                 return
             
             
-            faces_data = []
-            i = 0
+            st.caption("Frames are captured at full camera rate and the sharpest, "
+                       "best-lit, most varied captures are kept.")
+            settings = st.columns(2)
+            capture_count = settings[0].number_input("Captures to keep", min_value=1, max_value=20, value=5)
+            time_budget = settings[1].number_input("Time budget (seconds)", min_value=1.0, max_value=30.0,
+                                                   value=5.0, step=1.0)
+            replace = False
+            existing = gallery_admin.list_identities().get(name, 0)
+            if existing:
+                replace = st.checkbox(f"Replace the {existing} existing captures of {name}",
+                                      help="Otherwise the new captures are added to the existing ones")
+            enroller = enrollment.BurstEnroller(facedetect, count=int(capture_count), time_budget=time_budget)
+            frame_preview = preview.FramePreview(frame_placeholder)
             status_text = st.empty()
             
             start_recording = st.button("Start Recording")
             stop_placeholder = st.empty()
             stop_recording = stop_placeholder.button("Stop Recording", key="stop")
             
+            metrics_panel = st.session_state.get('metrics_panel')
+            
             if start_recording and not stop_recording:
-                status_text.text("Recording started. Please look at the camera.")
+                status_text.text("Recording started. Please look at the camera and turn your head slightly.")
                 
-                while len(faces_data) < 5 and not stop_recording:
-                    ret, frame = cap.read()
+                while not enroller.done and not stop_recording:
+                    with metrics.timed('enroll_capture'):
+                        ret, frame = cap.read()
                     if not ret:
                         st.error("Error: Could not read from webcam")
                         break
                     
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    with metrics.timed('enroll_detect'):
+                        faces = facedetect.detect(frame)
+                    with metrics.timed('enroll_score'):
+                        candidate = enroller.offer(frame, faces)
                     
-                    faces = facedetect.detectMultiScale(gray, 1.3, 5)
-                    
-                    for (x, y, w, h) in faces:
-                        cv2.rectangle(frame_rgb, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                        
-                        crop_img = frame[y:y+h, x:x+w, :]
-                        resized_img = cv2.resize(crop_img, (50, 50))
-                        
-                        if i % 5 == 0 and len(faces_data) < 5:
-                            faces_data.append(resized_img)
+                    if frame_preview.due():
+                        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                        if candidate is not None:
+                            x, y, w, h = candidate.box
+                            color = (255, 165, 0) if candidate.rejected else (0, 255, 0)
+                            cv2.rectangle(frame_rgb, (x, y), (x+w, y+h), color, 2)
+                            if candidate.rejected:
+                                cv2.putText(frame_rgb, candidate.rejected, (x, y-10),
+                                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+                        cv2.putText(frame_rgb, f"Usable: {len(enroller.candidates)}", (10, 30),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                        with metrics.timed('enroll_render'):
+                            frame_preview.show(frame_rgb)
                         
-                        i += 1
-                        
-                        cv2.putText(frame_rgb, f"Captures: {len(faces_data)}/5", 
-                                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 
-                                    1, (0, 255, 0), 2)
-                    
-                    frame_placeholder.image(frame_rgb, channels="RGB", use_column_width=True)
-                    
-                    status_text.text(f"Captured {len(faces_data)}/5 images")
+                        status_text.text(f"{enroller.frames} frames, {len(enroller.candidates)} usable faces, "
+                                         f"{max(0.0, time_budget - enroller.elapsed()):.1f}s left, "
+                                         f"first frame after {cap.first_frame_seconds * 1000:.0f} ms")
+                        stop_recording = stop_placeholder.button("Stop Recording", key=f"stop_{enroller.frames}")
                     
-                    stop_recording = stop_placeholder.button("Stop Recording", key=f"stop_{i}")
-                    
-                    time.sleep(0.2)
+                    if metrics_panel is not None:
+                        metrics_panel.refresh()
                 
                 cap.release()
                 
-                if len(faces_data) > 0:
-                    faces_data = np.asarray(faces_data)
-                    faces_data = faces_data.reshape(len(faces_data), -1)
-                    
-                    if 'names.pkl' not in os.listdir('Data/'):
-                        names = [name] * len(faces_data)
-                        with open('Data/names.pkl', 'wb') as f:
-                            pickle.dump(names, f)
-                    else:
-                        with open('Data/names.pkl', 'rb') as f:
-                            names = pickle.load(f)
-                        names = names + [name] * len(faces_data)
-                        with open('Data/names.pkl', 'wb') as f:
-                            pickle.dump(names, f)
-                    
-                    if 'faces_data.pkl' not in os.listdir('Data/'):
-                        with open('Data/faces_data.pkl', 'wb') as f:
-                            pickle.dump(faces_data, f)
-                    else:
-                        with open('Data/faces_data.pkl', 'rb') as f:
-                            faces = pickle.load(f)
-                        faces = np.append(faces, faces_data, axis=0)
-                        with open('Data/faces_data.pkl', 'wb') as f:
-                            pickle.dump(faces, f)
+                chosen = enroller.select()
+                if chosen:
+                    with metrics.timed('enroll_save'):
+                        enrollment.enroll(name, chosen, replace=replace)
+                        model_store.get_store().refresh()
+                    metrics.inc('faces_enrolled', len(chosen))
+                    if metrics_panel is not None:
+                        metrics_panel.refresh(force=True)
                     
-                    st.success(f"Successfully registered {name} with {len(faces_data)} face captures!")
+                    st.success(f"Successfully registered {name} with {len(chosen)} face captures!")
+                    if len(chosen) < capture_count:
+                        st.info(f"Only {len(chosen)} good captures were found; register again to add more.")
                 else:
-                    st.warning("No faces were captured. Please try again.")
+                    st.warning("No usable faces were captured. Please try again.")
+                if enroller.rejections:
+                    st.caption("Skipped frames: " + ", ".join(
+                        f"{reason} {count}" for reason, count in sorted(enroller.rejections.items())))
             
             elif not start_recording:
                 st.info("Click 'Start Recording' to begin face registration")
+            cap.release()
         
         with col2:
             st.subheader("Instructions")
@@ -133,7 +139,7 @@ def record_faces():
                 2. Make sure your face is well-lit
                 3. Keep your face centered in the frame
                 4. Avoid rapid movements
-                5. The system will capture 5 images of your face
+                5. The system keeps the best captures of your face
                 """
             )
             
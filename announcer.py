@@ -0,0 +1,294 @@
+"""
+Spoken attendance announcements on one background worker
+
+All speech goes through a single long-lived thread with a bounded queue.
+Names marked while the worker is busy are coalesced into one announcement
+("Attendance marked for 5 students") instead of each arrival starting its
+own thread and voices talking over each other. The speech engine is a
+pluggable backend:
+
+    sapi      Windows SAPI through pywin32
+    pyttsx3   Offline TTS through the optional pyttsx3 package
+    log       Prints the text; for Linux servers and tests
+
+The ATTENDANCE_TTS environment variable picks a backend; by default the
+first available one in the order above is used. The worker never calls
+Streamlit: failures are kept for the page to show with pop_error().
+"""
+import collections
+import os
+import threading
+import time
+
+import metrics
+
+BACKEND_ENV = 'ATTENDANCE_TTS'
+
+
+class LogBackend:
+    """
+    Prints announcements instead of speaking them
+    """
+
+    name = 'log'
+
+    def open(self):
+        pass
+
+    def say(self, text):
+        print(f"[announce] {text}")
+
+    def close(self):
+        pass
+
+
+class SAPIBackend:
+    """
+    Windows SAPI voice, created once on the worker thread
+    """
+
+    name = 'sapi'
+
+    def __init__(self):
+        self.voice = None
+
+    def open(self):
+        import pythoncom
+        from win32com.client import Dispatch
+        pythoncom.CoInitialize()
+        self.voice = Dispatch("SAPI.SpVoice")
+
+    def say(self, text):
+        self.voice.Speak(text)
+
+    def close(self):
+        import pythoncom
+        self.voice = None
+        pythoncom.CoUninitialize()
+
+
+class Pyttsx3Backend:
+    """
+    Offline text-to-speech through pyttsx3 (espeak, NSSpeechSynthesizer or SAPI)
+    """
+
+    name = 'pyttsx3'
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.engine = None
+
+    def open(self):
+        import pyttsx3
+        self.engine = pyttsx3.init()
+        if self.rate:
+            self.engine.setProperty('rate', self.rate)
+
+    def say(self, text):
+        self.engine.say(text)
+        self.engine.runAndWait()
+
+    def close(self):
+        self.engine = None
+
+
+BACKENDS = {backend.name: backend for backend in (SAPIBackend, Pyttsx3Backend, LogBackend)}
+
+
+def create_backend(name=None):
+    """
+    Backend by name, or the first one whose libraries are installed
+
+    Args:
+        name (str, optional): 'sapi', 'pyttsx3' or 'log'; defaults to $ATTENDANCE_TTS
+    """
+    name = name or os.environ.get(BACKEND_ENV)
+    if name:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown speech backend {name!r}; choose from {', '.join(BACKENDS)}")
+        return BACKENDS[name]()
+
+    import importlib.util
+    if os.name == 'nt' and importlib.util.find_spec('win32com') is not None:
+        return SAPIBackend()
+    if importlib.util.find_spec('pyttsx3') is not None:
+        return Pyttsx3Backend()
+    return LogBackend()
+
+
+def marked_message(names, total, name_limit=3):
+    """
+    One announcement for everyone marked since the last one
+    """
+    if total == 1:
+        return f"Attendance marked for {names[0]}"
+    if total <= name_limit:
+        return f"Attendance marked for {', '.join(names[:-1])} and {names[-1]}"
+    return f"Attendance marked for {total} students"
+
+
+class Announcer:
+    """
+    Single worker thread that speaks queued announcements in order
+
+    Args:
+        backend: Speech backend (see create_backend); opened on the worker thread
+        max_pending (int): Queued messages kept; the oldest are dropped beyond this
+        coalesce_delay (float): Seconds to wait after the first new mark for
+            others to arrive, so a burst becomes one announcement
+        name_limit (int): Largest burst announced by name rather than by count
+    """
+
+    def __init__(self, backend=None, max_pending=5, coalesce_delay=0.3, name_limit=3):
+        self.backend = backend or create_backend()
+        self.max_pending = max_pending
+        self.coalesce_delay = coalesce_delay
+        self.name_limit = name_limit
+        self._condition = threading.Condition()
+        self._messages = collections.deque()
+        self._marked = []
+        self._marked_total = 0
+        self._marked_since = None
+        self._errors = collections.deque(maxlen=10)
+        self._busy = False
+        self._stopping = False
+        self.spoken = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name='announcer', daemon=True)
+        self._thread.start()
+
+    def say(self, text):
+        """
+        Queue a message to be spoken after any already waiting
+
+        Returns:
+            bool: False if the announcer has been stopped
+        """
+        with self._condition:
+            if self._stopping:
+                return False
+            self._messages.append(text)
+            while len(self._messages) > self.max_pending:
+                self._messages.popleft()
+                self.dropped += 1
+            self._condition.notify()
+            return True
+
+    def mark(self, name):
+        """
+        Announce that attendance was marked, coalesced with other marks in the same burst
+        """
+        with self._condition:
+            if self._stopping:
+                return False
+            if self._marked_total == 0:
+                self._marked_since = time.monotonic()
+            if len(self._marked) < self.name_limit:
+                self._marked.append(name)
+            self._marked_total += 1
+            self._condition.notify()
+            return True
+
+    def _next(self):
+        """
+        Wait for the next message; None once stopped and drained
+        """
+        with self._condition:
+            while True:
+                if self._marked_total:
+                    wait = self._marked_since + self.coalesce_delay - time.monotonic()
+                    if wait <= 0 or self._stopping:
+                        text = marked_message(self._marked, self._marked_total, self.name_limit)
+                        metrics.inc('announcements_coalesced', self._marked_total - 1)
+                        self._marked, self._marked_total = [], 0
+                        break
+                    self._condition.wait(wait)
+                elif self._messages:
+                    text = self._messages.popleft()
+                    break
+                elif self._stopping:
+                    return None
+                else:
+                    self._condition.wait()
+            self._busy = True
+            return text
+
+    def _run(self):
+        try:
+            self.backend.open()
+        except Exception as e:
+            self._errors.append(f"Audio feedback is unavailable ({e}); using log output")
+            self.backend = LogBackend()
+
+        while True:
+            text = self._next()
+            if text is None:
+                break
+            try:
+                with metrics.timed('announce'):
+                    self.backend.say(text)
+                self.spoken += 1
+                metrics.inc('announcements')
+            except Exception as e:
+                self._errors.append(f"Audio feedback couldn't be played: {e}")
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+        try:
+            self.backend.close()
+        except Exception:
+            pass
+
+    def pop_error(self):
+        """
+        Oldest unreported backend error, for the page to show, or None
+        """
+        with self._condition:
+            return self._errors.popleft() if self._errors else None
+
+    @property
+    def pending(self):
+        with self._condition:
+            return len(self._messages) + (1 if self._marked_total else 0)
+
+    def wait_idle(self, timeout=None):
+        """
+        Block until everything queued has been spoken
+
+        Returns:
+            bool: False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._messages or self._marked_total or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stop(self, timeout=5.0):
+        """
+        Speak what is queued, then end the worker
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+
+_default_announcer = None
+_default_announcer_lock = threading.Lock()
+
+
+def get_announcer():
+    """
+    Return the process-wide Announcer shared by all Streamlit sessions
+    """
+    global _default_announcer
+    with _default_announcer_lock:
+        if _default_announcer is None:
+            _default_announcer = Announcer()
+        return _default_announcer
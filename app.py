@@ -1,11 +1,12 @@
 import streamlit as st
-import pandas as pd
 import os
+import threading
 import time
 from datetime import datetime
-import Add_faces
-import tempCodeRunnerFile
-from PIL import Image
+import metrics
+
+# Page modules and heavy libraries (cv2, NumPy, pandas) are imported where
+# they are used, so the Home page starts without loading any of them
 
 
 st.set_page_config(
@@ -18,11 +19,18 @@ for folder in ['Data', 'Attendance']:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
+if os.environ.get('ATTENDANCE_METRICS_PORT'):
+    metrics.start_http_server(int(os.environ['ATTENDANCE_METRICS_PORT']))
+
 def main():
     st.sidebar.title("Smart Attendance System")
     st.sidebar.image("https://img.icons8.com/color/96/000000/face-id.png", width=100)
     
-    page = st.sidebar.radio("Navigation", ["Home", "Register Face", "Take Attendance", "View Records"])
+    page = st.sidebar.radio("Navigation", ["Home", "Register Face", "Take Attendance", "Live Monitor", "View Records"])
+    
+    # Drawn before the page so the attendance and registration loops can
+    # keep it current while they run
+    metrics_panel()
     
     if page == "Home":
         st.title("Welcome to Smart Attendance System")
@@ -55,19 +63,199 @@ def main():
             st.image("https://img.icons8.com/color/96/000000/report-card.png", width=100)
             
     elif page == "Register Face":
+        import Add_faces
         Add_faces.record_faces()
         
     elif page == "Take Attendance":
+        import tempCodeRunnerFile
         tempCodeRunnerFile.take_attendance()
         
+    elif page == "Live Monitor":
+        live_monitor()
+        
     elif page == "View Records":
         view_attendance()
     
+    start_model_preload()
+    
     # Footer
     st.sidebar.markdown("---")
     st.sidebar.info("Smart Attendance System v1.0")
     st.sidebar.text("© 2025 | All Rights Reserved")
 
+@st.cache_resource
+def start_model_preload():
+    """
+    Load the recognition model on a background thread, once per server
+
+    Runs after the first page has rendered, so by the time the user reaches
+    Take Attendance the model is ready, or that page waits for the load
+    already in progress instead of starting its own. The face detection
+    cascade is parsed into the shared pool the same way.
+    """
+    def load():
+        try:
+            import model_store
+            model_store.get_model()
+        except Exception:
+            # Take Attendance reports the error when it loads the model itself
+            pass
+        try:
+            import resources
+            resources.warm_cascade()
+        except Exception:
+            # Likewise reported by the pages that detect faces
+            pass
+    
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    return thread
+
+class MetricsPanel:
+    """
+    Sidebar placeholder for the stage timings and counters
+
+    Pages that run a capture loop call refresh() on every iteration; the
+    panel is redrawn at most once per interval seconds.
+    """
+    
+    def __init__(self, placeholder, interval=1.0):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.drawn_at = None
+    
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self.drawn_at is not None and now - self.drawn_at < self.interval:
+            return
+        self.drawn_at = now
+        
+        stages, counters = metrics.snapshot()
+        with self.placeholder.container():
+            if stages:
+                import pandas as pd
+                rows = [{
+                    'STAGE': stage,
+                    'P50 MS': round(summary['quantiles'][0.5] * 1000, 2),
+                    'P90 MS': round(summary['quantiles'][0.9] * 1000, 2),
+                    'P99 MS': round(summary['quantiles'][0.99] * 1000, 2),
+                    'COUNT': summary['count'],
+                } for stage, summary in stages.items()]
+                st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+            else:
+                st.caption("No timings recorded yet. Take attendance or register a face first.")
+            for name, value in sorted(counters.items()):
+                st.caption(f"{name.replace('_', ' ').capitalize()}: {value}")
+
+def metrics_panel():
+    """
+    Optional sidebar panel with per-stage timings of the attendance loop
+
+    The panel is kept in st.session_state['metrics_panel'] (None while
+    hidden) for the running page to refresh.
+    """
+    st.sidebar.markdown("---")
+    if not st.sidebar.checkbox("Show performance metrics"):
+        st.session_state['profile_mode'] = metrics.PROFILE_OFF
+        st.session_state['metrics_panel'] = None
+        return
+    
+    panel = MetricsPanel(st.sidebar.empty())
+    panel.refresh()
+    st.session_state['metrics_panel'] = panel
+    
+    if st.sidebar.button("Export Prometheus metrics"):
+        st.sidebar.success(f"Written to {metrics.write_prometheus()}")
+    st.session_state['profile_mode'] = st.sidebar.selectbox(
+        "Profile attendance sessions",
+        [metrics.PROFILE_OFF, metrics.PROFILE_SAMPLING, metrics.PROFILE_CPROFILE],
+        help=f"Profiles are written to {metrics.PROFILE_DIR}")
+
+def live_monitor():
+    """
+    Read-only view over the headless attendance service (service.py)
+    """
+    st.header("Live Monitor")
+    st.caption("Shows attendance recorded by the camera service started with `python service.py --source ...`")
+    
+    import pandas as pd
+    import service
+    
+    status = service.read_status()
+    if status is None:
+        st.info("The attendance service has not been started yet.")
+        return
+    
+    age = time.time() - status['updated']
+    if age > 5:
+        st.warning(f"Service status last updated {int(age)} seconds ago")
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Sources", len(status['sources']))
+    col2.metric("Marked this run", status['attendance_marked'])
+    col3.metric("Recognitions received", status['events_received'])
+    
+    st.subheader("Sources")
+    rows = []
+    for label, stats in status['sources'].items():
+        rows.append({
+            'SOURCE': label,
+            'CAPTURE FPS': round(stats.get('capture_fps', 0.0), 1),
+            'RECOGNITION FPS': round(stats.get('process_fps', 0.0), 1),
+            'FRAMES': stats.get('frames_processed', 0),
+            'DROPPED': stats.get('frames_dropped', 0),
+            'STATUS': stats.get('error') or ("finished" if stats.get('finished') else "running"),
+        })
+    st.dataframe(pd.DataFrame(rows), use_container_width=True)
+    
+    st.subheader("Today's Attendance")
+    events = service.read_events(date=datetime.now().strftime("%d-%m-%Y"))
+    if events:
+        df = pd.DataFrame(events)[['name', 'time', 'source']]
+        df.columns = ['NAME', 'TIME', 'SOURCE']
+        st.dataframe(df.iloc[::-1], use_container_width=True)
+    else:
+        st.info("No attendance records yet")
+    
+    if st.checkbox("Auto refresh", value=True):
+        time.sleep(2)
+        st.rerun()
+
+def attendance_records(source="files"):
+    """
+    The shared AttendanceStore, or the Parquet export when source is "export";
+    pandas, sqlite3 and pyarrow are only imported on first use
+    """
+    if source == "export":
+        import export_attendance
+        return export_attendance.get_records()
+    import attendance_store
+    return attendance_store.get_store()
+
+@st.cache_data
+def cached_dates(version, source):
+    return attendance_records(source).dates()
+
+@st.cache_data
+def cached_names(version, source):
+    return attendance_records(source).names()
+
+@st.cache_data
+def cached_day(date, version, source):
+    return attendance_records(source).day(date)
+
+@st.cache_data
+def cached_date_range(start, end, name, version, source):
+    return attendance_records(source).date_range(start, end, name)
+
+@st.cache_data
+def cached_attendance_rates(start, end, version, source):
+    return attendance_records(source).attendance_rates(start, end)
+
+@st.cache_data
+def cached_monthly_rollup(start, end, version, source):
+    return attendance_records(source).monthly_rollup(start, end)
+
 def view_attendance():
     st.header("Attendance Records")
     
@@ -75,22 +263,47 @@ def view_attendance():
         st.error("No attendance records found.")
         return
     
-    attendance_files = [f for f in os.listdir('Attendance') if f.startswith('Attendance_') and f.endswith('.csv')]
+    # A Parquet export (python export_attendance.py) can serve the reports
+    # instead; it covers the history up to when it was last run
+    source = "files"
+    exported = attendance_records("export")
+    if exported.exists():
+        exported_at = exported.exported_at()
+        choice = st.radio("Source", ["Attendance files", f"Parquet export ({exported_at:%d-%m-%Y %H:%M})"],
+                          horizontal=True)
+        source = "files" if choice == "Attendance files" else "export"
+        if source == "export" and exported.unparsed_times():
+            st.caption(f"{exported.unparsed_times()} exported rows have a time in an unknown format; "
+                       "their TIME is shown as written")
     
-    if not attendance_files:
-        st.warning("No attendance records found.")
+    # Ingest is incremental, and the version changes only when new rows
+    # arrive, so the cached queries below are reused until then
+    store = attendance_records(source)
+    try:
+        store.ingest()
+    except Exception as e:
+        st.error(f"Error reading attendance files: {e}")
         return
+    version = store.version()
     
-    attendance_files.sort(reverse=True)
+    try:
+        dates = cached_dates(version, source)
+    except Exception as e:
+        st.error(f"Error reading attendance records: {e}")
+        return
+    if not dates:
+        st.warning("No attendance records found.")
+        return
     
-    selected_date = st.selectbox("Select Date", attendance_files, 
-                                format_func=lambda x: x.replace('Attendance_', '').replace('.csv', ''))
+    tab_day, tab_range, tab_rates, tab_monthly = st.tabs(
+        ["By Day", "Date Range", "Attendance Rates", "Monthly Summary"])
     
-    if selected_date:
-        file_path = os.path.join('Attendance', selected_date)
+    with tab_day:
+        selected_date = st.selectbox("Select Date", dates, 
+                                    format_func=lambda d: d.strftime("%d-%m-%Y"))
         
-        try:
-            df = pd.read_csv(file_path)
+        if selected_date:
+            df = cached_day(selected_date, version, source)
             
             st.subheader("Attendance Statistics")
             total_attendees = len(df)
@@ -103,12 +316,47 @@ def view_attendance():
             st.download_button(
                 label="Download CSV",
                 data=csv_data,
-                file_name=selected_date,
+                file_name=f"Attendance_{selected_date.strftime('%d-%m-%Y')}.csv",
                 mime='text/csv',
             )
+    
+    with tab_range:
+        col1, col2 = st.columns(2)
+        with col1:
+            date_range = st.date_input("Date range", value=(dates[-1], dates[0]),
+                                       min_value=dates[-1], max_value=dates[0])
+        with col2:
+            person = st.selectbox("Person", ["All"] + cached_names(version, source))
+        
+        if isinstance(date_range, tuple) and len(date_range) == 2:
+            start, end = date_range
+            df = cached_date_range(start, end, None if person == "All" else person, version, source)
             
-        except Exception as e:
-            st.error(f"Error reading attendance file: {e}")
+            st.metric("Records", len(df))
+            st.dataframe(df, use_container_width=True)
+            st.download_button(
+                label="Download CSV",
+                data=df.to_csv(index=False).encode('utf-8'),
+                file_name=f"Attendance_{start.strftime('%d-%m-%Y')}_to_{end.strftime('%d-%m-%Y')}.csv",
+                mime='text/csv',
+                key="download_range",
+            )
+    
+    with tab_rates:
+        rates_range = st.date_input("Date range", value=(dates[-1], dates[0]),
+                                    min_value=dates[-1], max_value=dates[0], key="rates_range")
+        
+        if isinstance(rates_range, tuple) and len(rates_range) == 2:
+            df = cached_attendance_rates(rates_range[0], rates_range[1], version, source)
+            st.dataframe(df, use_container_width=True)
+    
+    with tab_monthly:
+        df = cached_monthly_rollup(None, None, version, source)
+        if df.empty:
+            st.info("No attendance records yet")
+        else:
+            st.dataframe(df.pivot(index='NAME', columns='MONTH', values='DAYS_PRESENT').fillna(0).astype(int),
+                         use_container_width=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,233 @@
+"""
+Indexed SQLite store over the daily attendance CSV files
+
+The CSV files in Attendance/ remain the source of truth. AttendanceStore
+ingests them incrementally into Data/attendance.db: files whose size and
+mtime are unchanged are skipped, files that only grew (the writer appends)
+are read from where the last ingest stopped, and anything else is
+re-ingested from scratch. Rows are indexed on (date, name) so date-range
+queries, per-person rates and monthly rollups stay fast over years of data.
+"""
+import csv
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+DB_PATH = 'Data/attendance.db'
+ATTENDANCE_DIR = 'Attendance'
+
+_FILE_PATTERN = re.compile(r'^Attendance_(\d{2}-\d{2}-\d{4})\.csv$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attendance (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    time TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_date_name ON attendance (date, name);
+CREATE INDEX IF NOT EXISTS idx_attendance_name_date ON attendance (name, date);
+CREATE INDEX IF NOT EXISTS idx_attendance_source ON attendance (source);
+CREATE TABLE IF NOT EXISTS ingested_files (
+    source TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+"""
+
+
+def parse_file_date(filename):
+    """
+    Parse the date out of an Attendance_dd-mm-YYYY.csv filename
+
+    Returns:
+        datetime.date or None if the name does not match
+    """
+    match = _FILE_PATTERN.match(os.path.basename(filename))
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%d-%m-%Y").date()
+    except ValueError:
+        return None
+
+
+class AttendanceStore:
+    """
+    SQLite-backed attendance index with incremental CSV ingest
+
+    Args:
+        db_path (str): SQLite database file
+        directory (str): Folder with the Attendance_*.csv files
+    """
+
+    def __init__(self, db_path=DB_PATH, directory=ATTENDANCE_DIR):
+        self.db_path = db_path
+        self.directory = directory
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _ingest_file(self, conn, filename, date, known):
+        path = os.path.join(self.directory, filename)
+        st = os.stat(path)
+        if known is not None and (known[0], known[1]) == (st.st_size, st.st_mtime_ns):
+            return 0
+
+        offset = 0
+        if known is not None and st.st_size >= known[2] and known[2] > 0:
+            offset = known[2]
+        else:
+            conn.execute("DELETE FROM attendance WHERE source = ?", (filename,))
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        # Only consume complete lines while the file may still be mid-write;
+        # a trailing row without a newline is taken once the file has settled
+        end = data.rfind(b'\n') + 1
+        if end < len(data) and time.time() - st.st_mtime > 2:
+            end = len(data)
+        text = data[:end].decode('utf-8', errors='replace')
+
+        reader = csv.reader(io.StringIO(text))
+        if offset == 0:
+            next(reader, None)
+        iso_date = date.isoformat()
+        rows = [(iso_date, row[0], row[1] if len(row) > 1 else '', filename) for row in reader if row]
+        conn.executemany("INSERT INTO attendance (date, name, time, source) VALUES (?, ?, ?, ?)", rows)
+        # Record the consumed size so an unconsumed tail is looked at again next time
+        conn.execute("INSERT OR REPLACE INTO ingested_files (source, size, mtime_ns, offset) VALUES (?, ?, ?, ?)",
+                     (filename, offset + end, st.st_mtime_ns, offset + end))
+        return len(rows)
+
+    def ingest(self):
+        """
+        Bring the database up to date with the CSV files
+
+        Returns:
+            int: Number of new rows ingested
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        with self._lock, self._connect() as conn:
+            known = {row[0]: row[1:] for row in conn.execute(
+                "SELECT source, size, mtime_ns, offset FROM ingested_files")}
+            added = 0
+            present = set()
+            for filename in os.listdir(self.directory):
+                date = parse_file_date(filename)
+                if date is None:
+                    continue
+                present.add(filename)
+                added += self._ingest_file(conn, filename, date, known.get(filename))
+
+            for filename in set(known) - present:
+                conn.execute("DELETE FROM attendance WHERE source = ?", (filename,))
+                conn.execute("DELETE FROM ingested_files WHERE source = ?", (filename,))
+            return added
+
+    def version(self):
+        """
+        Token that changes whenever the ingested files change, for cache keys
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(MAX(mtime_ns), 0) FROM ingested_files"
+            ).fetchone()
+
+    def _query(self, sql, params=()):
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def dates(self):
+        """
+        Dates with attendance records, newest first
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT DISTINCT date FROM attendance ORDER BY date DESC").fetchall()
+        return [datetime.strptime(row[0], "%Y-%m-%d").date() for row in rows]
+
+    def day(self, date):
+        """
+        Attendance rows for one day, in the original NAME/TIME layout
+        """
+        return self._query("SELECT name AS NAME, time AS TIME FROM attendance WHERE date = ? ORDER BY id",
+                           (date.isoformat(),))
+
+    def date_range(self, start, end, name=None):
+        """
+        All rows between start and end (inclusive), optionally for one person
+        """
+        sql = "SELECT date AS DATE, name AS NAME, time AS TIME FROM attendance WHERE date BETWEEN ? AND ?"
+        params = [start.isoformat(), end.isoformat()]
+        if name:
+            sql += " AND name = ?"
+            params.append(name)
+        return self._query(sql + " ORDER BY date, id", params)
+
+    def attendance_rates(self, start, end):
+        """
+        Per-person days present out of the days with any attendance in range
+        """
+        return self._query(
+            """
+            WITH days AS (
+                SELECT COUNT(DISTINCT date) AS total FROM attendance WHERE date BETWEEN ? AND ?
+            )
+            SELECT name AS NAME,
+                   COUNT(DISTINCT date) AS DAYS_PRESENT,
+                   days.total AS TOTAL_DAYS,
+                   ROUND(100.0 * COUNT(DISTINCT date) / days.total, 1) AS RATE
+            FROM attendance, days
+            WHERE date BETWEEN ? AND ?
+            GROUP BY name
+            ORDER BY RATE DESC, name
+            """,
+            (start.isoformat(), end.isoformat(), start.isoformat(), end.isoformat()))
+
+    def monthly_rollup(self, start=None, end=None):
+        """
+        Days present per person per month
+        """
+        sql = "SELECT substr(date, 1, 7) AS MONTH, name AS NAME, COUNT(DISTINCT date) AS DAYS_PRESENT FROM attendance"
+        params = []
+        if start and end:
+            sql += " WHERE date BETWEEN ? AND ?"
+            params = [start.isoformat(), end.isoformat()]
+        return self._query(sql + " GROUP BY MONTH, name ORDER BY MONTH, name", params)
+
+    def names(self):
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT name FROM attendance ORDER BY name")]
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Return the process-wide AttendanceStore
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = AttendanceStore()
+        return _default_store
@@ -0,0 +1,262 @@
+"""
+Thread-safe writer for the daily attendance CSV files
+
+AttendanceWriter keeps the current day's Attendance_<dd-mm-YYYY>.csv open,
+rolls over to a new file at midnight, and skips names already present in
+the day's file so a restarted session does not mark people twice. fsync is
+batched according to the fsync policy.
+
+Every session in a process shares one writer (get_writer), and with it one
+in-memory set of the day's names, so "already marked today" is a set lookup.
+Other processes writing the same file (the headless service, another app
+server) are picked up by reading only the rows added since the writer last
+looked. A new name is checked against those rows and appended under an
+exclusive lock on the file, so concurrent writers neither interleave rows
+nor record anybody twice, and a write that returns True is on file.
+"""
+import atexit
+import csv
+import io
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import utils
+
+ATTENDANCE_DIR = 'Attendance'
+HEADER = ['NAME', 'TIME']
+LOCK_FILE = '.lock'
+
+FSYNC_ALWAYS = 'always'
+FSYNC_ON_CLOSE = 'close'
+FSYNC_NEVER = 'never'
+
+
+def attendance_path(date, directory=ATTENDANCE_DIR):
+    """
+    Path of the attendance file for a dd-mm-YYYY date string
+    """
+    return os.path.join(directory, f"Attendance_{date}.csv")
+
+
+def _read_names(path, offset=0):
+    """
+    Names recorded in an attendance file from a byte offset on
+
+    Only complete lines are read, so a row another process is still writing
+    is left for the next call.
+
+    Returns:
+        tuple: (set of names, offset just past the last complete line)
+    """
+    if not os.path.exists(path):
+        return set(), 0
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    rows = csv.reader(io.StringIO(data[:end].decode('utf-8', errors='replace'), newline=''))
+    if offset == 0:
+        next(rows, None)
+    return {row[0] for row in rows if row}, offset + end
+
+
+@contextmanager
+def _locked(path):
+    """
+    Hold an exclusive lock on the folder of an attendance file across processes
+    """
+    with utils.file_lock(os.path.join(os.path.dirname(path) or '.', LOCK_FILE)):
+        yield
+
+
+class AttendanceWriter:
+    """
+    Appends attendance rows with a single open handle per day
+
+    Args:
+        directory (str): Folder holding the daily attendance files
+        path (str, optional): Write to this fixed file instead of one file per day
+        fsync (str): 'always' to fsync after every row, 'close' to fsync only
+            when a file is closed or rolled over, 'never' to leave it to the OS
+    """
+
+    def __init__(self, directory=ATTENDANCE_DIR, path=None, fsync=FSYNC_ON_CLOSE):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_ON_CLOSE, FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.directory = directory
+        self.fixed_path = path
+        self.fsync = fsync
+
+        self.rows_written = 0
+        self.flushes = 0
+        self.duplicates_skipped = 0
+
+        self._lock = threading.RLock()
+        self._file = None
+        self._writer = None
+        self._path = None
+        self._date = None
+        self._names = set()
+        self._offset = 0
+        self._closed = threading.Event()
+
+    def _open(self, date):
+        """
+        Switch to the file for a date, loading the names already in it
+        """
+        self._close_file()
+        path = self.fixed_path or attendance_path(date, self.directory)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        with _locked(path):
+            if os.path.getsize(path) == 0:
+                self._writer.writerow(HEADER)
+                self._file.flush()
+            self._names, self._offset = _read_names(path)
+        self._path = path
+        self._date = date
+
+    def _catch_up(self):
+        """
+        Read rows other processes appended since the file was last read
+        """
+        try:
+            size = os.path.getsize(self._path)
+        except OSError:
+            return
+        if size <= self._offset:
+            return
+        names, self._offset = _read_names(self._path, self._offset)
+        self._names |= names
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        self._writer = None
+
+    def has(self, name, when=None):
+        """
+        True if name is already recorded for the day of when (default: today)
+        """
+        when = when or datetime.now()
+        with self._lock:
+            date = when.strftime("%d-%m-%Y")
+            if date != self._date:
+                path = self.fixed_path or attendance_path(date, self.directory)
+                return name in _read_names(path)[0]
+            if name not in self._names:
+                self._catch_up()
+            return name in self._names
+
+    def write(self, name, when=None, time_text=None):
+        """
+        Record attendance for name unless it is already recorded that day
+
+        Args:
+            name (str): Name of the person
+            when (datetime, optional): Time of attendance, default now; picks the day's file
+            time_text (str, optional): Text for the TIME column, default when as HH:MM:SS
+
+        Returns:
+            bool: True if a new row was written, False if the name is already
+            recorded that day, by this or any other process
+        """
+        when = when or datetime.now()
+        date = when.strftime("%d-%m-%Y")
+        with self._lock:
+            if self._closed.is_set():
+                raise ValueError("AttendanceWriter is closed")
+            if date != self._date or self._file is None:
+                self._open(date)
+            if name in self._names:
+                self.duplicates_skipped += 1
+                return False
+
+            # Another process may have recorded the name since the file was
+            # last read; check and append under the lock so only one does
+            with _locked(self._path):
+                self._catch_up()
+                if name in self._names:
+                    self.duplicates_skipped += 1
+                    return False
+                self._writer.writerow([name, time_text or when.strftime("%H:%M:%S")])
+                self._file.flush()
+                if self.fsync == FSYNC_ALWAYS:
+                    os.fsync(self._file.fileno())
+                self._offset = os.fstat(self._file.fileno()).st_size
+            self._names.add(name)
+            self.rows_written += 1
+        return True
+
+    def flush(self):
+        """
+        Make sure every row written so far has reached the file
+
+        Rows are handed to the OS as they are written, so this is only
+        needed by callers that write through other handles.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self.flushes += 1
+
+    def close(self):
+        """
+        Flush, fsync (unless the policy is 'never') and close the current file
+        """
+        self._closed.set()
+        with self._lock:
+            self._close_file()
+            self._date = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rows_written': self.rows_written,
+                'flushes': self.flushes,
+                'duplicates_skipped': self.duplicates_skipped,
+                'path': self._path,
+            }
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(directory=ATTENDANCE_DIR, path=None):
+    """
+    Return the process-wide writer for a directory (or fixed file path)
+
+    Writers are shared so every session and thread appends through the same
+    open handle and dedupe set. They are closed automatically at exit.
+    """
+    key = (os.path.abspath(directory), os.path.abspath(path) if path else None)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None or writer._closed.is_set():
+            writer = AttendanceWriter(directory, path)
+            _writers[key] = writer
+        return writer
+
+
+@atexit.register
+def close_all():
+    """
+    Close every shared writer, flushing any buffered rows
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
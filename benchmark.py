@@ -0,0 +1,1101 @@
+"""
+Performance benchmarks for the Smart Attendance System
+
+Usage:
+    python benchmark.py recognition [--faces 1 10 50] [--repeat 30] [--synthetic N]
+    python benchmark.py detection [--video clip.mp4] [--configs 0.5:1 0.5:3]
+    python benchmark.py service [--video clip.mp4] [--max-sources 4]
+    python benchmark.py features [--dims 64 128] [--dnn-model model.t7]
+    python benchmark.py index [--sizes 1000 10000 100000] [--nprobe 4 8 16]
+    python benchmark.py replay [--video clip.mp4] [--json result.json] [--baseline previous.json]
+    python benchmark.py startup [--modules app Add_faces] [--top 10]
+    python benchmark.py preview [--video clip.mp4] [--configs 640:70 480:60]
+    python benchmark.py sessions [--processes 4] [--sessions 8] [--people 200]
+    python benchmark.py motion [--video lecture.mp4] [--configs 1:15 0.5:10]
+    python benchmark.py camera [--source 0] [--visits 10] [--gap 1.0]
+    python benchmark.py migration [--people 10] [--captures 5] [--processes 4]
+"""
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+
+def _time_call(fn, repeat):
+    """
+    Run fn repeat times and return the per-call durations in seconds
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return np.asarray(durations)
+
+
+def _load_gallery(synthetic=0, n_identities=30, seed=0):
+    """
+    Load the stored gallery, or build a synthetic one of the given size
+    """
+    if synthetic:
+        rng = np.random.default_rng(seed)
+        faces = rng.integers(0, 256, size=(synthetic, 7500), dtype=np.uint8)
+        labels = [f"person_{i % n_identities}" for i in range(synthetic)]
+        return faces, labels
+
+    import utils
+    faces, labels = utils.load_face_data()
+    if faces is None or len(faces) == 0:
+        raise SystemExit("No face data found. Register faces first or use --synthetic N")
+    return np.asarray(faces), labels
+
+
+def _probe_faces(faces, count, seed=1):
+    """
+    Draw gallery rows with a little noise to stand in for live crops
+    """
+    rng = np.random.default_rng(seed)
+    rows = faces[rng.integers(0, len(faces), size=count)].astype(np.int16)
+    rows += rng.integers(-10, 11, size=rows.shape, dtype=np.int16)
+    return np.clip(rows, 0, 255).astype(np.uint8)
+
+
+def bench_recognition(args):
+    """
+    Compare per-face KNeighborsClassifier.predict with BatchRecognizer
+    """
+    from sklearn.neighbors import KNeighborsClassifier
+    from recognizer import BatchRecognizer
+
+    faces, labels = _load_gallery(args.synthetic)
+    print(f"Gallery: {len(faces)} captures, {len(set(labels))} identities")
+
+    knn = KNeighborsClassifier(n_neighbors=5).fit(faces, labels)
+    batch64 = BatchRecognizer(faces, labels, dtype=np.float64)
+    batch32 = BatchRecognizer(faces, labels, dtype=np.float32)
+
+    print(f"{'faces':>6} {'per-face ms':>12} {'batch f64 ms':>13} {'batch f32 ms':>13} "
+          f"{'speedup':>8} {'agree f32':>10}")
+    for count in args.faces:
+        probes = _probe_faces(faces, count)
+
+        def per_face():
+            return [str(knn.predict(row.reshape(1, -1))[0]) for row in probes]
+
+        per_face_ms = np.median(_time_call(per_face, args.repeat)) * 1000
+        f64_ms = np.median(_time_call(lambda: batch64.recognize(probes), args.repeat)) * 1000
+        f32_ms = np.median(_time_call(lambda: batch32.recognize(probes), args.repeat)) * 1000
+
+        agreement = np.mean(np.asarray(per_face()) == np.asarray(batch32.recognize(probes)[0]))
+        print(f"{count:>6} {per_face_ms:>12.2f} {f64_ms:>13.2f} {f32_ms:>13.2f} "
+              f"{per_face_ms / f32_ms:>7.1f}x {agreement:>9.0%}")
+
+
+def _synthetic_frames(count=200, faces_per_frame=1, size=(480, 640), seed=0):
+    """
+    Frames with gallery faces drifting across a plain background
+
+    Gallery crops are upscaled and moved a few pixels each frame, which is
+    enough for the Haar cascade to find them and to exercise tracking.
+    """
+    faces, _ = _load_gallery()
+    rng = np.random.default_rng(seed)
+    height, width = size
+    face_size = 160
+    picks = rng.integers(0, len(faces), size=faces_per_frame)
+    starts = rng.integers(0, width - face_size * 2, size=faces_per_frame)
+    lanes = [int(i * (height - face_size) / max(faces_per_frame, 1)) for i in range(faces_per_frame)]
+
+    crops = [cv2.resize(np.asarray(faces[p]).reshape(50, 50, 3), (face_size, face_size)) for p in picks]
+    frames = []
+    for i in range(count):
+        frame = np.full((height, width, 3), 110, dtype=np.uint8)
+        for crop, start, lane in zip(crops, starts, lanes):
+            x = int(start + 2 * i) % (width - face_size)
+            frame[lane:lane + face_size, x:x + face_size] = crop
+        frames.append(frame)
+    return frames
+
+
+def _load_frames(video=None, limit=300, synthetic_faces=1):
+    """
+    Read up to limit frames from a video file, or generate synthetic ones
+    """
+    if not video:
+        return _synthetic_frames(limit, synthetic_faces)
+    cap = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise SystemExit(f"Could not read frames from {video}")
+    return frames
+
+
+def _recall(reference, candidate, threshold=0.4):
+    """
+    Fraction of reference boxes matched by a candidate box with IoU >= threshold
+    """
+    from detection import iou
+
+    total = matched = 0
+    for ref_boxes, cand_boxes in zip(reference, candidate):
+        total += len(ref_boxes)
+        matched += sum(any(iou(r, c) >= threshold for c in cand_boxes) for r in ref_boxes)
+    return matched / total if total else 1.0
+
+
+def bench_detection(args):
+    """
+    Compare detection FPS and recall against full-frame detection
+    """
+    from detection import FaceDetector
+
+    frames = _load_frames(args.video, args.frames, args.synthetic_faces)
+    print(f"Clip: {len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+
+    def run(detector):
+        start = time.perf_counter()
+        boxes = [detector.detect(frame) for frame in frames]
+        return boxes, len(frames) / (time.perf_counter() - start)
+
+    reference, reference_fps = run(FaceDetector())
+    print(f"{'scale':>6} {'every':>6} {'fps':>8} {'speedup':>8} {'recall':>7}")
+    print(f"{1.0:>6} {1:>6} {reference_fps:>8.1f} {1.0:>7.1f}x {1.0:>6.0%}")
+    for config in args.configs:
+        downscale, detect_every = config.split(':')
+        detector = FaceDetector(downscale=float(downscale), detect_every=int(detect_every))
+        boxes, fps = run(detector)
+        print(f"{float(downscale):>6} {int(detect_every):>6} {fps:>8.1f} "
+              f"{fps / reference_fps:>7.1f}x {_recall(reference, boxes):>6.0%}")
+
+
+def _write_clip(frames, path, fps=25):
+    """
+    Save frames as an MJPG video so they can be replayed like a recording
+    """
+    height, width = frames[0].shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def bench_service(args):
+    """
+    Aggregate service throughput as more video sources are added
+    """
+    import os
+    import tempfile
+
+    import attendance_writer
+    import service
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = args.video or _write_clip(_synthetic_frames(args.frames, 2), os.path.join(tmp, 'clip.avi'))
+        print(f"Clip: {video}")
+        print(f"{'sources':>8} {'frames':>8} {'seconds':>8} {'total fps':>10} {'fps/source':>11}")
+        for count in range(1, args.max_sources + 1):
+            run_dir = os.path.join(tmp, f"run_{count}")
+            writer = attendance_writer.AttendanceWriter(os.path.join(run_dir, 'Attendance'))
+            result = service.run_service([video] * count, writer=writer, service_dir=run_dir)
+            writer.close()
+            print(f"{count:>8} {result['frames_processed']:>8} {result['elapsed']:>8.1f} "
+                  f"{result['fps']:>10.1f} {result['fps'] / count:>11.1f}")
+
+
+def _loo_accuracy(vectors, labels, n_neighbors=5, rows=None):
+    """
+    Leave-one-out accuracy: classify each row against all the other rows
+
+    Args:
+        rows (np.ndarray, optional): Only classify these rows
+    """
+    from recognizer import BatchRecognizer
+
+    recognizer = BatchRecognizer(vectors, labels, n_neighbors=n_neighbors + 1)
+    rows = np.arange(len(vectors)) if rows is None else np.asarray(rows)
+    correct = 0
+    for start in range(0, len(rows), 256):
+        batch = rows[start:start + 256]
+        _, nearest = recognizer.kneighbors(vectors[batch])
+        for row, neighbours in zip(batch, nearest):
+            votes = recognizer.label_idx[neighbours[neighbours != row][:n_neighbors]]
+            predicted = np.bincount(votes, minlength=len(recognizer.classes)).argmax()
+            correct += recognizer.classes[predicted] == labels[row]
+    return correct / len(rows)
+
+
+def _extract(extractor, faces):
+    return np.concatenate([np.asarray(extractor.transform(faces[i:i + 4096]), dtype=np.float32)
+                           for i in range(0, len(faces), 4096)])
+
+
+def _fold_accuracy(dims, faces, labels, folds=5):
+    """
+    Leave-one-out accuracy of PCA features, refitting the projection for
+    each fold without the rows that fold classifies
+    """
+    import features
+
+    correct = 0
+    for rows in np.array_split(np.arange(len(faces)), min(folds, len(faces))):
+        train = np.ones(len(faces), dtype=bool)
+        train[rows] = False
+        extractor = features.PCAExtractor(min(dims, int(train.sum()))).fit(faces[train])
+        correct += _loo_accuracy(_extract(extractor, faces), labels, rows=rows) * len(rows)
+    return correct / len(faces)
+
+
+def bench_features(args):
+    """
+    Memory, latency and accuracy of each feature extractor vs raw pixels
+    """
+    import features
+    from recognizer import BatchRecognizer
+
+    faces, labels = _load_gallery(args.synthetic)
+    print(f"Gallery: {len(faces)} captures, {len(set(labels))} identities")
+
+    extractors = [features.PixelExtractor()]
+    for dims in args.dims:
+        extractors.append(features.PCAExtractor(min(dims, len(faces))).fit(faces))
+    if args.dnn_model:
+        extractors.append(features.DnnExtractor(args.dnn_model))
+
+    probes = _probe_faces(faces, args.batch)
+    print(f"{'extractor':>12} {'dims':>6} {'gallery MB':>11} {f'ms/{args.batch} faces':>14} {'LOO accuracy':>13}")
+    for extractor in extractors:
+        vectors = _extract(extractor, faces)
+        recognizer = BatchRecognizer(vectors, labels)
+        latency = np.median(_time_call(lambda: recognizer.recognize(extractor.transform(probes)),
+                                       args.repeat)) * 1000
+        if extractor.name == 'pca':
+            # Fitted on the gallery, so accuracy comes from fits that leave the classified rows out
+            name = f"pca-{extractor.dim}"
+            accuracy = _fold_accuracy(extractor.dim, faces, labels, args.folds)
+        else:
+            name = extractor.name
+            accuracy = _loo_accuracy(vectors, labels)
+        print(f"{name:>12} {vectors.shape[1]:>6} {recognizer.gallery.nbytes / 1e6:>11.2f} "
+              f"{latency:>14.2f} {accuracy:>12.1%}")
+
+def _clustered_vectors(count, dim, per_identity=10, seed=0):
+    """
+    Synthetic embeddings: a few noisy captures around one centre per identity
+    """
+    rng = np.random.default_rng(seed)
+    n_identities = max(1, count // per_identity)
+    centres = rng.standard_normal((n_identities, dim)).astype(np.float32)
+    identity = np.arange(count) % n_identities
+    vectors = centres[identity] + 0.3 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors, [f"person_{i}" for i in identity]
+
+
+def bench_index(args):
+    """
+    Recall and latency of the IVF index and identity centroids vs exact search
+    """
+    from gallery_index import IVFIndex
+    from recognizer import BatchRecognizer, CentroidRecognizer
+
+    k = 5
+    print(f"{'gallery':>8} {'index':>12} {'build s':>8} {f'ms/{args.batch} faces':>14} "
+          f"{f'recall@{k}':>9} {'same name':>10}")
+    for size in args.sizes:
+        vectors, labels = _clustered_vectors(size, args.dim)
+        rng = np.random.default_rng(1)
+        probes = vectors[rng.integers(0, size, size=args.batch)]
+        probes = probes + 0.3 * rng.standard_normal(probes.shape).astype(np.float32)
+
+        exact = BatchRecognizer(vectors, labels, n_neighbors=k)
+        _, exact_nearest = exact.kneighbors(probes)
+        exact_names = exact.recognize(probes)[0]
+        latency = np.median(_time_call(lambda: exact.recognize(probes), args.repeat)) * 1000
+        print(f"{size:>8} {'exact':>12} {'-':>8} {latency:>14.2f} {1:>9.1%} {1:>10.1%}")
+
+        start = time.perf_counter()
+        ivf = IVFIndex(vectors, nlist=args.nlist)
+        build_seconds = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            ivf.nprobe = nprobe
+            approx = BatchRecognizer(vectors, labels, n_neighbors=k, index=ivf)
+            _, nearest = approx.kneighbors(probes)
+            recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(exact_nearest, nearest)])
+            agreement = np.mean([a == b for a, b in zip(exact_names, approx.recognize(probes)[0])])
+            latency = np.median(_time_call(lambda: approx.recognize(probes), args.repeat)) * 1000
+            name = f"ivf{ivf.nlist}/{nprobe}"
+            print(f"{size:>8} {name:>12} {build_seconds:>8.2f} {latency:>14.2f} {recall:>9.1%} {agreement:>10.1%}")
+
+        # Per-identity centroids: one comparison per person instead of per capture
+        start = time.perf_counter()
+        centroid = CentroidRecognizer(vectors, labels)
+        build_seconds = time.perf_counter() - start
+        agreement = np.mean([a == b for a, b in zip(exact_names, centroid.recognize(probes)[0])])
+        latency = np.median(_time_call(lambda: centroid.recognize(probes), args.repeat)) * 1000
+        print(f"{size:>8} {'centroid':>12} {build_seconds:>8.2f} {latency:>14.2f} {'-':>9} {agreement:>10.1%}")
+
+
+def _peak_rss_mb():
+    """
+    Peak resident memory of this process in MB, or None where unsupported
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def _percentiles(durations):
+    durations = np.asarray(durations) * 1000
+    if len(durations) == 0:
+        return {'count': 0}
+    return {
+        'count': int(len(durations)),
+        'mean_ms': float(durations.mean()),
+        'p50_ms': float(np.percentile(durations, 50)),
+        'p90_ms': float(np.percentile(durations, 90)),
+        'p99_ms': float(np.percentile(durations, 99)),
+        'max_ms': float(durations.max()),
+    }
+
+
+def bench_replay(args):
+    """
+    Replay frames through detection, recognition and attendance writing
+
+    Uses the same FaceProcessor, model store and AttendanceWriter as the app,
+    without Streamlit or a camera. Attendance and enrollment writes go to a
+    temporary directory so the real records and gallery are left untouched.
+    """
+    import json
+    import os
+    import tempfile
+
+    import attendance_writer
+    import gallery
+    import model_store
+    import pipeline
+    import recognizer
+
+    frames = _load_frames(args.video, args.frames, args.synthetic_faces)
+    with tempfile.TemporaryDirectory() as tmp:
+        gallery_dir = gallery.GALLERY_DIR
+        if args.synthetic:
+            gallery_dir = os.path.join(tmp, 'gallery')
+            faces, labels = _load_gallery(args.synthetic)
+            gallery.append_faces(faces, labels, gallery_dir)
+
+        start = time.perf_counter()
+        model = model_store.ModelStore(gallery_dir).get()
+        gallery_load = time.perf_counter() - start
+        if model is None:
+            raise SystemExit("No face data found. Register faces first or use --synthetic N")
+
+        processor = pipeline.FaceProcessor(model, identity_ttl=args.identity_ttl,
+                                           downscale=args.downscale, detect_every=args.detect_every)
+        writer = attendance_writer.AttendanceWriter(os.path.join(tmp, 'Attendance'))
+        stages = {'detect': [], 'recognize': [], 'annotate': [], 'attendance_write': [], 'end_to_end': []}
+        faces_detected = 0
+        enrollment_crops = []
+
+        replay_start = time.perf_counter()
+        for frame in frames:
+            t0 = time.perf_counter()
+            boxes = processor.detect(frame)
+            t1 = time.perf_counter()
+            names, _ = processor.recognize(frame, boxes)
+            t2 = time.perf_counter()
+            pipeline.annotate(frame, boxes, names)
+            t3 = time.perf_counter()
+            for name in names:
+                if name != recognizer.UNKNOWN:
+                    writer.write(name)
+            t4 = time.perf_counter()
+
+            stages['detect'].append(t1 - t0)
+            stages['recognize'].append(t2 - t1)
+            stages['annotate'].append(t3 - t2)
+            stages['attendance_write'].append(t4 - t3)
+            stages['end_to_end'].append(t4 - t0)
+            faces_detected += len(boxes)
+            if len(boxes) and len(enrollment_crops) < 5:
+                enrollment_crops.append(recognizer.crops_from_frame(frame, boxes[:1])[0])
+        replay_seconds = time.perf_counter() - replay_start
+        writer.close()
+
+        # The enrollment write done by record_faces, against a scratch gallery
+        enroll_seconds = None
+        if enrollment_crops:
+            start = time.perf_counter()
+            gallery.append_faces(np.stack(enrollment_crops), ['benchmark'] * len(enrollment_crops),
+                                 os.path.join(tmp, 'enroll'))
+            enroll_seconds = time.perf_counter() - start
+
+    result = {
+        'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'config': {key: value for key, value in vars(args).items() if key != 'func'},
+        'frames': len(frames),
+        'frame_size': [int(frames[0].shape[1]), int(frames[0].shape[0])],
+        'fps': len(frames) / replay_seconds,
+        'faces_detected': faces_detected,
+        'attendance_marked': writer.rows_written,
+        'gallery': {
+            'captures': len(model),
+            'identities': len(set(model.labels)),
+            'load_seconds': gallery_load,
+            'read_seconds': model.timings['load'],
+            'fit_seconds': model.timings['fit'],
+        },
+        'enroll_seconds': enroll_seconds,
+        'stages': {stage: _percentiles(durations) for stage, durations in stages.items()},
+        'processor': processor.stats(),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+    print(f"Replayed {result['frames']} frames of {frames[0].shape[1]}x{frames[0].shape[0]} "
+          f"at {result['fps']:.1f} fps, {faces_detected} faces, {result['attendance_marked']} marked")
+    print(f"Gallery: {result['gallery']['captures']} captures loaded in {gallery_load * 1000:.1f} ms")
+    if enroll_seconds is not None:
+        print(f"Enrollment write: {enroll_seconds * 1000:.1f} ms for {len(enrollment_crops)} captures")
+    if result['peak_rss_mb'] is not None:
+        print(f"Peak memory: {result['peak_rss_mb']:.0f} MB")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(f"{'stage':>17} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+          + (f" {'p50 vs base':>12}" if baseline else ""))
+    for stage, stats in result['stages'].items():
+        line = (f"{stage:>17} {stats['p50_ms']:>8.2f} {stats['p90_ms']:>8.2f} "
+                f"{stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+        base = (baseline or {}).get('stages', {}).get(stage, {}).get('p50_ms')
+        if base:
+            line += f" {stats['p50_ms'] / base - 1:>+11.0%}"
+        print(line)
+    if baseline:
+        print(f"FPS {result['fps']:.1f} vs baseline {baseline['fps']:.1f} "
+              f"({result['fps'] / baseline['fps'] - 1:+.0%})")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+def _import_times(module):
+    """
+    Import a module in a fresh interpreter with -X importtime
+
+    Returns:
+        list: (package, self_ms, cumulative_ms, depth) rows in import order
+    """
+    import subprocess
+
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            capture_output=True, text=True).stderr
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, self_us, cumulative_us, name = line.split('|', 1)[0], *line.split('|')[-3:]
+        self_us = self_us.split(':')[-1]
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000, depth))
+    return rows
+
+
+_PAGE_TIMER = """
+import json, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file('app.py', default_timeout=120)
+at.run()
+timings = {'cold start (Home)': time.perf_counter() - start}
+for page in %r:
+    start = time.perf_counter()
+    at.sidebar.radio[0].set_value(page).run()
+    timings[page] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def bench_startup(args):
+    """
+    Import cost of the app modules and cold start / page switch time of the app
+    """
+    import json
+    import subprocess
+
+    print(f"{'module':>20} {'import ms':>10}   heaviest imports (cumulative ms)")
+    for module in args.modules:
+        rows = _import_times(module)
+        if not rows:
+            print(f"{module:>20} {'failed':>10}")
+            continue
+        # Children are printed before their parent, so the module's own
+        # imports are the rows just above it that are nested deeper
+        total, depth = rows[-1][2], rows[-1][3]
+        children = []
+        for row in reversed(rows[:-1]):
+            if row[3] <= depth:
+                break
+            if row[3] == depth + 1:
+                children.append(row)
+        heaviest = sorted(children, key=lambda r: -r[2])[:args.top]
+        print(f"{module:>20} {total:>10.1f}   " + ", ".join(f"{name} {ms:.0f}" for name, _, ms, _ in heaviest))
+
+    if args.no_pages:
+        return
+    pages = ["Register Face", "Take Attendance", "View Records", "Home"]
+    result = subprocess.run([sys.executable, '-c', _PAGE_TIMER % (pages,)], capture_output=True, text=True)
+    try:
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        print(f"Could not time app pages:\n{result.stderr[-2000:]}")
+        return
+    print(f"\n{'app run':>20} {'seconds':>10}")
+    for page, seconds in timings.items():
+        print(f"{page:>20} {seconds:>10.2f}")
+
+
+def bench_preview(args):
+    """
+    Bytes per preview frame and encode time for JPEG preview settings vs full frames
+    """
+    import pipeline
+    from preview import FramePreview
+
+    class Placeholder:
+        def image(self, *args, **kwargs):
+            pass
+
+    frames = [pipeline.annotate(frame, [], []) for frame in _load_frames(args.video, args.frames)]
+    print(f"Clip: {len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(f"{'preview':>12} {'KB/frame':>9} {'encode ms':>10} {f'KB/s at {args.fps:g} fps':>15} {'vs full':>8}")
+    # st.image re-encodes full-size arrays as quality-100 JPEG, so that is the baseline
+    full_bytes = None
+    for config in ['0:100'] + args.configs:
+        width, quality = (int(v) for v in config.split(':'))
+        preview = FramePreview(Placeholder(), max_width=width, quality=quality)
+        durations = _time_call(lambda: [preview.show(frame) for frame in frames], 1)
+        per_frame = preview.bytes_sent / len(frames)
+        full_bytes = full_bytes or per_frame
+        name = f"{width}px q{quality}" if width else "full q100"
+        print(f"{name:>12} {per_frame / 1024:>9.1f} {durations[0] * 1000 / len(frames):>10.2f} "
+              f"{per_frame * args.fps / 1024:>15.0f} {per_frame / full_bytes:>7.1%}")
+
+
+def _session_worker(directory, sessions, people, marks, seed):
+    """
+    One process running several simulated attendance sessions on threads
+
+    Every session marks random people, many of them more than once, through
+    the process's shared writer, as the Take Attendance page does.
+
+    Returns:
+        dict: Names attempted, check and write latencies, and rows accepted
+    """
+    import threading
+    import attendance_writer
+
+    writer = attendance_writer.get_writer(directory)
+    checks, writes = [], []
+    attempted, accepted = set(), [0]
+    lock = threading.Lock()
+
+    def session(session_seed):
+        rng = np.random.default_rng(session_seed)
+        local_checks, local_writes, names, count = [], [], set(), 0
+        for person in rng.integers(0, people, size=marks):
+            name = f"Person {person:04d}"
+            names.add(name)
+            start = time.perf_counter()
+            marked = writer.has(name)
+            local_checks.append(time.perf_counter() - start)
+            if not marked:
+                start = time.perf_counter()
+                count += writer.write(name)
+                local_writes.append(time.perf_counter() - start)
+            time.sleep(float(rng.exponential(0.0005)))
+        with lock:
+            checks.extend(local_checks)
+            writes.extend(local_writes)
+            attempted.update(names)
+            accepted[0] += count
+
+    threads = [threading.Thread(target=session, args=(seed * 1000 + i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    attendance_writer.close_all()
+    return {'attempted': attempted, 'checks': checks, 'writes': writes, 'accepted': accepted[0]}
+
+
+def bench_sessions(args):
+    """
+    Many concurrent sessions in several processes marking the same people
+
+    Checks that the day's file ends up with exactly one well-formed row per
+    person, and that exactly those writes were accepted, so nobody was told
+    they were marked without a row in the file. Reports the latency of
+    "already marked" checks and writes.
+    """
+    import concurrent.futures
+    import csv
+    import tempfile
+    from datetime import datetime
+    import attendance_writer
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        with concurrent.futures.ProcessPoolExecutor(args.processes) as pool:
+            results = list(pool.map(_session_worker, [directory] * args.processes,
+                                    [args.sessions] * args.processes, [args.people] * args.processes,
+                                    [args.marks] * args.processes, range(args.processes)))
+        elapsed = time.perf_counter() - start
+
+        path = attendance_writer.attendance_path(datetime.now().strftime("%d-%m-%Y"), directory)
+        with open(path, newline='') as f:
+            rows = list(csv.reader(f))
+
+    attempted = set().union(*(r['attempted'] for r in results))
+    names = [row[0] for row in rows[1:]]
+    malformed = [row for row in rows[1:] if len(row) != len(attendance_writer.HEADER)]
+    duplicates = len(names) - len(set(names))
+    accepted = sum(r['accepted'] for r in results)
+    checks = np.asarray([d for r in results for d in r['checks']])
+    writes = np.asarray([d for r in results for d in r['writes']])
+
+    total_sessions = args.processes * args.sessions
+    print(f"{total_sessions} sessions in {args.processes} processes, "
+          f"{total_sessions * args.marks} marks of {args.people} people in {elapsed:.2f}s")
+    print(f"{'':>22} {'p50 us':>8} {'p99 us':>8} {'max us':>8} {'count':>8}")
+    for label, durations in (('already-marked check', checks), ('write', writes)):
+        if len(durations):
+            print(f"{label:>22} {np.percentile(durations, 50) * 1e6:>8.1f} {np.percentile(durations, 99) * 1e6:>8.1f} "
+                  f"{durations.max() * 1e6:>8.1f} {len(durations):>8}")
+    print(f"Rows in file: {len(names)} for {len(attempted)} people; writes accepted {accepted}; "
+          f"duplicates {duplicates}; malformed rows {len(malformed)}; header rows "
+          f"{sum(row == attendance_writer.HEADER for row in rows)}")
+    ok = (rows[0] == attendance_writer.HEADER and not duplicates and not malformed
+          and set(names) == attempted and accepted == len(names))
+    print("PASS" if ok else "FAIL")
+    if not ok:
+        sys.exit(1)
+
+
+def _write_legacy_pickles(data_dir, people, captures, seed=0):
+    """
+    Write a names.pkl/faces_data.pkl pair as the pre-gallery app stored them
+    """
+    import os
+    import pickle
+
+    rng = np.random.default_rng(seed)
+    names = [f"Person {i:04d}" for i in range(people) for _ in range(captures)]
+    faces = rng.integers(0, 256, size=(len(names), 7500), dtype=np.uint8)
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(data_dir, 'names.pkl'), 'wb') as f:
+        pickle.dump(names, f)
+    with open(os.path.join(data_dir, 'faces_data.pkl'), 'wb') as f:
+        pickle.dump(faces, f)
+    return len(names)
+
+
+def _migration_worker(directory, start_at):
+    """
+    One process opening a fresh checkout's gallery at a given wall-clock time
+    """
+    import os
+    import gallery
+
+    # The legacy pickle paths are relative to the working directory
+    os.chdir(directory)
+    time.sleep(max(0.0, start_at - time.time()))
+    return gallery.ensure_gallery()
+
+
+def bench_migration(args):
+    """
+    Check that the legacy pickles are migrated into the gallery exactly once
+
+    Several processes open the gallery of a fresh checkout at the same
+    moment, as the app and the service do; the pickles have to be imported
+    once between them. Then every identity is deleted and the gallery is
+    compacted and opened again: it has to stay empty instead of importing
+    the pickles a second time.
+    """
+    import concurrent.futures
+    import os
+    import tempfile
+    import gallery
+    import gallery_admin
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        written = _write_legacy_pickles(os.path.join(directory, 'Data'), args.people, args.captures)
+        start = time.perf_counter()
+        with concurrent.futures.ProcessPoolExecutor(args.processes) as pool:
+            seen = list(pool.map(_migration_worker, [directory] * args.processes,
+                                 [time.time() + 1.0] * args.processes))
+        elapsed = time.perf_counter() - start - 1.0
+
+        os.chdir(directory)
+        try:
+            migrated = gallery.ensure_gallery()
+
+            for name in gallery_admin.list_identities():
+                gallery_admin.delete_identity(name, compact=False)
+            gallery.compact()
+            after_compact = gallery.ensure_gallery()
+            identities = list(gallery_admin.list_identities())
+        finally:
+            os.chdir(cwd)
+
+    print(f"{args.processes} processes starting together saw {sorted(set(seen))} rows "
+          f"after {elapsed * 1000:.0f} ms; gallery has {migrated} of {written} legacy rows")
+    print(f"After deleting every identity and compacting: {after_compact} rows, "
+          f"{len(identities)} identities")
+    ok = migrated == written and set(seen) == {written} and after_compact == 0 and not identities
+    print("PASS" if ok else "FAIL")
+    if not ok:
+        sys.exit(1)
+
+
+def _lecture_frames(seconds=120, fps=15, arrivals=6, size=(480, 640), seed=0):
+    """
+    Yield frames of a mostly static, slightly noisy room that people walk into
+
+    Each arrival is a gallery face sliding in from the side, pausing in front
+    of the camera for two seconds and leaving again.
+    """
+    faces, _ = _load_gallery()
+    rng = np.random.default_rng(seed)
+    height, width = size
+    face_size = 160
+    background = cv2.GaussianBlur(rng.integers(60, 180, size=(height, width, 3), dtype=np.uint8), (0, 0), 15)
+    visit = 5.0
+    starts = np.linspace(seconds / (arrivals + 1), seconds - visit, arrivals)
+    crops = [cv2.resize(np.asarray(faces[p]).reshape(50, 50, 3), (face_size, face_size))
+             for p in rng.integers(0, len(faces), size=arrivals)]
+    for i in range(int(seconds * fps)):
+        t = i / fps
+        frame = background.copy()
+        noise = rng.integers(-2, 3, size=(height, width, 1), dtype=np.int16)
+        frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+        for start, crop in zip(starts, crops):
+            if start <= t < start + visit:
+                # Slide in for 1.5 s, pause for 2 s, slide out for 1.5 s
+                phase = t - start
+                center = (width - face_size) // 2
+                offset = max(0.0, 1.5 - phase) - max(0.0, phase - 3.5)
+                x = int(np.clip(center - offset * center / 1.5, 0, width - face_size))
+                y = (height - face_size) // 2
+                frame[y:y + face_size, x:x + face_size] = crop
+        yield frame
+
+
+def _visits(recognitions, gap):
+    """
+    Split (time, name) recognitions into visits: (name, first, last) with gaps under gap seconds
+    """
+    visits = []
+    open_visits = {}
+    for t, name in sorted(recognitions):
+        current = open_visits.get(name)
+        if current is not None and t - current[2] <= gap:
+            current[2] = t
+        else:
+            current = open_visits[name] = [name, t, t]
+            visits.append(current)
+    return visits
+
+
+def _scheduled_run(frames, fps, model, scheduler, args):
+    """
+    Process a clip at video time through an optional scheduler
+
+    Returns:
+        tuple: (CPU seconds, frames processed, [(time, name)] recognitions)
+    """
+    import pipeline
+    import recognizer
+
+    processor = pipeline.FaceProcessor(model, identity_ttl=args.identity_ttl, downscale=args.downscale,
+                                       detect_every=args.detect_every)
+    cpu = 0.0
+    processed = 0
+    recognitions = []
+    for i, frame in enumerate(frames):
+        t = i / fps
+        start = time.process_time()
+        if scheduler is None or scheduler.should_process(frame, t):
+            frame_rgb, boxes, names, _ = processor(frame)
+            processed += 1
+            recognitions.extend((t, name) for name in names if name != recognizer.UNKNOWN)
+        cpu += time.process_time() - start
+    return cpu, processed, recognitions
+
+
+def bench_motion(args):
+    """
+    CPU per hour and missed arrivals with motion-gated scheduling vs every frame
+
+    Arrivals are taken from the every-frame run: a visit counts as missed if
+    the scheduled run never recognizes that person during it.
+    """
+    import os
+    import tempfile
+
+    import gallery
+    import model_store
+    import motion
+
+    if args.video:
+        cap = cv2.VideoCapture(args.video)
+        fps = cap.get(cv2.CAP_PROP_FPS) or args.fps
+        cap.release()
+        clip = lambda: _load_frames(args.video, args.frames)
+    else:
+        fps = args.fps
+        clip = lambda: _lecture_frames(args.seconds, fps, args.arrivals)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        gallery_dir = os.path.join(tmp, 'gallery')
+        faces, labels = _load_gallery()
+        gallery.append_faces(faces, labels, gallery_dir)
+        model = model_store.ModelStore(gallery_dir).get()
+
+        runs = [('every frame', None)]
+        for config in args.configs:
+            min_fps, max_fps = (float(v) for v in config.split(':'))
+            runs.append((f"{min_fps:g}-{max_fps:g} fps",
+                         lambda min_fps=min_fps, max_fps=max_fps: motion.AdaptiveScheduler(
+                             min_fps, max_fps, motion_threshold=args.threshold)))
+
+        results = []
+        for label, make_scheduler in runs:
+            cpu, processed, recognitions = _scheduled_run(clip(), fps, model,
+                                                          make_scheduler() if make_scheduler else None, args)
+            results.append((label, cpu, processed, recognitions))
+
+    frames = results[0][2]
+    duration = frames / fps
+    baseline_visits = _visits(results[0][3], args.gap)
+    print(f"Clip: {frames} frames, {duration:.0f} s at {fps:g} fps; "
+          f"{len(baseline_visits)} arrivals recognized when processing every frame")
+    print(f"{'schedule':>14} {'processed':>10} {'CPU s/hour':>11} {'% core':>7} {'missed':>7} {'delay p50 s':>12} {'max s':>6}")
+    for label, cpu, processed, recognitions in results:
+        missed, delays = 0, []
+        for name, first, last in baseline_visits:
+            seen = [t for t, n in recognitions if n == name and first - 1.0 / fps <= t <= last + args.gap]
+            if seen:
+                delays.append(max(0.0, min(seen) - first))
+            else:
+                missed += 1
+        delay_p50 = f"{np.median(delays):.2f}" if delays else "-"
+        delay_max = f"{max(delays):.2f}" if delays else "-"
+        print(f"{label:>14} {processed:>10} {cpu / duration * 3600:>11.0f} {cpu / duration:>7.1%} "
+              f"{missed:>7} {delay_p50:>12} {delay_max:>6}")
+
+
+def bench_camera(args):
+    """
+    Time to first frame on page visits with the shared camera and cascade vs opening them per visit
+
+    Each visit loads a face detector, opens the camera, waits for the first
+    frame, reads --frames more and lets go, then the next visit follows
+    --gap seconds later, like a user switching between pages.
+    """
+    import pipeline
+    import resources
+
+    opens = []
+    if args.source is not None:
+        def opener(source):
+            opens.append(source)
+            return pipeline.open_source(source)
+        print(f"Source: {args.source}")
+    else:
+        frames = _synthetic_frames(60)
+
+        def opener(source):
+            opens.append(source)
+            time.sleep(args.open_delay)
+            return pipeline.SyntheticSource(frames, fps=args.fps, loop=True)
+        print(f"Source: synthetic {args.fps:g} fps camera that takes {args.open_delay:g} s to open")
+
+    def per_visit():
+        resources.load_cascade(args.cascade)
+        return opener(args.source)
+
+    reader = resources.CameraReader(args.source, idle_timeout=args.idle_timeout, opener=opener)
+
+    def shared():
+        import detection
+        detection.FaceDetector(args.cascade)
+        return reader.subscribe()
+
+    print(f"{'mode':>10} {'visits':>7} {'opens':>6} {'first p50 ms':>13} {'p90 ms':>8} {'max ms':>8} {'failed':>7}")
+    for label, visit in (('per visit', per_visit), ('shared', shared)):
+        del opens[:]
+        firsts, failed = [], 0
+        for _ in range(args.visits):
+            start = time.perf_counter()
+            cap = visit()
+            ok, _ = cap.read()
+            if ok:
+                firsts.append(time.perf_counter() - start)
+                for _ in range(args.frames):
+                    cap.read()
+            else:
+                failed += 1
+            cap.release()
+            time.sleep(args.gap)
+        firsts = np.asarray(firsts) * 1000 if firsts else np.zeros(1)
+        print(f"{label:>10} {args.visits:>7} {len(opens):>6} {np.percentile(firsts, 50):>13.1f} "
+              f"{np.percentile(firsts, 90):>8.1f} {firsts.max():>8.1f} {failed:>7}")
+    reader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Smart Attendance System benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    recognition = subparsers.add_parser('recognition', help="Per-face vs batch recognition")
+    recognition.add_argument('--faces', type=int, nargs='+', default=[1, 10, 50],
+                             help="Faces per frame to benchmark")
+    recognition.add_argument('--repeat', type=int, default=30, help="Timed runs per setting")
+    recognition.add_argument('--synthetic', type=int, default=0,
+                             help="Use a random gallery of this many captures")
+    recognition.set_defaults(func=bench_recognition)
+
+    detection = subparsers.add_parser('detection', help="Downscaled / ROI-tracked detection vs full frame")
+    detection.add_argument('--video', help="Recorded clip to replay (default: synthetic frames)")
+    detection.add_argument('--frames', type=int, default=300, help="Maximum frames to use")
+    detection.add_argument('--synthetic-faces', type=int, default=2,
+                           help="Faces per synthetic frame when no video is given")
+    detection.add_argument('--configs', nargs='+', default=['0.5:1', '0.5:3', '0.25:1', '0.25:3'],
+                           help="Detector settings to compare, as downscale:detect_every")
+    detection.set_defaults(func=bench_detection)
+
+    service = subparsers.add_parser('service', help="Multi-source service throughput")
+    service.add_argument('--video', help="Recorded clip used for every source (default: synthetic)")
+    service.add_argument('--frames', type=int, default=200, help="Frames in the synthetic clip")
+    service.add_argument('--max-sources', type=int, default=4, help="Largest number of sources to run")
+    service.set_defaults(func=bench_service)
+
+    feature = subparsers.add_parser('features', help="Feature extractors vs raw pixel vectors")
+    feature.add_argument('--dims', type=int, nargs='+', default=[64, 128], help="PCA sizes to compare")
+    feature.add_argument('--dnn-model', help="Also compare an OpenCV DNN embedding model file")
+    feature.add_argument('--batch', type=int, default=10, help="Faces per timed recognition call")
+    feature.add_argument('--repeat', type=int, default=30, help="Timed runs per extractor")
+    feature.add_argument('--synthetic', type=int, default=0,
+                         help="Use a random gallery of this many captures")
+    feature.add_argument('--folds', type=int, default=5,
+                         help="Folds for the PCA accuracy, each fitted without the faces it classifies")
+    feature.set_defaults(func=bench_features)
+
+    index = subparsers.add_parser('index', help="IVF index recall and latency vs exact search")
+    index.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                       help="Gallery sizes to benchmark")
+    index.add_argument('--dim', type=int, default=128, help="Embedding dimensions (e.g. PCA-128)")
+    index.add_argument('--nlist', type=int, help="IVF buckets (default about 4 * sqrt(N))")
+    index.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16], help="Buckets scanned per query")
+    index.add_argument('--batch', type=int, default=10, help="Faces per timed recognition call")
+    index.add_argument('--repeat', type=int, default=20, help="Timed runs per setting")
+    index.set_defaults(func=bench_index)
+
+    replay = subparsers.add_parser('replay', help="Per-stage latency of the attendance loop on recorded frames")
+    replay.add_argument('--video', help="Recorded clip to replay (default: synthetic frames)")
+    replay.add_argument('--frames', type=int, default=300, help="Maximum frames to use")
+    replay.add_argument('--synthetic-faces', type=int, default=2,
+                        help="Faces per synthetic frame when no video is given")
+    replay.add_argument('--synthetic', type=int, default=0,
+                        help="Recognize against a random gallery of this many captures")
+    replay.add_argument('--downscale', type=float, default=0.5, help="Detection scale")
+    replay.add_argument('--detect-every', type=int, default=2, help="Full-frame detection interval")
+    replay.add_argument('--identity-ttl', type=float, default=5.0,
+                        help="Seconds to reuse a tracked face's identity (0 = recognize every frame)")
+    replay.add_argument('--json', help="Write the results to this JSON file")
+    replay.add_argument('--baseline', help="Earlier --json output to compare against")
+    replay.set_defaults(func=bench_replay)
+
+    startup = subparsers.add_parser('startup', help="Import times and app cold start / page switch latency")
+    startup.add_argument('--modules', nargs='+',
+                         default=['app', 'metrics', 'service', 'attendance_store', 'Add_faces',
+                                  'tempCodeRunnerFile', 'model_store'],
+                         help="Modules to import with -X importtime")
+    startup.add_argument('--top', type=int, default=5, help="Heaviest imports listed per module")
+    startup.add_argument('--no-pages', action='store_true', help="Skip timing the app's pages")
+    startup.set_defaults(func=bench_startup)
+
+    preview = subparsers.add_parser('preview', help="Preview bandwidth and encode time per JPEG setting")
+    preview.add_argument('--video', help="Recorded clip to encode (default: synthetic frames)")
+    preview.add_argument('--frames', type=int, default=100, help="Maximum frames to use")
+    preview.add_argument('--configs', nargs='+', default=['640:70', '480:60', '320:50'],
+                         help="Preview settings to compare, as max_width:jpeg_quality")
+    preview.add_argument('--fps', type=float, default=10.0, help="Preview frame rate cap")
+    preview.set_defaults(func=bench_preview)
+
+    sessions = subparsers.add_parser('sessions', help="Stress test concurrent sessions marking the same people")
+    sessions.add_argument('--processes', type=int, default=4, help="Processes, each with its own shared writer")
+    sessions.add_argument('--sessions', type=int, default=8, help="Simulated sessions (threads) per process")
+    sessions.add_argument('--people', type=int, default=200, help="Distinct people being marked")
+    sessions.add_argument('--marks', type=int, default=500, help="Recognitions per session")
+    sessions.set_defaults(func=bench_sessions)
+
+    motion = subparsers.add_parser('motion', help="CPU per hour and missed arrivals with motion-gated scheduling")
+    motion.add_argument('--video', help="Recorded clip (default: synthetic lecture with arrivals)")
+    motion.add_argument('--frames', type=int, default=100000, help="Maximum frames read from --video")
+    motion.add_argument('--fps', type=float, default=15.0, help="Frame rate of the synthetic clip")
+    motion.add_argument('--seconds', type=float, default=120.0, help="Length of the synthetic clip")
+    motion.add_argument('--arrivals', type=int, default=6, help="People arriving in the synthetic clip")
+    motion.add_argument('--configs', nargs='+', default=['1:15', '0.5:10', '1:0'],
+                        help="Schedules to compare, as min_fps:max_fps (max 0 = every frame when active)")
+    motion.add_argument('--threshold', type=float, default=0.01, help="Changed fraction that counts as motion")
+    motion.add_argument('--gap', type=float, default=2.0, help="Seconds apart that split one arrival from the next")
+    motion.add_argument('--downscale', type=float, default=0.5, help="Detection scale")
+    motion.add_argument('--detect-every', type=int, default=2, help="Full-frame detection interval")
+    motion.add_argument('--identity-ttl', type=float, default=5.0, help="Seconds to reuse a tracked face's identity")
+    motion.set_defaults(func=bench_motion)
+
+    migration = subparsers.add_parser('migration', help="Check the legacy pickles are migrated only once")
+    migration.add_argument('--people', type=int, default=10, help="Identities in the synthetic pickles")
+    migration.add_argument('--captures', type=int, default=5, help="Captures per identity")
+    migration.add_argument('--processes', type=int, default=4, help="Processes opening the fresh gallery at once")
+    migration.set_defaults(func=bench_migration)
+
+    camera = subparsers.add_parser('camera', help="Time to first frame on page switches with the shared camera")
+    camera.add_argument('--source', help="Camera index or video (default: synthetic camera)")
+    camera.add_argument('--visits', type=int, default=10, help="Page visits to simulate")
+    camera.add_argument('--frames', type=int, default=30, help="Frames read per visit after the first")
+    camera.add_argument('--gap', type=float, default=1.0, help="Seconds between visits")
+    camera.add_argument('--idle-timeout', type=float, default=15.0,
+                        help="Seconds the shared camera stays open without subscribers")
+    camera.add_argument('--open-delay', type=float, default=0.8,
+                        help="Seconds the synthetic camera takes to open")
+    camera.add_argument('--fps', type=float, default=30.0, help="Frame rate of the synthetic camera")
+    camera.add_argument('--cascade', default='Data/haarcascade_frontalface_default.xml',
+                        help="Haar cascade loaded on each visit")
+    camera.set_defaults(func=bench_camera)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Haar cascade face detection with downscaling and ROI tracking
+
+Running detectMultiScale on every full-resolution frame dominates CPU time.
+FaceDetector runs the cascade on a downscaled grayscale frame, optionally
+only every Nth frame, and in between re-detects each known face only inside
+a small region around its last box. Boxes are always returned in
+full-resolution frame coordinates so crops for recognition keep their detail.
+"""
+import cv2
+
+import resources
+
+CASCADE_PATH = resources.CASCADE_PATH
+
+
+def iou(a, b):
+    """
+    Intersection over union of two (x, y, w, h) boxes
+    """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceDetector:
+    """
+    Configurable face detector
+
+    Args:
+        cascade_path (str): Haar cascade file
+        downscale (float): Factor the frame is resized by before detection (1.0 = full size)
+        detect_every (int): Run a full-frame detection every N frames; frames in
+            between only search around the faces already being tracked
+        roi_margin (float): How far around a tracked box to search, as a
+            fraction of the box size
+        max_misses (int): Drop a tracked box after this many frames without
+            a re-detection
+        scale_factor (float): detectMultiScale scaleFactor
+        min_neighbors (int): detectMultiScale minNeighbors
+    """
+
+    def __init__(self, cascade_path=CASCADE_PATH, downscale=1.0, detect_every=1, roi_margin=0.5,
+                 max_misses=2, scale_factor=1.3, min_neighbors=5):
+        # Parsed cascades are pooled in resources and borrowed per call, so
+        # detectors are cheap to create and safe to use from any thread
+        self.cascade_path = cascade_path
+        resources.warm_cascade(cascade_path)
+        self.downscale = downscale
+        self.detect_every = max(1, int(detect_every))
+        self.roi_margin = roi_margin
+        self.max_misses = max_misses
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+        self.frame_index = 0
+        self.full_detections = 0
+        self.roi_detections = 0
+        self._tracks = []
+
+    def reset(self):
+        """
+        Forget tracked boxes so the next frame gets a full detection
+        """
+        self._tracks = []
+        self.frame_index = 0
+
+    def _cascade(self, gray):
+        with resources.cascade(self.cascade_path) as cascade:
+            return cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors)
+
+    def _small_gray(self, frame):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.downscale == 1.0:
+            return gray
+        return cv2.resize(gray, None, fx=self.downscale, fy=self.downscale, interpolation=cv2.INTER_AREA)
+
+    def _to_full(self, box, offset, frame_shape):
+        x, y, w, h = (int(round(v / self.downscale)) for v in box)
+        x += offset[0]
+        y += offset[1]
+        x = max(0, min(x, frame_shape[1] - 1))
+        y = max(0, min(y, frame_shape[0] - 1))
+        return x, y, min(w, frame_shape[1] - x), min(h, frame_shape[0] - y)
+
+    def _detect_full(self, frame, small):
+        self.full_detections += 1
+        return [self._to_full(box, (0, 0), frame.shape) for box in self._cascade(small)]
+
+    def _detect_roi(self, frame, small, box):
+        """
+        Re-detect a tracked face inside an expanded region around its box
+        """
+        self.roi_detections += 1
+        x, y, w, h = box
+        mx, my = int(w * self.roi_margin), int(h * self.roi_margin)
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        x1, y1 = min(frame.shape[1], x + w + mx), min(frame.shape[0], y + h + my)
+
+        sx0, sy0 = int(x0 * self.downscale), int(y0 * self.downscale)
+        sx1, sy1 = int(x1 * self.downscale), int(y1 * self.downscale)
+        found = self._cascade(small[sy0:sy1, sx0:sx1])
+        if len(found) == 0:
+            return None
+
+        offset = (int(round(sx0 / self.downscale)), int(round(sy0 / self.downscale)))
+        candidates = [self._to_full(b, offset, frame.shape) for b in found]
+        return max(candidates, key=lambda b: iou(b, box))
+
+    def detect(self, frame):
+        """
+        Detect faces in a BGR (or grayscale) frame
+
+        Returns:
+            list: (x, y, w, h) boxes in full-resolution coordinates
+        """
+        small = self._small_gray(frame)
+        full_pass = self.frame_index % self.detect_every == 0 or not self._tracks
+        self.frame_index += 1
+
+        if full_pass:
+            boxes = self._detect_full(frame, small)
+            self._tracks = [[box, 0] for box in boxes]
+            return boxes
+
+        boxes = []
+        for track in self._tracks:
+            found = self._detect_roi(frame, small, track[0])
+            if found is None:
+                track[1] += 1
+                if track[1] <= self.max_misses:
+                    boxes.append(track[0])
+            else:
+                track[0], track[1] = found, 0
+                boxes.append(found)
+        self._tracks = [track for track in self._tracks if track[1] <= self.max_misses]
+        return boxes
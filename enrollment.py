@@ -0,0 +1,332 @@
+"""
+Quality-gated face enrollment
+
+Instead of keeping every 5th detected face, enrollment grabs frames at the
+camera's full rate for a short time budget, scores each face crop and keeps
+the best few captures that are not near-duplicates of each other. Crops are
+rejected when they are too small, too dark or bright, or too blurry
+(variance of the Laplacian). The chosen captures are written with one
+gallery append.
+
+A directory of photos can be enrolled in bulk, one folder per person,
+processed in parallel worker processes:
+
+    python enrollment.py import photos/ --per-person 10
+    photos/
+        Alice/  img1.jpg img2.jpg ...
+        Bob/    ...
+"""
+import argparse
+import concurrent.futures
+import os
+import time
+
+import cv2
+import numpy as np
+
+import gallery
+import recognizer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+MIN_FACE_SIZE = 60
+MIN_SHARPNESS = 20.0
+MIN_BRIGHTNESS = 40.0
+MAX_BRIGHTNESS = 215.0
+MIN_DIFFERENCE = 0.04
+
+# Sharpness is measured on crops resized to this size so that it does not
+# depend on how large the face is in the frame
+_SHARPNESS_SIZE = (100, 100)
+
+
+class Candidate:
+    """
+    One scored face crop
+
+    Attributes:
+        vector (np.ndarray): (FACE_DIM,) uint8 face vector, as stored in the gallery
+        box (tuple): (x, y, w, h) in the source frame
+        sharpness (float): Variance of the Laplacian of the grayscale crop
+        brightness (float): Mean grayscale level, 0-255
+        score (float): Overall quality, higher is better
+        rejected (str): Why the crop failed a quality gate, or None
+    """
+
+    def __init__(self, vector, box, sharpness, brightness, score, rejected=None):
+        self.vector = vector
+        self.box = box
+        self.sharpness = sharpness
+        self.brightness = brightness
+        self.score = score
+        self.rejected = rejected
+
+
+def score_crop(frame, box, min_size=MIN_FACE_SIZE, min_sharpness=MIN_SHARPNESS,
+               min_brightness=MIN_BRIGHTNESS, max_brightness=MAX_BRIGHTNESS):
+    """
+    Score the face in box for enrollment
+
+    Returns:
+        Candidate: The crop with its quality measures; rejected is set if it
+        fails the size, brightness or sharpness gate
+    """
+    x, y, w, h = box
+    crop = frame[y:y+h, x:x+w]
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    sharpness = float(cv2.Laplacian(cv2.resize(gray, _SHARPNESS_SIZE), cv2.CV_64F).var())
+    brightness = float(gray.mean())
+    vector = recognizer.crops_from_frame(frame, [box])[0]
+
+    rejected = None
+    if min(w, h) < min_size:
+        rejected = 'too small'
+    elif not min_brightness <= brightness <= max_brightness:
+        rejected = 'too dark' if brightness < min_brightness else 'too bright'
+    elif sharpness < min_sharpness:
+        rejected = 'blurry'
+
+    # Prefer sharp, evenly lit, large faces; log damps very high sharpness from noise
+    lighting = 1.0 - 0.5 * abs(brightness - 128) / 128
+    size = min(1.0, min(w, h) / (2 * min_size))
+    score = float(np.log1p(sharpness) * lighting * size)
+    return Candidate(vector, tuple(int(v) for v in box), sharpness, brightness, score, rejected)
+
+
+def _difference(a, b):
+    """
+    RMS difference of two face vectors as a fraction of the full 0-255 range
+    """
+    diff = a.astype(np.float32) - b.astype(np.float32)
+    return float(np.sqrt(np.mean(diff * diff)) / 255)
+
+
+def select_diverse(candidates, count, min_difference=MIN_DIFFERENCE):
+    """
+    Pick up to count high-scoring candidates that are not near-duplicates
+
+    Candidates are taken best first, skipping any within min_difference of
+    one already chosen. If that leaves too few, the remaining slots go to
+    the candidates least similar to those chosen, never to exact copies.
+
+    Returns:
+        list: Chosen candidates, best first
+    """
+    ranked = sorted(candidates, key=lambda c: -c.score)
+    chosen, skipped = [], []
+    for candidate in ranked:
+        if len(chosen) == count:
+            break
+        if all(_difference(candidate.vector, c.vector) >= min_difference for c in chosen):
+            chosen.append(candidate)
+        else:
+            skipped.append(candidate)
+
+    while len(chosen) < count and skipped:
+        separation = [min(_difference(s.vector, c.vector) for c in chosen) for s in skipped]
+        best = int(np.argmax(separation))
+        if separation[best] == 0:
+            break
+        chosen.append(skipped.pop(best))
+    return chosen
+
+
+class BurstEnroller:
+    """
+    Collects scored candidates from a burst of frames
+
+    Only the largest face in each frame is considered, since one person
+    enrolls at a time.
+
+    Args:
+        detector (detection.FaceDetector): Used when offer() is not given boxes
+        count (int): Captures to keep
+        time_budget (float): Seconds to collect for at most
+        max_candidates (int): Passing candidates kept; the worst are dropped beyond this
+        min_difference (float): Near-duplicate threshold for select_diverse
+        **gates: min_size, min_sharpness, min_brightness, max_brightness for score_crop
+    """
+
+    def __init__(self, detector, count=5, time_budget=5.0, max_candidates=60,
+                 min_difference=MIN_DIFFERENCE, **gates):
+        self.detector = detector
+        self.count = count
+        self.time_budget = time_budget
+        self.max_candidates = max_candidates
+        self.min_difference = min_difference
+        self.gates = gates
+        self.candidates = []
+        self.frames = 0
+        self.rejections = {}
+        self.started = None
+
+    def offer(self, frame, boxes=None):
+        """
+        Score the largest face in a frame
+
+        Returns:
+            Candidate or None if no face was found
+        """
+        if self.started is None:
+            self.started = time.monotonic()
+        self.frames += 1
+        if boxes is None:
+            boxes = self.detector.detect(frame)
+        if len(boxes) == 0:
+            self.rejections['no face'] = self.rejections.get('no face', 0) + 1
+            return None
+
+        box = max(boxes, key=lambda b: b[2] * b[3])
+        candidate = score_crop(frame, box, **self.gates)
+        if candidate.rejected:
+            self.rejections[candidate.rejected] = self.rejections.get(candidate.rejected, 0) + 1
+            return candidate
+
+        self.candidates.append(candidate)
+        if len(self.candidates) > self.max_candidates:
+            self.candidates.remove(min(self.candidates, key=lambda c: c.score))
+        return candidate
+
+    def elapsed(self):
+        return 0.0 if self.started is None else time.monotonic() - self.started
+
+    @property
+    def done(self):
+        """
+        True once the time budget is used up, or the pool is full well before it
+        """
+        return self.elapsed() >= self.time_budget or len(self.candidates) >= self.max_candidates
+
+    def select(self):
+        return select_diverse(self.candidates, self.count, self.min_difference)
+
+
+def enroll(name, candidates, gallery_dir=gallery.GALLERY_DIR, replace=False):
+    """
+    Store chosen captures for one person with a single gallery append
+
+    Args:
+        replace (bool): Delete the person's earlier captures afterwards
+
+    Returns:
+        int: Number of captures stored
+    """
+    if not candidates:
+        return 0
+    vectors = np.stack([c.vector for c in candidates])
+    if replace:
+        import gallery_admin
+        gallery_admin.replace_identity(name, vectors, gallery_dir)
+    else:
+        gallery.append_faces(vectors, name, gallery_dir)
+    return len(candidates)
+
+
+def _read_image(path, max_side=1024):
+    """
+    Read a photo, shrinking it so its longer side is at most max_side
+    """
+    image = cv2.imread(path)
+    if image is None:
+        return None
+    scale = max_side / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+
+def _person_captures(name, paths, count, options):
+    """
+    Worker process: score every photo of one person and pick the best captures
+
+    Returns:
+        tuple: (name, (k, FACE_DIM) uint8 vectors, report dict)
+    """
+    import detection
+
+    detector = detection.FaceDetector(options.get('cascade_path', detection.CASCADE_PATH))
+    enroller = BurstEnroller(detector, count=count, time_budget=float('inf'), max_candidates=len(paths),
+                             min_difference=options.get('min_difference', MIN_DIFFERENCE),
+                             **options.get('gates', {}))
+    unreadable = 0
+    for path in paths:
+        image = _read_image(path)
+        if image is None:
+            unreadable += 1
+            continue
+        detector.reset()
+        enroller.offer(image)
+
+    chosen = enroller.select()
+    vectors = np.stack([c.vector for c in chosen]) if chosen else np.empty((0, gallery.FACE_DIM), dtype=np.uint8)
+    report = {'photos': len(paths), 'usable': len(enroller.candidates), 'kept': len(chosen),
+              'unreadable': unreadable, 'rejected': enroller.rejections}
+    return name, vectors, report
+
+
+def import_directory(root, count=10, workers=None, gallery_dir=gallery.GALLERY_DIR, **options):
+    """
+    Enroll every person folder under root, in parallel
+
+    Each person's photos are scored in a worker process; all chosen captures
+    are then written with one gallery append.
+
+    Args:
+        root (str): Directory with one sub-directory of photos per person
+        count (int): Captures kept per person at most
+        workers (int, optional): Worker processes, default os.cpu_count()
+        **options: cascade_path, min_difference, gates (dict for score_crop)
+
+    Returns:
+        dict: Per-person report of photos, usable crops, kept captures and rejections
+    """
+    people = {}
+    for name in sorted(os.listdir(root)):
+        folder = os.path.join(root, name)
+        if not os.path.isdir(folder):
+            continue
+        paths = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                 if f.lower().endswith(IMAGE_EXTENSIONS)]
+        if paths:
+            people[name] = paths
+
+    vectors, names, reports = [], [], {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_person_captures, name, paths, count, options) for name, paths in people.items()]
+        for future in concurrent.futures.as_completed(futures):
+            name, person_vectors, report = future.result()
+            reports[name] = report
+            vectors.append(person_vectors)
+            names.extend([name] * len(person_vectors))
+
+    if names:
+        gallery.append_faces(np.concatenate(vectors), names, gallery_dir)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enroll faces into the gallery")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help="Enroll a directory with one photo folder per person")
+    import_parser.add_argument('root', help="Directory of person folders")
+    import_parser.add_argument('--per-person', type=int, default=10, help="Captures kept per person at most")
+    import_parser.add_argument('--workers', type=int, help="Worker processes (default: all CPUs)")
+    import_parser.add_argument('--min-size', type=int, default=MIN_FACE_SIZE, help="Smallest face side in pixels")
+    import_parser.add_argument('--min-sharpness', type=float, default=MIN_SHARPNESS,
+                               help="Smallest Laplacian variance accepted")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    reports = import_directory(args.root, args.per_person, args.workers,
+                               gates={'min_size': args.min_size, 'min_sharpness': args.min_sharpness})
+    for name, report in sorted(reports.items()):
+        rejected = ", ".join(f"{reason} {n}" for reason, n in sorted(report['rejected'].items()))
+        print(f"{name}: kept {report['kept']} of {report['photos']} photos"
+              + (f" (rejected: {rejected})" if rejected else "")
+              + (f", {report['unreadable']} unreadable" if report['unreadable'] else ""))
+    kept = sum(report['kept'] for report in reports.values())
+    print(f"Enrolled {kept} captures of {len(reports)} people in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
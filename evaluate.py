@@ -0,0 +1,448 @@
+"""
+Offline evaluation of recognition on the stored gallery
+
+Calibrate the open-set threshold:
+    python evaluate.py calibrate [--mode knn|centroid] [--far 0.01] [--dry-run]
+
+Compare recognizer settings:
+    python evaluate.py sweep [--k 1 3 5] [--metric euclidean cosine] [--crop-size 50 32]
+                             [--extractor pixels pca:128] [--folds 5] [--min-accuracy 0.95]
+                             [--json sweep.json]
+
+Each capture is scored twice, in the gallery's current feature space:
+
+    genuine   distance to the closest other capture of the same person
+              (knn) or to that person's centroid without the capture (centroid)
+    impostor  distance to the closest capture or centroid of anyone else,
+              i.e. the best match the face would get if the person were not
+              registered
+
+The threshold is the impostor distance quantile that lets --far of
+strangers through. It is saved in Data/gallery/recognition.json and used by
+every recognizer built from the gallery from then on.
+
+The sweep runs leave-one-capture-out cross-validation: every capture is
+classified by a k-NN vote over all the others, for each combination of k,
+distance metric, crop size and feature extractor. Crop sizes below the
+stored 50x50 are simulated by resizing the stored crops. PCA is fitted
+separately for each of --folds folds of the held-out captures, without
+that fold's captures, so no face is classified in a projection it helped
+shape; latency and memory use a fit on all captures, as migrate does. The
+cross-validation is split over worker processes; per-face latency (feature extraction plus matching
+against the whole gallery, one face at a time) is then timed in the main
+process so the workers do not distort it. Detection settings are measured
+by `python benchmark.py detection`, since the gallery only holds crops.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import tempfile
+import time
+
+import cv2
+
+import numpy as np
+
+import features
+import gallery
+import model_store
+
+
+def _gallery_features(gallery_dir=gallery.GALLERY_DIR):
+    """
+    Feature vectors and integer labels of every stored capture
+    """
+    if gallery.ensure_gallery(gallery_dir) == 0:
+        raise SystemExit("No face data found. Register faces first.")
+    snapshot = gallery.open_gallery(gallery_dir)
+    extractor = features.load_extractor(gallery_dir)
+    vectors = np.asarray(features.gallery_vectors(snapshot, extractor), dtype=np.float32)
+    return vectors, np.asarray(snapshot.label_ids), snapshot.identities, extractor
+
+
+def _sq_distances(queries, vectors, vector_norms):
+    sq_dist = vector_norms[None, :] - 2 * queries @ vectors.T
+    sq_dist += np.einsum('ij,ij->i', queries, queries)[:, None]
+    return np.maximum(sq_dist, 0, out=sq_dist)
+
+
+def knn_scores(vectors, label_ids, chunk_rows=1024):
+    """
+    Leave-one-out genuine and impostor distances against individual captures
+
+    Returns:
+        tuple: (genuine, impostor) arrays; genuine only covers captures whose
+        person has at least one other capture
+    """
+    norms = np.einsum('ij,ij->i', vectors, vectors)
+    genuine, impostor = [], []
+    for start in range(0, len(vectors), chunk_rows):
+        rows = np.arange(start, min(start + chunk_rows, len(vectors)))
+        sq_dist = _sq_distances(vectors[rows], vectors, norms)
+        sq_dist[np.arange(len(rows)), rows] = np.inf
+        same = label_ids[rows][:, None] == label_ids[None, :]
+        genuine.append(np.where(same, sq_dist, np.inf).min(axis=1))
+        impostor.append(np.where(same, np.inf, sq_dist).min(axis=1))
+    genuine, impostor = np.sqrt(np.concatenate(genuine)), np.sqrt(np.concatenate(impostor))
+    return genuine[np.isfinite(genuine)], impostor[np.isfinite(impostor)]
+
+
+def centroid_scores(vectors, label_ids, chunk_rows=1024):
+    """
+    Leave-one-out genuine and impostor distances against identity centroids
+    """
+    n_ids = int(label_ids.max()) + 1
+    sums = np.zeros((n_ids, vectors.shape[1]))
+    np.add.at(sums, label_ids, vectors)
+    counts = np.bincount(label_ids, minlength=n_ids)
+    centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+    norms = np.einsum('ij,ij->i', centroids, centroids)
+    norms[counts == 0] = np.inf
+
+    genuine, impostor = [], []
+    for start in range(0, len(vectors), chunk_rows):
+        block = vectors[start:start + chunk_rows]
+        ids = label_ids[start:start + chunk_rows]
+        sq_dist = _sq_distances(block, centroids, norms)
+        sq_dist[np.arange(len(block)), ids] = np.inf
+        impostor.append(np.sqrt(sq_dist.min(axis=1)))
+
+        # Own centroid with this capture removed
+        others = counts[ids] - 1
+        own = (sums[ids] - block) / np.maximum(others, 1)[:, None]
+        distance = np.linalg.norm(block - own, axis=1)
+        genuine.append(distance[others > 0])
+    impostor = np.concatenate(impostor)
+    return np.concatenate(genuine), impostor[np.isfinite(impostor)]
+
+
+def calibrate(mode=model_store.MODE_KNN, false_accept_rate=0.01, gallery_dir=gallery.GALLERY_DIR):
+    """
+    Pick the open-set threshold for a gallery
+
+    Returns:
+        dict: Calibration, in the format saved to recognition.json
+    """
+    vectors, label_ids, identities, extractor = _gallery_features(gallery_dir)
+    if len(np.unique(label_ids)) < 2:
+        raise SystemExit("At least two registered people are needed to calibrate")
+    scores = centroid_scores if mode == model_store.MODE_CENTROID else knn_scores
+    genuine, impostor = scores(vectors, label_ids)
+    threshold = float(np.quantile(impostor, false_accept_rate))
+    return {
+        'mode': mode,
+        'threshold': threshold,
+        'extractor': extractor.name,
+        'dim': int(extractor.dim),
+        'false_accept_rate': float(np.mean(impostor <= threshold)),
+        'genuine_accept_rate': float(np.mean(genuine <= threshold)) if len(genuine) else None,
+        'captures': int(len(vectors)),
+        'identities': int(len(np.unique(label_ids))),
+        'calibrated_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+METRICS = ('euclidean', 'cosine', 'manhattan')
+
+
+def resize_crops(faces, side, chunk_rows=4096):
+    """
+    Resize stored face vectors to side x side crops
+
+    Returns:
+        np.ndarray: (n, side * side * 3) uint8 face vectors
+    """
+    if side == gallery.FACE_SIZE[0]:
+        return np.asarray(faces)
+    if side > gallery.FACE_SIZE[0]:
+        raise ValueError(f"Crops are stored at {gallery.FACE_SIZE[0]}x{gallery.FACE_SIZE[1]}; "
+                         f"cannot evaluate {side}x{side}")
+    out = np.empty((len(faces), side * side * 3), dtype=np.uint8)
+    for start in range(0, len(faces), chunk_rows):
+        images = np.asarray(faces[start:start + chunk_rows]).reshape((-1,) + features.FACE_SHAPE)
+        for i, image in enumerate(images):
+            out[start + i] = cv2.resize(image, (side, side), interpolation=cv2.INTER_AREA).reshape(-1)
+    return out
+
+
+def _needs_fit(spec):
+    return spec.partition(':')[0] == features.PCAExtractor.name
+
+
+def _create_extractor(spec, crops):
+    """
+    Extractor for a sweep spec such as 'pixels', 'pca:64' or 'dnn:model.t7', fitted on crops
+    """
+    kind, _, option = spec.partition(':')
+    if kind == features.PCAExtractor.name:
+        return features.PCAExtractor(min(int(option or 128), len(crops))).fit(crops)
+    if kind == features.DnnExtractor.name:
+        return features.create_extractor(kind, model_path=option)
+    return features.create_extractor(kind)
+
+
+def _extractor_bytes(extractor):
+    return sum(np.asarray(value).nbytes for value in extractor.state().values())
+
+
+def _transform(extractor, crops, chunk_rows=4096):
+    return np.concatenate([np.asarray(extractor.transform(crops[start:start + chunk_rows]), dtype=np.float32)
+                           for start in range(0, len(crops), chunk_rows)])
+
+
+def _metric_vectors(vectors, metric):
+    """
+    Vectors to search for a metric; cosine becomes euclidean on unit vectors
+    """
+    if metric == 'cosine':
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return vectors
+
+
+def _nearest(queries, vectors, norms, metric, k, exclude=None):
+    """
+    Indices of the k nearest vectors to each query, nearest first
+
+    Args:
+        exclude (np.ndarray, optional): Row of vectors to skip for each query
+    """
+    if metric == 'manhattan':
+        from scipy.spatial.distance import cdist
+        dist = cdist(queries, vectors, 'cityblock')
+    else:
+        dist = _sq_distances(queries, vectors, norms)
+    if exclude is not None:
+        dist[np.arange(len(queries)), exclude] = np.inf
+    k = min(k, dist.shape[1])
+    nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(dist, nearest, axis=1), axis=1)
+    return np.take_along_axis(nearest, order, axis=1)
+
+
+def _vote(neighbour_classes, n_classes):
+    """
+    Majority class of each row, ties to the lowest class as in BatchRecognizer
+    """
+    counts = np.zeros((len(neighbour_classes), n_classes), dtype=np.intp)
+    np.add.at(counts, (np.arange(len(neighbour_classes))[:, None], neighbour_classes), 1)
+    return counts.argmax(axis=1)
+
+
+def _loo_correct(vectors, metric, ks, class_idx, rows):
+    """
+    Correct leave-one-out predictions of some captures, per k
+    """
+    norms = np.einsum('ij,ij->i', vectors, vectors)
+    nearest = _nearest(np.asarray(vectors[rows]), vectors, norms, metric, max(ks), exclude=rows)
+    n_classes = int(class_idx.max()) + 1
+    truth = class_idx[rows]
+    return np.array([np.sum(_vote(class_idx[nearest[:, :k]], n_classes) == truth) for k in ks])
+
+
+def _loo_chunk(path, metric, ks, class_idx, rows):
+    """
+    Worker process: leave-one-out predictions of some captures for every k
+
+    Returns:
+        dict: Metric -> correct predictions per k
+    """
+    return {metric: _loo_correct(np.load(path, mmap_mode='r'), metric, ks, class_idx, rows)}
+
+
+def _fold_chunk(crops_path, spec, metrics, ks, class_idx, rows):
+    """
+    Worker process: fit the extractor without some captures, then classify them
+
+    Returns:
+        dict: Metric -> correct predictions per k
+    """
+    crops = np.load(crops_path, mmap_mode='r')
+    train = np.ones(len(crops), dtype=bool)
+    train[rows] = False
+    vectors = _transform(_create_extractor(spec, crops[train]), crops)
+    return {metric: _loo_correct(_metric_vectors(vectors, metric), metric, ks, class_idx, rows)
+            for metric in metrics}
+
+
+def _match_latency(extractor, crops, vectors, metric, k, class_idx, n_classes, samples, seed=0):
+    """
+    Median seconds to extract and match one face against the whole gallery
+    """
+    rng = np.random.default_rng(seed)
+    norms = np.einsum('ij,ij->i', vectors, vectors)
+    durations = []
+    # The first row only warms up caches and lazily loaded code
+    for row in rng.integers(0, len(crops), size=samples + 1):
+        start = time.perf_counter()
+        query = _metric_vectors(np.asarray(extractor.transform(crops[row:row + 1]), dtype=np.float32), metric)
+        _vote(class_idx[_nearest(query, vectors, norms, metric, k)], n_classes)
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations[1:]))
+
+
+def sweep(ks=(1, 3, 5, 7), metrics=('euclidean', 'cosine'), crop_sizes=(50, 32), extractors=('pixels', 'pca:128'),
+          workers=None, queries=None, latency_samples=200, folds=5, chunk_rows=256, seed=0):
+    """
+    Leave-one-capture-out accuracy, per-face latency and memory of recognizer settings
+
+    Args:
+        ks: Neighbour counts to try
+        metrics: Distance metrics from METRICS
+        crop_sizes: Square crop sides in pixels, at most the stored 50
+        extractors: Extractor specs: 'pixels', 'pca:<dims>' or 'dnn:<model path>'
+        workers (int, optional): Worker processes, default os.cpu_count()
+        queries (int, optional): Held-out captures to classify, default all
+        latency_samples (int): Single-face matches timed per configuration
+        folds (int): Folds of held-out captures for extractors fitted on the
+            gallery (PCA); each fold is classified by a fit without it
+
+    Returns:
+        dict: Gallery summary and one result per configuration, in sweep order
+    """
+    import utils
+
+    faces, labels = utils.load_face_data()
+    if faces is None or len(faces) == 0:
+        raise SystemExit("No face data found. Register faces first.")
+    classes, class_idx = np.unique(np.asarray(labels, dtype=object), return_inverse=True)
+    if len(classes) < 2:
+        raise SystemExit("At least two registered people are needed to evaluate")
+    # A person's only capture cannot be recognized once it is left out
+    counts = np.bincount(class_idx)
+    candidates = np.flatnonzero(counts[class_idx] > 1)
+    rng = np.random.default_rng(seed)
+    if queries and queries < len(candidates):
+        candidates = np.sort(rng.choice(candidates, size=queries, replace=False))
+    chunks = [candidates[start:start + chunk_rows] for start in range(0, len(candidates), chunk_rows)]
+    fold_rows = np.array_split(candidates, max(1, min(folds, len(candidates))))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        spaces = []
+        for side, spec in itertools.product(crop_sizes, extractors):
+            crops = resize_crops(faces, side)
+            extractor = _create_extractor(spec, crops)
+            vectors = _transform(extractor, crops)
+            if _needs_fit(spec):
+                crops_path = os.path.join(tmp_dir, f"crops-{len(spaces)}.npy")
+                np.save(crops_path, crops)
+                fold_futures = [pool.submit(_fold_chunk, crops_path, spec, metrics, ks, class_idx, rows)
+                                for rows in fold_rows]
+            for metric in metrics:
+                path = os.path.join(tmp_dir, f"{len(spaces)}.npy")
+                np.save(path, _metric_vectors(vectors, metric))
+                if _needs_fit(spec):
+                    futures = fold_futures
+                else:
+                    futures = [pool.submit(_loo_chunk, path, metric, ks, class_idx, rows) for rows in chunks]
+                spaces.append((side, spec, extractor, crops, metric, path, futures))
+
+        for side, spec, extractor, crops, metric, path, futures in spaces:
+            correct = sum(future.result()[metric] for future in futures)
+            vectors = np.load(path)
+            memory = vectors.nbytes + _extractor_bytes(extractor)
+            for k, hits in zip(ks, correct):
+                latency = _match_latency(extractor, crops, vectors, metric, k, class_idx, len(classes),
+                                         latency_samples)
+                results.append({
+                    'crop_size': int(side),
+                    'extractor': spec,
+                    'dims': int(vectors.shape[1]),
+                    'metric': metric,
+                    'k': int(k),
+                    'accuracy': float(hits / len(candidates)),
+                    'latency_ms': latency * 1000,
+                    'memory_mb': memory / 1e6,
+                })
+
+    return {
+        'captures': int(len(faces)),
+        'identities': int(len(classes)),
+        'evaluated': int(len(candidates)),
+        'results': results,
+    }
+
+
+def fastest(results, min_accuracy):
+    """
+    The lowest-latency result with at least min_accuracy, or None
+    """
+    passing = [result for result in results if result['accuracy'] >= min_accuracy]
+    return min(passing, key=lambda result: result['latency_ms']) if passing else None
+
+
+def _print_sweep(report, min_accuracy):
+    print(f"Leave-one-out over {report['evaluated']} of {report['captures']} captures "
+          f"of {report['identities']} people")
+    print(f"{'crop':>5} {'extractor':>12} {'dims':>6} {'metric':>10} {'k':>3} "
+          f"{'accuracy':>9} {'ms/face':>8} {'MB':>8}")
+    for result in report['results']:
+        print(f"{result['crop_size']:>5} {result['extractor']:>12} {result['dims']:>6} {result['metric']:>10} "
+              f"{result['k']:>3} {result['accuracy']:>8.1%} {result['latency_ms']:>8.2f} {result['memory_mb']:>8.2f}")
+    if min_accuracy is not None:
+        best = report['recommended']
+        print(f"No configuration reaches {min_accuracy:.1%} accuracy" if best is None else
+              f"Fastest with at least {min_accuracy:.1%}: {best['crop_size']}px {best['extractor']} "
+              f"{best['metric']} k={best['k']} ({best['accuracy']:.1%}, {best['latency_ms']:.2f} ms/face)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate recognition on the stored gallery")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    calibrate_parser = subparsers.add_parser('calibrate', help="Calibrate the unknown-face threshold")
+    calibrate_parser.add_argument('--mode', choices=[model_store.MODE_KNN, model_store.MODE_CENTROID],
+                                  default=model_store.MODE_KNN,
+                                  help="Match against every capture (knn) or per-identity centroids")
+    calibrate_parser.add_argument('--far', type=float, default=0.01,
+                                  help="Target fraction of unregistered faces accepted")
+    calibrate_parser.add_argument('--dry-run', action='store_true', help="Report without saving")
+    sweep_parser = subparsers.add_parser('sweep', help="Compare recognizer settings with leave-one-out")
+    sweep_parser.add_argument('--k', type=int, nargs='+', default=[1, 3, 5, 7], help="Neighbour counts")
+    sweep_parser.add_argument('--metric', nargs='+', choices=METRICS, default=['euclidean', 'cosine'])
+    sweep_parser.add_argument('--crop-size', type=int, nargs='+', default=[50, 32],
+                              help="Square crop sides in pixels (at most 50)")
+    sweep_parser.add_argument('--extractor', nargs='+', default=['pixels', 'pca:128'],
+                              help="pixels, pca:<dims> or dnn:<model path>")
+    sweep_parser.add_argument('--workers', type=int, help="Worker processes (default: all CPUs)")
+    sweep_parser.add_argument('--queries', type=int, help="Held-out captures to classify (default: all)")
+    sweep_parser.add_argument('--folds', type=int, default=5,
+                              help="Folds for extractors fitted on the gallery (PCA)")
+    sweep_parser.add_argument('--latency-samples', type=int, default=200,
+                              help="Single-face matches timed per configuration")
+    sweep_parser.add_argument('--min-accuracy', type=float,
+                              help="Report the fastest configuration with at least this accuracy (0-1)")
+    sweep_parser.add_argument('--json', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == 'sweep':
+        report = sweep(args.k, args.metric, args.crop_size, args.extractor, args.workers, args.queries,
+                       args.latency_samples, args.folds)
+        if args.min_accuracy is not None:
+            report['min_accuracy'] = args.min_accuracy
+            report['recommended'] = fastest(report['results'], args.min_accuracy)
+        _print_sweep(report, args.min_accuracy)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Wrote {args.json}")
+        return
+
+    calibration = calibrate(args.mode, args.far)
+    gar = calibration['genuine_accept_rate']
+    print(f"{calibration['mode']} on {calibration['captures']} captures of {calibration['identities']} people "
+          f"({calibration['extractor']}, {calibration['dim']} dims)")
+    print(f"Threshold {calibration['threshold']:.3f}: accepts {calibration['false_accept_rate']:.1%} of "
+          f"impostors and {'n/a' if gar is None else f'{gar:.1%}'} of registered faces")
+    if args.dry_run:
+        return
+    with gallery.locked():
+        model_store.save_calibration(calibration)
+        gallery.bump_generation()
+    print(f"Saved to {gallery.GALLERY_DIR}/{model_store.CALIBRATION_FILE}")
+
+
+if __name__ == "__main__":
+    main()
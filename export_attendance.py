@@ -0,0 +1,383 @@
+"""
+Parallel Parquet export of the attendance history
+
+Every Attendance_dd-mm-YYYY.csv file is parsed in a pool of worker
+processes into typed columns (a real date, the name, the time of day) and
+written to a Parquet dataset with one part file per month. Times are
+parsed from both HH:MM:SS and the HH:MM-SS format of older files; the
+text as written is kept alongside in time_text, and rows whose time
+cannot be parsed are counted and reported rather than dropped:
+
+    Data/attendance_export/
+        _manifest.json
+        attendance-2025-03.parquet
+        ...
+
+_manifest.json is the checkpoint. It records the size and mtime of the
+files behind each part and is rewritten after every finished month, so an
+interrupted export resumes where it stopped and later runs only redo the
+months whose files changed. The parts read as one table with
+pyarrow.dataset, pandas.read_parquet or DuckDB, and the View Records page
+can report from them instead of the CSV files.
+
+    python export_attendance.py --workers 8
+"""
+import argparse
+import concurrent.futures
+import csv
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import attendance_store
+
+EXPORT_DIR = 'Data/attendance_export'
+MANIFEST_FILE = '_manifest.json'
+
+# Bumped when the part layout changes, so existing exports are rewritten
+FORMAT_VERSION = 2
+
+# Older versions of the app wrote times as HH:MM-SS
+TIME_FORMATS = ("%H:%M:%S", "%H:%M-%S")
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('date', pa.date32()),
+        ('name', pa.string()),
+        ('time', pa.time32('s')),
+        ('time_text', pa.string()),
+        ('source', pa.string()),
+    ])
+
+
+def _parse_time(text):
+    """
+    Time of day from an attendance TIME value, or None if no known format matches
+    """
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), time_format).time()
+        except ValueError:
+            pass
+    return None
+
+
+def _read_rows(path, date):
+    """
+    Rows of one attendance file; a trailing row still being written is left out
+
+    Returns:
+        tuple: (rows as (date, name, time, time_text) tuples, (size, mtime_ns) that was read)
+    """
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read(st.st_size)
+    end = data.rfind(b'\n') + 1
+    if end < len(data) and time.time() - st.st_mtime > 2:
+        end = len(data)
+    reader = csv.reader(io.StringIO(data[:end].decode('utf-8', errors='replace')))
+    next(reader, None)
+    rows = []
+    for row in reader:
+        if row:
+            text = row[1] if len(row) > 1 else ''
+            rows.append((date, row[0], _parse_time(text), text))
+    return rows, (st.st_size, st.st_mtime_ns)
+
+
+def _export_month(month, files, directory, export_dir, compression):
+    """
+    Worker process: write the part file for one month
+
+    Args:
+        files (list): (filename, date) pairs, in date order
+
+    Returns:
+        dict: Manifest entry for the month, with the rows whose time could
+        not be parsed counted in unparsed_times
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    part = f"attendance-{month}.parquet"
+    tmp_path = os.path.join(export_dir, f".{part}.tmp-{os.getpid()}")
+    stats, rows, unparsed = {}, 0, 0
+    with pq.ParquetWriter(tmp_path, _schema(), compression=compression) as writer:
+        for filename, date in files:
+            file_rows, stats[filename] = _read_rows(os.path.join(directory, filename), date)
+            if not file_rows:
+                continue
+            dates, names, times, texts = zip(*file_rows)
+            writer.write_table(pa.table([list(dates), list(names), list(times), list(texts),
+                                         [filename] * len(file_rows)], schema=_schema()))
+            rows += len(file_rows)
+            unparsed += sum(1 for t in times if t is None)
+    os.replace(tmp_path, os.path.join(export_dir, part))
+    return {'part': part, 'rows': rows, 'unparsed_times': unparsed, 'files': stats}
+
+
+def read_manifest(export_dir=EXPORT_DIR):
+    """
+    The export checkpoint: {'version', 'months': {'YYYY-MM': {'part', 'rows', 'unparsed_times', 'files'}}}
+    """
+    try:
+        with open(os.path.join(export_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': FORMAT_VERSION, 'months': {}}
+
+
+def _write_manifest(manifest, export_dir):
+    path = os.path.join(export_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _scan(directory):
+    """
+    Attendance files by month, as {'YYYY-MM': [(filename, date), ...]}
+    """
+    months = {}
+    if not os.path.isdir(directory):
+        return months
+    for filename in os.listdir(directory):
+        date = attendance_store.parse_file_date(filename)
+        if date is not None:
+            months.setdefault(date.strftime("%Y-%m"), []).append((filename, date))
+    for files in months.values():
+        files.sort(key=lambda item: item[1])
+    return months
+
+
+def _unchanged(entry, files, directory):
+    if entry is None or set(entry['files']) != {filename for filename, _ in files}:
+        return False
+    for filename, _ in files:
+        st = os.stat(os.path.join(directory, filename))
+        if entry['files'][filename] != [st.st_size, st.st_mtime_ns]:
+            return False
+    return True
+
+
+def export(directory=attendance_store.ATTENDANCE_DIR, export_dir=EXPORT_DIR, workers=None,
+           compression='zstd', full=False):
+    """
+    Bring the Parquet export up to date with the attendance files
+
+    Args:
+        directory (str): Folder with the Attendance_*.csv files
+        export_dir (str): Folder of the Parquet parts and manifest
+        workers (int, optional): Worker processes, default os.cpu_count()
+        compression (str): Parquet codec
+        full (bool): Rewrite every month instead of only the changed ones
+
+    Returns:
+        dict: Months exported, skipped and removed, rows written, and how
+        many of those have a time that could not be parsed
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    # Leftovers of an interrupted run
+    for filename in os.listdir(export_dir):
+        if '.tmp' in filename:
+            os.remove(os.path.join(export_dir, filename))
+
+    manifest = read_manifest(export_dir)
+    if manifest.get('version') != FORMAT_VERSION:
+        full = True
+        manifest['version'] = FORMAT_VERSION
+    done = manifest['months']
+    months = _scan(directory)
+    summary = {'exported': 0, 'skipped': 0, 'removed': 0, 'rows': 0, 'unparsed_times': 0}
+
+    for month in sorted(set(done) - set(months)):
+        part = os.path.join(export_dir, done.pop(month)['part'])
+        if os.path.exists(part):
+            os.remove(part)
+        summary['removed'] += 1
+    if summary['removed']:
+        _write_manifest(manifest, export_dir)
+
+    todo = {month: files for month, files in months.items()
+            if full or not _unchanged(done.get(month), files, directory)}
+    summary['skipped'] = len(months) - len(todo)
+    if not todo:
+        return summary
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_export_month, month, files, directory, export_dir, compression): month
+                   for month, files in sorted(todo.items())}
+        for future in concurrent.futures.as_completed(futures):
+            entry = future.result()
+            done[futures[future]] = entry
+            _write_manifest(manifest, export_dir)
+            summary['exported'] += 1
+            summary['rows'] += entry['rows']
+            summary['unparsed_times'] += entry['unparsed_times']
+    return summary
+
+
+class ExportedRecords:
+    """
+    The attendance queries of AttendanceStore, answered from the Parquet export
+
+    The parts are loaded into one DataFrame on first use and again whenever
+    the manifest changes.
+    """
+
+    def __init__(self, export_dir=EXPORT_DIR):
+        self.export_dir = export_dir
+        self._lock = threading.Lock()
+        self._frame = None
+        self._frame_version = None
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.export_dir, MANIFEST_FILE))
+
+    def ingest(self):
+        """
+        The export is refreshed by export(), not by the page; nothing to do
+        """
+        return 0
+
+    def version(self):
+        try:
+            st = os.stat(os.path.join(self.export_dir, MANIFEST_FILE))
+        except FileNotFoundError:
+            return (0, 0)
+        return (st.st_size, st.st_mtime_ns)
+
+    def exported_at(self):
+        """
+        When the export was last written, or None
+        """
+        version = self.version()
+        return datetime.fromtimestamp(version[1] / 1e9) if version[1] else None
+
+    def unparsed_times(self):
+        """
+        Exported rows whose TIME matched no known format
+        """
+        months = read_manifest(self.export_dir)['months']
+        return sum(entry.get('unparsed_times', 0) for entry in months.values())
+
+    def frame(self):
+        """
+        Every exported row as a DataFrame with date, name, time, time_text and source columns
+
+        time is the parsed time of day (None if unparsable); time_text is
+        the value as written in the CSV file, which the reports show.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        with self._lock:
+            version = self.version()
+            if self._frame is None or self._frame_version != version:
+                months = read_manifest(self.export_dir)['months']
+                tables = [pq.read_table(os.path.join(self.export_dir, months[month]['part']))
+                          for month in sorted(months)]
+                table = pa.concat_tables(tables) if tables else _schema().empty_table()
+                frame = table.to_pandas()
+                frame['time_text'] = frame['time_text'].fillna('')
+                self._frame, self._frame_version = frame, version
+            return self._frame
+
+    def _between(self, start, end):
+        frame = self.frame()
+        return frame[(frame['date'] >= start) & (frame['date'] <= end)]
+
+    def dates(self):
+        """
+        Dates with attendance records, newest first
+        """
+        return sorted(self.frame()['date'].unique(), reverse=True)
+
+    def day(self, date):
+        """
+        Attendance rows for one day, in the original NAME/TIME layout
+        """
+        frame = self.frame()
+        rows = frame[frame['date'] == date]
+        return rows[['name', 'time_text']].rename(columns={'name': 'NAME', 'time_text': 'TIME'}).reset_index(drop=True)
+
+    def date_range(self, start, end, name=None):
+        """
+        All rows between start and end (inclusive), optionally for one person
+        """
+        rows = self._between(start, end)
+        if name:
+            rows = rows[rows['name'] == name]
+        rows = rows[['date', 'name', 'time_text']].rename(columns={'date': 'DATE', 'name': 'NAME',
+                                                                   'time_text': 'TIME'})
+        return rows.sort_values('DATE', kind='stable').reset_index(drop=True)
+
+    def attendance_rates(self, start, end):
+        """
+        Per-person days present out of the days with any attendance in range
+        """
+        import pandas as pd
+
+        rows = self._between(start, end)
+        if rows.empty:
+            return pd.DataFrame(columns=['NAME', 'DAYS_PRESENT', 'TOTAL_DAYS', 'RATE'])
+        present = rows.groupby('name')['date'].nunique()
+        total = rows['date'].nunique()
+        df = pd.DataFrame({'NAME': present.index, 'DAYS_PRESENT': present.values, 'TOTAL_DAYS': total})
+        df['RATE'] = (100.0 * df['DAYS_PRESENT'] / total).round(1)
+        return df.sort_values(['RATE', 'NAME'], ascending=[False, True]).reset_index(drop=True)
+
+    def monthly_rollup(self, start=None, end=None):
+        """
+        Days present per person per month
+        """
+        rows = self._between(start, end) if start and end else self.frame()
+        months = rows['date'].map(lambda d: d.strftime("%Y-%m"))
+        df = rows.assign(MONTH=months).groupby(['MONTH', 'name'])['date'].nunique().reset_index()
+        return df.rename(columns={'name': 'NAME', 'date': 'DAYS_PRESENT'})
+
+    def names(self):
+        return sorted(self.frame()['name'].unique())
+
+
+_default_records = None
+_default_records_lock = threading.Lock()
+
+
+def get_records():
+    """
+    Return the process-wide ExportedRecords for the default export
+    """
+    global _default_records
+    with _default_records_lock:
+        if _default_records is None:
+            _default_records = ExportedRecords()
+        return _default_records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the attendance history to Parquet")
+    parser.add_argument('--directory', default=attendance_store.ATTENDANCE_DIR, help="Attendance CSV folder")
+    parser.add_argument('--output', default=EXPORT_DIR, help="Folder for the Parquet parts and manifest")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: all CPUs)")
+    parser.add_argument('--compression', default='zstd', help="Parquet codec (zstd, snappy, gzip, none)")
+    parser.add_argument('--full', action='store_true', help="Rewrite every month, not only changed ones")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = export(args.directory, args.output, args.workers, args.compression, args.full)
+    print(f"Exported {summary['rows']} rows in {summary['exported']} months, "
+          f"{summary['skipped']} months unchanged, {summary['removed']} removed "
+          f"in {time.perf_counter() - start:.1f}s")
+    if summary['unparsed_times']:
+        print(f"Warning: {summary['unparsed_times']} rows have a TIME in no known format "
+              f"({', '.join(TIME_FORMATS)}); their time is empty and the text is kept in time_text")
+
+
+if __name__ == "__main__":
+    main()
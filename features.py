@@ -0,0 +1,296 @@
+"""
+Pluggable feature extraction for face crops
+
+Recognition used to compare raw 50x50x3 BGR pixel vectors (7500 dims). A
+feature extractor maps those vectors to a compact float32 embedding before
+they are stored and compared. The extractor configured for a gallery is kept
+in Data/gallery/extractor.npz, and the embeddings of every stored face in
+Data/gallery/embeddings.npy, so registration and attendance always use the
+same features.
+
+Extractors:
+    pixels  Raw pixel vectors (the original behaviour, no extractor file)
+    pca     Grayscale + histogram equalization + PCA projection (default 128 dims)
+    dnn     OpenCV DNN embedding model loaded from a local file, CPU only
+
+Usage:
+    python features.py migrate --type pca --dims 128
+    python features.py migrate --type dnn --model Data/openface.nn4.small2.v1.t7
+    python features.py migrate --type pixels
+"""
+import argparse
+import os
+import threading
+
+import cv2
+import numpy as np
+
+import gallery
+import gallery_index
+
+FACE_SHAPE = gallery.FACE_SIZE + (3,)
+
+
+class PixelExtractor:
+    """
+    Identity extractor: the raw uint8 pixel vector is the feature
+    """
+
+    name = 'pixels'
+
+    def __init__(self):
+        self.dim = gallery.FACE_DIM
+
+    def transform(self, faces):
+        return np.asarray(faces).reshape(len(faces), -1)
+
+    def state(self):
+        return {}
+
+
+def _face_images(faces):
+    """
+    (k, side * side * 3) face vectors -> (k, side, side, 3) uint8 images
+
+    Crops are normally FACE_SHAPE; other square sizes are accepted so that
+    evaluate.py can compare crop sizes.
+    """
+    faces = np.asarray(faces, dtype=np.uint8)
+    side = int(round(np.sqrt(faces.shape[-1] / 3))) if faces.ndim == 2 else FACE_SHAPE[0]
+    return faces.reshape(-1, side, side, 3)
+
+
+def _equalized_gray(faces):
+    """
+    (k, 7500) BGR face vectors -> (k, 2500) float32 equalized grayscale in [0, 1]
+    """
+    faces = _face_images(faces)
+    out = np.empty((len(faces), faces.shape[1] * faces.shape[2]), dtype=np.float32)
+    for i, face in enumerate(faces):
+        out[i] = cv2.equalizeHist(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)).reshape(-1)
+    out *= 1.0 / 255
+    return out
+
+
+class PCAExtractor:
+    """
+    Grayscale + histogram equalization + PCA projection
+
+    Equalization removes most global lighting differences, and the PCA
+    basis is fitted on the stored gallery.
+
+    Args:
+        dims (int): Number of principal components kept
+    """
+
+    name = 'pca'
+
+    def __init__(self, dims=128, mean=None, components=None):
+        self.dims = dims
+        self.mean = mean
+        self.components = components
+
+    @property
+    def dim(self):
+        return self.dims if self.components is None else self.components.shape[0]
+
+    def fit(self, faces, chunk_rows=4096):
+        """
+        Fit the PCA basis on gallery face vectors
+        """
+        # Accumulate the covariance in chunks so the whole gallery never has
+        # to be held as float features at once
+        dim = np.asarray(faces[:1]).shape[1] // 3
+        total = np.zeros(dim)
+        scatter = np.zeros((dim, dim))
+        for start in range(0, len(faces), chunk_rows):
+            gray = _equalized_gray(faces[start:start + chunk_rows]).astype(np.float64)
+            total += gray.sum(axis=0)
+            scatter += gray.T @ gray
+        mean = total / len(faces)
+        covariance = scatter / len(faces) - np.outer(mean, mean)
+
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:self.dims]
+        self.mean = mean.astype(np.float32)
+        self.components = np.ascontiguousarray(eigenvectors[:, order].T, dtype=np.float32)
+        return self
+
+    def transform(self, faces):
+        if self.components is None:
+            raise ValueError("PCAExtractor has not been fitted")
+        gray = _equalized_gray(faces)
+        gray -= self.mean
+        return gray @ self.components.T
+
+    def state(self):
+        return {'dims': self.dims, 'mean': self.mean, 'components': self.components}
+
+
+class DnnExtractor:
+    """
+    Embedding network run through cv2.dnn on the CPU
+
+    Works with models such as OpenFace nn4.small2.v1 (Torch .t7, 96x96 RGB
+    input, 128-d output). Embeddings are L2-normalized.
+
+    Args:
+        model_path (str): Local model file readable by cv2.dnn.readNet
+        input_size (int): Square input size the network expects
+    """
+
+    name = 'dnn'
+
+    def __init__(self, model_path, input_size=96):
+        self.model_path = model_path
+        self.input_size = input_size
+        # A cv2.dnn Net is not safe to run from several threads at once
+        self._lock = threading.Lock()
+        self.net = cv2.dnn.readNet(model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.dim = int(self.transform(np.zeros((1, gallery.FACE_DIM), dtype=np.uint8)).shape[1])
+
+    def transform(self, faces):
+        faces = _face_images(faces)
+        blob = cv2.dnn.blobFromImages(list(faces), 1.0 / 255, (self.input_size, self.input_size),
+                                      (0, 0, 0), swapRB=True, crop=False)
+        with self._lock:
+            self.net.setInput(blob)
+            embeddings = self.net.forward().reshape(len(faces), -1).astype(np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+    def state(self):
+        return {'model_path': np.asarray(self.model_path), 'input_size': self.input_size}
+
+
+def create_extractor(kind, dims=128, model_path=None):
+    """
+    Build an unfitted extractor by name
+    """
+    if kind == PixelExtractor.name:
+        return PixelExtractor()
+    if kind == PCAExtractor.name:
+        return PCAExtractor(dims)
+    if kind == DnnExtractor.name:
+        if not model_path or not os.path.exists(model_path):
+            raise FileNotFoundError(f"DNN model file not found: {model_path}")
+        return DnnExtractor(model_path)
+    raise ValueError(f"Unknown feature extractor: {kind}")
+
+
+_loaded = {}
+
+
+def load_extractor(gallery_dir=gallery.GALLERY_DIR):
+    """
+    Return the extractor configured for a gallery (PixelExtractor if none)
+
+    Extractors are cached per gallery and reloaded when the file changes.
+    """
+    path = os.path.join(gallery_dir, gallery.EXTRACTOR_FILE)
+    if not os.path.exists(path):
+        return PixelExtractor()
+
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    if key not in _loaded:
+        with np.load(path, allow_pickle=False) as data:
+            kind = str(data['kind'])
+            if kind == PCAExtractor.name:
+                extractor = PCAExtractor(int(data['dims']), data['mean'], data['components'])
+            elif kind == DnnExtractor.name:
+                extractor = DnnExtractor(str(data['model_path']), int(data['input_size']))
+            else:
+                extractor = PixelExtractor()
+        _loaded.clear()
+        _loaded[key] = extractor
+    return _loaded[key]
+
+
+def _save_extractor(extractor, gallery_dir):
+    path = os.path.join(gallery_dir, gallery.EXTRACTOR_FILE)
+    if extractor.name == PixelExtractor.name:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, kind=np.asarray(extractor.name), **extractor.state())
+    os.replace(tmp_path, path)
+
+
+def migrate(extractor, gallery_dir=gallery.GALLERY_DIR, chunk_rows=4096):
+    """
+    Switch a gallery to a new extractor and re-project every stored face
+
+    Legacy names.pkl/faces_data.pkl are migrated into the gallery first. PCA
+    extractors are fitted on the stored faces. The gallery generation is
+    bumped so cached models reload with the new features.
+
+    Returns:
+        int: Number of faces re-projected
+    """
+    import model_store
+
+    gallery.ensure_gallery(gallery_dir)
+    with gallery.locked(gallery_dir):
+        snapshot = gallery.open_gallery(gallery_dir)
+        faces = snapshot.faces
+        if isinstance(extractor, PCAExtractor) and extractor.components is None:
+            if len(faces) < 2:
+                raise ValueError("Not enough stored faces to fit PCA")
+            extractor.dims = min(extractor.dims, len(faces))
+            extractor.fit(faces, chunk_rows)
+
+        if extractor.name == PixelExtractor.name:
+            gallery.remove_embeddings(gallery_dir)
+        else:
+            embeddings = np.empty((len(faces), extractor.dim), dtype=np.float32)
+            for start in range(0, len(faces), chunk_rows):
+                embeddings[start:start + chunk_rows] = extractor.transform(faces[start:start + chunk_rows])
+            gallery.write_embeddings(embeddings, gallery_dir)
+        _save_extractor(extractor, gallery_dir)
+        # IVF centroids and open-set thresholds belong to the old feature space
+        gallery_index.remove_index(gallery_dir)
+        model_store.remove_calibration(gallery_dir)
+        gallery.bump_generation(gallery_dir)
+        return len(faces)
+
+
+def gallery_vectors(snapshot, extractor, start_row=0):
+    """
+    Feature vectors for snapshot rows from start_row on
+
+    Uses the stored embeddings where they exist and projects any rows they
+    do not cover yet (e.g. faces appended by an older version).
+    """
+    if extractor.name == PixelExtractor.name:
+        return snapshot.faces[start_row:]
+
+    stored = 0
+    if snapshot.embeddings is not None and snapshot.embeddings.shape[1] == extractor.dim:
+        stored = len(snapshot.embeddings)
+    if stored >= len(snapshot):
+        return snapshot.embeddings[start_row:]
+
+    head = snapshot.embeddings[start_row:stored] if start_row < stored else None
+    tail = extractor.transform(snapshot.faces[max(start_row, stored):])
+    return tail if head is None else np.concatenate([head, tail])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Configure the gallery's feature extractor")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="Switch extractor and re-project stored faces")
+    migrate_parser.add_argument('--type', choices=['pixels', 'pca', 'dnn'], default='pca')
+    migrate_parser.add_argument('--dims', type=int, default=128, help="PCA components")
+    migrate_parser.add_argument('--model', help="Model file for --type dnn")
+    args = parser.parse_args()
+
+    extractor = create_extractor(args.type, args.dims, args.model)
+    count = migrate(extractor)
+    print(f"Re-projected {count} faces with the '{extractor.name}' extractor ({extractor.dim} dims)")
+
+
+if __name__ == "__main__":
+    main()
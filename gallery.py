@@ -0,0 +1,676 @@
+"""
+Append-only face gallery storage
+
+The gallery lives in Data/gallery/ and replaces the names.pkl/faces_data.pkl
+pair. It consists of:
+
+    faces.npy        (N, 7500) uint8 face vectors, memory-mappable
+    labels.npy       (N,) int32 identity id for each face row
+    identities.txt   One name per line; line number is the identity id
+    gallery.json     Manifest with the format version, a generation counter
+                     and whether the legacy pickles have been migrated
+    extractor.npz    Optional feature extractor (see features.py)
+    embeddings.npy   (N, d) float32 features of each face row, when an
+                     extractor is configured
+    tombstones.npy   Sorted row numbers that have been deleted
+
+Both .npy files are written with a fixed 128-byte header so new rows can be
+appended in place and the row count patched without rewriting the file. The
+row count in labels.npy is the commit point: rows beyond it (from an append
+that was interrupted) are ignored by readers and overwritten by the next append.
+
+Deleting rows only adds them to tombstones.npy; readers skip them. compact()
+later rewrites the files without the deleted rows. Several names in
+identities.txt may be the same after a merge; readers use the first id of
+each name.
+"""
+import os
+import json
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import utils
+
+GALLERY_DIR = 'Data/gallery'
+LEGACY_NAMES_PATH = 'Data/names.pkl'
+LEGACY_FACES_PATH = 'Data/faces_data.pkl'
+
+FACES_FILE = 'faces.npy'
+LABELS_FILE = 'labels.npy'
+IDENTITIES_FILE = 'identities.txt'
+MANIFEST_FILE = 'gallery.json'
+EXTRACTOR_FILE = 'extractor.npz'
+EMBEDDINGS_FILE = 'embeddings.npy'
+TOMBSTONES_FILE = 'tombstones.npy'
+LOCK_FILE = '.lock'
+
+# Files replaced when a compaction is swapped in, in this order
+_COMPACTED_FILES = (FACES_FILE, EMBEDDINGS_FILE, IDENTITIES_FILE, LABELS_FILE, TOMBSTONES_FILE)
+
+FACE_SIZE = (50, 50)
+FACE_DIM = FACE_SIZE[0] * FACE_SIZE[1] * 3
+FORMAT_VERSION = 1
+
+_HEADER_SIZE = 128
+_MAGIC = b'\x93NUMPY\x01\x00'
+
+_thread_lock = threading.Lock()
+
+
+def _npy_header(descr, shape):
+    """
+    Build a .npy v1.0 header padded to exactly _HEADER_SIZE bytes
+    """
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': %s, }" % (descr, repr(tuple(shape)))
+    header_len = _HEADER_SIZE - len(_MAGIC) - 2
+    header = header.ljust(header_len - 1) + '\n'
+    return _MAGIC + header_len.to_bytes(2, 'little') + header.encode('latin1')
+
+
+def _read_npy_shape(path):
+    """
+    Read the full shape from a fixed-header .npy file without loading data
+    """
+    with open(path, 'rb') as f:
+        f.seek(len(_MAGIC))
+        header = f.read(_HEADER_SIZE - len(_MAGIC))
+    shape_start = header.index(b"'shape': (") + len(b"'shape': (")
+    shape_end = header.index(b')', shape_start)
+    return tuple(int(v) for v in header[shape_start:shape_end].split(b',') if v.strip())
+
+
+def _read_npy_rows(path):
+    """
+    Read the row count from a fixed-header .npy file without loading data
+    """
+    return _read_npy_shape(path)[0]
+
+
+def _fsync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+@contextmanager
+def locked(gallery_dir=GALLERY_DIR):
+    """
+    Hold an exclusive lock on the gallery across threads and processes
+    """
+    with _thread_lock, utils.file_lock(os.path.join(gallery_dir, LOCK_FILE)):
+        yield
+
+
+class GallerySnapshot:
+    """
+    A read-only view of the gallery at a given committed row count
+
+    Deleted rows are left out. Without deletions faces and embeddings are
+    memmaps; with them they are in-memory copies of the remaining rows.
+
+    Attributes:
+        faces (np.ndarray): (N, FACE_DIM) uint8 face vectors
+        label_ids (np.ndarray): (N,) int32 identity id per row
+        identities (list): Identity names indexed by id
+        generation (int): Manifest generation the snapshot was taken at
+        embeddings (np.ndarray): (M, d) float32 stored features for the first
+            M rows (M may lag N), or None without an extractor
+        row_ids (np.ndarray): (N,) position of each row in the gallery files
+        rows (int): Committed rows in the files, deleted ones included
+    """
+
+    def __init__(self, faces, label_ids, identities, generation, embeddings=None, row_ids=None, rows=None):
+        self.faces = faces
+        self.label_ids = label_ids
+        self.identities = identities
+        self.generation = generation
+        self.embeddings = embeddings
+        self.row_ids = np.arange(len(label_ids)) if row_ids is None else row_ids
+        self.rows = len(label_ids) if rows is None else rows
+
+    def __len__(self):
+        return len(self.label_ids)
+
+    @property
+    def labels(self):
+        """
+        Name for each face row, as a list
+        """
+        return [self.identities[i] for i in self.label_ids]
+
+
+def gallery_exists(gallery_dir=GALLERY_DIR):
+    return os.path.exists(os.path.join(gallery_dir, MANIFEST_FILE))
+
+
+def _read_manifest(gallery_dir):
+    with open(os.path.join(gallery_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def _write_manifest(gallery_dir, manifest):
+    path = os.path.join(gallery_dir, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+        _fsync(f)
+    os.replace(tmp_path, path)
+
+
+def _read_identities(gallery_dir):
+    with open(os.path.join(gallery_dir, IDENTITIES_FILE), encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+def write_identities(identities, gallery_dir=GALLERY_DIR):
+    """
+    Replace identities.txt, e.g. to rename or merge identities
+
+    The caller must hold locked(gallery_dir) and bump the generation.
+    """
+    path = os.path.join(gallery_dir, IDENTITIES_FILE)
+    _write_lines(path + '.tmp', identities)
+    os.replace(path + '.tmp', path)
+
+
+def _write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(line + '\n' for line in lines)
+        _fsync(f)
+
+
+def read_tombstones(gallery_dir=GALLERY_DIR):
+    """
+    Sorted row numbers of deleted rows (empty if none)
+    """
+    path = os.path.join(gallery_dir, TOMBSTONES_FILE)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=np.int64)
+    return np.load(path)
+
+
+def add_tombstones(rows, gallery_dir=GALLERY_DIR):
+    """
+    Mark rows as deleted without touching the face data
+
+    The caller must hold locked(gallery_dir) and bump the generation.
+
+    Returns:
+        int: Total deleted rows awaiting compaction
+    """
+    tombstones = np.union1d(read_tombstones(gallery_dir), np.asarray(rows, dtype=np.int64))
+    path = os.path.join(gallery_dir, TOMBSTONES_FILE)
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, tombstones)
+        _fsync(f)
+    os.replace(path + '.tmp', path)
+    return len(tombstones)
+
+
+def _canonical_ids(identities):
+    """
+    Map each identity id to the first id with the same name, or None if names are unique
+    """
+    if len(set(identities)) == len(identities):
+        return None
+    first = {}
+    return np.array([first.setdefault(name, i) for i, name in enumerate(identities)], dtype=np.int32)
+
+
+def create_gallery(gallery_dir=GALLERY_DIR, migrated=True):
+    """
+    Create an empty gallery if one does not already exist
+
+    Args:
+        migrated (bool): Record the legacy pickles as already migrated; False
+            leaves them for migrate_from_pickles to import
+    """
+    if gallery_exists(gallery_dir):
+        return
+    os.makedirs(gallery_dir, exist_ok=True)
+    with open(os.path.join(gallery_dir, FACES_FILE), 'wb') as f:
+        f.write(_npy_header('|u1', (0, FACE_DIM)))
+        _fsync(f)
+    with open(os.path.join(gallery_dir, LABELS_FILE), 'wb') as f:
+        f.write(_npy_header('<i4', (0,)))
+        _fsync(f)
+    open(os.path.join(gallery_dir, IDENTITIES_FILE), 'w', encoding='utf-8').close()
+    # The manifest is written last so a half-created gallery is never seen as valid
+    _write_manifest(gallery_dir, {'version': FORMAT_VERSION, 'generation': 0, 'migrated': migrated})
+
+
+def committed_state(gallery_dir=GALLERY_DIR):
+    """
+    Return (generation, committed row count) without mapping any data
+
+    This only reads the manifest and the labels header, so it is cheap
+    enough to call on every Streamlit rerun to detect gallery changes.
+    """
+    manifest = _read_manifest(gallery_dir)
+    return manifest['generation'], _read_npy_rows(os.path.join(gallery_dir, LABELS_FILE))
+
+
+def _open_files(gallery_dir, rows=None):
+    """
+    Map the committed rows of every gallery file, deleted rows included
+    """
+    label_ids = np.load(os.path.join(gallery_dir, LABELS_FILE), mmap_mode='r')
+    faces = np.load(os.path.join(gallery_dir, FACES_FILE), mmap_mode='r')
+    count = min(len(label_ids), len(faces)) if rows is None else rows
+    embeddings = None
+    embeddings_path = os.path.join(gallery_dir, EMBEDDINGS_FILE)
+    if os.path.exists(embeddings_path) and _read_npy_rows(embeddings_path) > 0:
+        embeddings = np.load(embeddings_path, mmap_mode='r')[:count]
+    return faces[:count], label_ids[:count], embeddings
+
+
+def _read_consistent(gallery_dir, timeout):
+    """
+    Map the gallery files, retrying while a compaction is being swapped in
+
+    Returns:
+        tuple: (manifest, faces, label_ids, embeddings, identities, tombstones)
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        manifest = _read_manifest(gallery_dir)
+        if not manifest.get('compacting'):
+            try:
+                faces, label_ids, embeddings = _open_files(gallery_dir)
+                identities = _read_identities(gallery_dir)
+                tombstones = read_tombstones(gallery_dir)
+            except ValueError:
+                # np.load read the header of a file that was swapped before it was mapped
+                if _read_manifest(gallery_dir) == manifest:
+                    raise
+            else:
+                if _read_manifest(gallery_dir) == manifest:
+                    tombstones = tombstones[tombstones < len(label_ids)]
+                    return manifest, faces, label_ids, embeddings, identities, tombstones
+        if time.monotonic() > deadline:
+            raise IOError(f"Gallery in {gallery_dir} is being compacted; try again")
+        time.sleep(0.01)
+
+
+def _live_rows(rows, tombstones):
+    keep = np.ones(rows, dtype=bool)
+    keep[tombstones] = False
+    return np.flatnonzero(keep)
+
+
+def open_gallery(gallery_dir=GALLERY_DIR, timeout=5.0):
+    """
+    Open the gallery zero-copy through np.load(mmap_mode='r')
+
+    If a compaction is being swapped in, waits up to timeout seconds for it
+    to finish so the files are never read half old and half new.
+
+    Returns:
+        GallerySnapshot: Read-only view of all committed, undeleted rows
+    """
+    manifest, faces, label_ids, embeddings, identities, tombstones = _read_consistent(gallery_dir, timeout)
+    rows = len(label_ids)
+    label_ids = np.asarray(label_ids)
+    canonical = _canonical_ids(identities)
+    if canonical is not None:
+        label_ids = canonical[label_ids]
+
+    row_ids = None
+    if len(tombstones):
+        row_ids = _live_rows(rows, tombstones)
+        faces, label_ids = faces[row_ids], label_ids[row_ids]
+        if embeddings is not None:
+            embeddings = embeddings[row_ids[row_ids < len(embeddings)]]
+    return GallerySnapshot(faces, label_ids, identities, manifest['generation'], embeddings, row_ids, rows)
+
+
+def identity_counts(gallery_dir=GALLERY_DIR, timeout=5.0):
+    """
+    Number of undeleted rows per identity name, reading only the labels
+
+    Returns:
+        dict: {name: count} for names with at least one row, in id order
+    """
+    _, _, label_ids, _, identities, tombstones = _read_consistent(gallery_dir, timeout)
+    label_ids = np.asarray(label_ids)
+    if len(tombstones):
+        label_ids = label_ids[_live_rows(len(label_ids), tombstones)]
+    per_id = np.bincount(label_ids, minlength=len(identities))
+    counts = {}
+    for i in np.flatnonzero(per_id):
+        counts[identities[i]] = counts.get(identities[i], 0) + int(per_id[i])
+    return counts
+
+
+def append_faces(faces, names, gallery_dir=GALLERY_DIR):
+    """
+    Atomically append face vectors and their names to the gallery
+
+    Face rows are written first, then any new identity names, then the label
+    ids. The row counts in the headers are patched last, labels.npy last of
+    all, so a reader never sees a label without its face row.
+
+    Args:
+        faces (np.ndarray): (k, FACE_DIM) or (k, 50, 50, 3) uint8 faces
+        names (list): Name for each face, or a single name for all of them
+
+    Returns:
+        int: Total committed rows after the append
+    """
+    create_gallery(gallery_dir)
+    if len(faces) == 0:
+        return committed_state(gallery_dir)[1]
+    with locked(gallery_dir):
+        return _append_locked(faces, names, gallery_dir)
+
+
+def _append_locked(faces, names, gallery_dir):
+    """
+    append_faces for a caller that already holds locked(gallery_dir)
+    """
+    faces = np.ascontiguousarray(np.asarray(faces, dtype=np.uint8).reshape(len(faces), -1))
+    if faces.shape[1] != FACE_DIM:
+        raise ValueError(f"Expected face vectors of length {FACE_DIM}, got {faces.shape[1]}")
+    if isinstance(names, str):
+        names = [names] * len(faces)
+    if len(names) != len(faces):
+        raise ValueError("Number of names does not match number of faces")
+
+    faces_path = os.path.join(gallery_dir, FACES_FILE)
+    labels_path = os.path.join(gallery_dir, LABELS_FILE)
+
+    count = _read_npy_rows(labels_path)
+    identities = _read_identities(gallery_dir)
+    identity_ids = {}
+    for i, name in enumerate(identities):
+        identity_ids.setdefault(name, i)
+
+    new_identities = []
+    label_ids = np.empty(len(names), dtype='<i4')
+    for i, name in enumerate(names):
+        if name not in identity_ids:
+            identity_ids[name] = len(identities) + len(new_identities)
+            new_identities.append(name)
+        label_ids[i] = identity_ids[name]
+
+    new_count = count + len(faces)
+
+    with open(faces_path, 'r+b') as f:
+        f.seek(_HEADER_SIZE + count * FACE_DIM)
+        f.write(faces.tobytes())
+        f.truncate()
+        _fsync(f)
+
+    if new_identities:
+        with open(os.path.join(gallery_dir, IDENTITIES_FILE), 'a', encoding='utf-8') as f:
+            for name in new_identities:
+                f.write(name + '\n')
+            _fsync(f)
+
+    _append_embeddings(gallery_dir, faces, count)
+
+    with open(labels_path, 'r+b') as f:
+        f.seek(_HEADER_SIZE + count * 4)
+        f.write(label_ids.tobytes())
+        f.truncate()
+        _fsync(f)
+
+    with open(faces_path, 'r+b') as f:
+        f.write(_npy_header('|u1', (new_count, FACE_DIM)))
+        _fsync(f)
+
+    with open(labels_path, 'r+b') as f:
+        f.write(_npy_header('<i4', (new_count,)))
+        _fsync(f)
+
+    return new_count
+
+
+def _append_embeddings(gallery_dir, faces, count):
+    """
+    Extend embeddings.npy for new face rows, if an extractor is configured
+
+    Only done while the embeddings are in step with the committed rows; if
+    they lag behind, readers compute the missing tail themselves.
+    """
+    embeddings_path = os.path.join(gallery_dir, EMBEDDINGS_FILE)
+    if not os.path.exists(embeddings_path):
+        return
+    shape = _read_npy_shape(embeddings_path)
+    if shape[0] < count:
+        return
+
+    import features
+    extractor = features.load_extractor(gallery_dir)
+    embeddings = np.ascontiguousarray(extractor.transform(faces), dtype='<f4')
+    if embeddings.shape[1] != shape[1]:
+        return
+
+    with open(embeddings_path, 'r+b') as f:
+        f.seek(_HEADER_SIZE + count * shape[1] * 4)
+        f.write(embeddings.tobytes())
+        f.truncate()
+        f.seek(0)
+        f.write(_npy_header('<f4', (count + len(embeddings), shape[1])))
+        _fsync(f)
+
+
+def write_embeddings(embeddings, gallery_dir=GALLERY_DIR):
+    """
+    Replace embeddings.npy with features for every committed row
+
+    The caller must hold locked(gallery_dir) and pass exactly one row per
+    undeleted face, in snapshot order; deleted rows are stored as zeros.
+    The file is written to a temporary name and swapped in.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype='<f4')
+    rows = committed_state(gallery_dir)[1]
+    if len(embeddings) < rows:
+        tombstones = read_tombstones(gallery_dir)
+        keep = np.ones(rows, dtype=bool)
+        keep[tombstones[tombstones < rows]] = False
+        full = np.zeros((rows, embeddings.shape[1]), dtype='<f4')
+        full[keep] = embeddings
+        embeddings = full
+    path = os.path.join(gallery_dir, EMBEDDINGS_FILE)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(_npy_header('<f4', embeddings.shape))
+        f.write(embeddings.tobytes())
+        _fsync(f)
+    os.replace(path + '.tmp', path)
+
+
+def remove_embeddings(gallery_dir=GALLERY_DIR):
+    """
+    Drop stored embeddings, e.g. when switching back to raw pixels
+    """
+    path = os.path.join(gallery_dir, EMBEDDINGS_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def bump_generation(gallery_dir=GALLERY_DIR):
+    """
+    Mark the gallery as rewritten so every cached model reloads it in full
+
+    The caller must hold locked(gallery_dir).
+    """
+    manifest = _read_manifest(gallery_dir)
+    manifest['generation'] += 1
+    _write_manifest(gallery_dir, manifest)
+    return manifest['generation']
+
+
+def _finish_compaction(gallery_dir):
+    """
+    Swap in the side files of a compaction and publish a new generation
+
+    Safe to repeat after a crash part-way through. The caller must hold
+    locked(gallery_dir).
+    """
+    manifest = _read_manifest(gallery_dir)
+    suffix = manifest.get('compacting')
+    if not suffix:
+        return
+    for name in _COMPACTED_FILES:
+        path = os.path.join(gallery_dir, name)
+        if os.path.exists(path + suffix):
+            os.replace(path + suffix, path)
+    del manifest['compacting']
+    manifest['generation'] += 1
+    _write_manifest(gallery_dir, manifest)
+
+
+def _write_npy(path, descr, shape, chunks):
+    with open(path, 'wb') as f:
+        f.write(_npy_header(descr, shape))
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk).tobytes())
+        _fsync(f)
+
+
+def compact(gallery_dir=GALLERY_DIR, chunk_rows=4096):
+    """
+    Rewrite the gallery without deleted rows, merging duplicate identity names
+
+    The remaining face rows are copied to side files without holding the
+    lock, so registration carries on meanwhile. Rows appended during the
+    copy are added under the lock just before the files are swapped in.
+    The order of the remaining rows does not change.
+
+    Returns:
+        int: Rows removed, or None if the gallery was changed by another
+        deletion or rewrite during the copy (nothing is swapped in then)
+    """
+    manifest = _read_manifest(gallery_dir)
+    rows = committed_state(gallery_dir)[1]
+    faces, label_ids, _ = _open_files(gallery_dir, rows)
+    identities = _read_identities(gallery_dir)
+    tombstones = read_tombstones(gallery_dir)
+    tombstones = tombstones[tombstones < rows]
+    canonical = _canonical_ids(identities)
+    if manifest.get('compacting') or (not len(tombstones) and canonical is None):
+        return 0
+
+    keep = np.ones(rows, dtype=bool)
+    keep[tombstones] = False
+    live_rows = int(keep.sum())
+    suffix = f'.compact-{os.getpid()}-{threading.get_ident()}'
+    faces_path = os.path.join(gallery_dir, FACES_FILE)
+    side_files = [os.path.join(gallery_dir, name) + suffix for name in _COMPACTED_FILES]
+    try:
+        _write_npy(faces_path + suffix, '|u1', (live_rows, FACE_DIM),
+                   (faces[start:start + chunk_rows][keep[start:start + chunk_rows]]
+                    for start in range(0, rows, chunk_rows)))
+
+        with locked(gallery_dir):
+            if _read_manifest(gallery_dir)['generation'] != manifest['generation']:
+                return None
+            new_rows = committed_state(gallery_dir)[1]
+            faces, label_ids, embeddings = _open_files(gallery_dir, new_rows)
+            identities = _read_identities(gallery_dir)
+            keep = np.concatenate([keep, np.ones(new_rows - rows, dtype=bool)])
+            tail = faces[rows:new_rows]
+            if len(tail):
+                with open(faces_path + suffix, 'r+b') as f:
+                    f.seek(0, os.SEEK_END)
+                    f.write(np.ascontiguousarray(tail).tobytes())
+                    f.seek(0)
+                    f.write(_npy_header('|u1', (live_rows + len(tail), FACE_DIM)))
+                    _fsync(f)
+
+            # Renumber identities by first use among the remaining rows
+            names = [identities[i] for i in np.asarray(label_ids)[keep]]
+            new_ids = {}
+            new_labels = np.array([new_ids.setdefault(name, len(new_ids)) for name in names], dtype='<i4')
+            _write_lines(os.path.join(gallery_dir, IDENTITIES_FILE) + suffix, new_ids)
+            _write_npy(os.path.join(gallery_dir, LABELS_FILE) + suffix, '<i4', new_labels.shape, [new_labels])
+            if embeddings is not None:
+                kept = embeddings[keep[:len(embeddings)]]
+                _write_npy(os.path.join(gallery_dir, EMBEDDINGS_FILE) + suffix, '<f4', kept.shape, [kept])
+            with open(os.path.join(gallery_dir, TOMBSTONES_FILE) + suffix, 'wb') as f:
+                np.save(f, np.empty(0, dtype=np.int64))
+                _fsync(f)
+
+            manifest = _read_manifest(gallery_dir)
+            manifest['compacting'] = suffix
+            _write_manifest(gallery_dir, manifest)
+            _finish_compaction(gallery_dir)
+        return new_rows - len(new_labels)
+    finally:
+        # Kept only if the swap failed part-way, for ensure_gallery to finish
+        if _read_manifest(gallery_dir).get('compacting') != suffix:
+            for path in side_files:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def migrate_from_pickles(names_path=LEGACY_NAMES_PATH, faces_path=LEGACY_FACES_PATH,
+                         gallery_dir=GALLERY_DIR):
+    """
+    One-shot migration of names.pkl/faces_data.pkl into the gallery
+
+    The pickles are only imported into a gallery created here, and the
+    manifest then records the migration, so identities deleted later are
+    never imported again, even once no rows are left. The check, the
+    import and the record all happen under the gallery lock, so processes
+    starting together on a fresh checkout import the pickles only once.
+
+    Returns:
+        int: Number of rows migrated
+    """
+    os.makedirs(gallery_dir, exist_ok=True)
+    with locked(gallery_dir):
+        if not gallery_exists(gallery_dir):
+            create_gallery(gallery_dir, migrated=False)
+        manifest = _read_manifest(gallery_dir)
+        if manifest.get('migrated', True):
+            return 0
+        count = _import_pickles(names_path, faces_path, gallery_dir)
+        manifest['migrated'] = True
+        _write_manifest(gallery_dir, manifest)
+    return count
+
+
+def _import_pickles(names_path, faces_path, gallery_dir):
+    """
+    Append the rows of the legacy pickles; the caller holds locked(gallery_dir)
+    """
+    if not os.path.exists(names_path) or not os.path.exists(faces_path):
+        return 0
+
+    with open(names_path, 'rb') as w:
+        names = pickle.load(w)
+    with open(faces_path, 'rb') as f:
+        faces = pickle.load(f)
+
+    count = min(len(names), len(faces))
+    if count == 0:
+        return 0
+    _append_locked(np.asarray(faces)[:count], [str(n) for n in names[:count]], gallery_dir)
+    return count
+
+
+def ensure_gallery(gallery_dir=GALLERY_DIR):
+    """
+    Make sure the gallery exists, migrating legacy pickles on first use
+
+    Returns:
+        int: Number of committed rows
+    """
+    if not gallery_exists(gallery_dir) or not _read_manifest(gallery_dir).get('migrated', True):
+        # Checked again under the lock; this only skips taking it once migrated
+        migrate_from_pickles(gallery_dir=gallery_dir)
+    if _read_manifest(gallery_dir).get('compacting'):
+        # A compaction stopped part-way through swapping its files in
+        with locked(gallery_dir):
+            _finish_compaction(gallery_dir)
+    return committed_state(gallery_dir)[1]
+
+
+if __name__ == "__main__":
+    migrated = migrate_from_pickles()
+    print(f"Migrated {migrated} face rows into {GALLERY_DIR}")
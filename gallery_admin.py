@@ -0,0 +1,326 @@
+"""
+Gallery maintenance
+
+Lists identities with their capture counts, deletes, replaces and merges
+identities, and trims identities to their most varied captures. Deleting
+only records tombstones, and merging only renames entries in
+identities.txt, so none of these operations rewrite the face data. Once
+enough rows are deleted, compaction rewrites the gallery without them in
+the background.
+
+Each operation bumps the gallery generation, so cached models reload, and
+keeps a saved IVF index in step with the remaining rows.
+
+    python gallery_admin.py list
+    python gallery_admin.py delete "Jane Doe"
+    python gallery_admin.py merge "jane" "Jane D" --into "Jane Doe"
+    python gallery_admin.py cap --max 20
+    python gallery_admin.py dedupe
+    python gallery_admin.py compact
+"""
+import argparse
+import collections
+import threading
+
+import numpy as np
+
+import gallery
+import gallery_index
+
+# Fraction of deleted rows at which a background compaction is started
+COMPACT_RATIO = 0.2
+
+# Captures of one person closer than this (RMS difference over the 0-255
+# range, as in enrollment.py) count as duplicates
+DUPLICATE_DIFFERENCE = 0.02
+
+_compaction = None
+_compaction_lock = threading.Lock()
+
+
+def list_identities(gallery_dir=gallery.GALLERY_DIR):
+    """
+    Capture count of every identity with at least one capture
+
+    Returns:
+        collections.OrderedDict: {name: count} in registration order
+    """
+    gallery.ensure_gallery(gallery_dir)
+    return collections.OrderedDict(gallery.identity_counts(gallery_dir))
+
+
+def _delete_rows(snapshot, rows, gallery_dir):
+    """
+    Tombstone snapshot rows (positions in the snapshot); the caller holds the lock
+    """
+    keep = np.ones(len(snapshot), dtype=bool)
+    keep[rows] = False
+    gallery.add_tombstones(snapshot.row_ids[~keep], gallery_dir)
+    gallery_index.keep_rows(keep, gallery_dir)
+    gallery.bump_generation(gallery_dir)
+
+
+def _identity_rows(snapshot, name):
+    ids = [i for i, identity in enumerate(snapshot.identities) if identity == name]
+    return np.flatnonzero(np.isin(snapshot.label_ids, ids))
+
+
+def delete_identity(name, gallery_dir=gallery.GALLERY_DIR, compact=True):
+    """
+    Delete every capture of a person
+
+    Returns:
+        int: Captures deleted
+    """
+    gallery.ensure_gallery(gallery_dir)
+    with gallery.locked(gallery_dir):
+        snapshot = gallery.open_gallery(gallery_dir)
+        rows = _identity_rows(snapshot, name)
+        if len(rows):
+            _delete_rows(snapshot, rows, gallery_dir)
+    if compact:
+        schedule_compaction(gallery_dir)
+    return len(rows)
+
+
+def replace_identity(name, faces, gallery_dir=gallery.GALLERY_DIR, compact=True):
+    """
+    Store new captures of a person and delete the ones they had before
+
+    The new captures are appended first, so the person stays recognizable
+    throughout.
+
+    Returns:
+        int: Captures deleted
+    """
+    gallery.ensure_gallery(gallery_dir)
+    rows = gallery.committed_state(gallery_dir)[1]
+    gallery.append_faces(faces, name, gallery_dir)
+    with gallery.locked(gallery_dir):
+        snapshot = gallery.open_gallery(gallery_dir)
+        old = _identity_rows(snapshot, name)
+        old = old[snapshot.row_ids[old] < rows]
+        if len(old):
+            _delete_rows(snapshot, old, gallery_dir)
+    if compact:
+        schedule_compaction(gallery_dir)
+    return len(old)
+
+
+def merge_identities(sources, target, gallery_dir=gallery.GALLERY_DIR):
+    """
+    Give the captures of every source identity the target name
+
+    Only identities.txt is rewritten. Merging a single source into a new
+    name renames it.
+
+    Returns:
+        int: Captures that now carry the target name
+    """
+    gallery.ensure_gallery(gallery_dir)
+    with gallery.locked(gallery_dir):
+        identities = gallery.open_gallery(gallery_dir).identities
+        missing = [name for name in sources if name not in identities]
+        if missing:
+            raise ValueError(f"Unknown identities: {', '.join(missing)}")
+        identities = [target if name in sources else name for name in identities]
+        gallery.write_identities(identities, gallery_dir)
+        gallery.bump_generation(gallery_dir)
+    return list_identities(gallery_dir).get(target, 0)
+
+
+def _scaled(faces):
+    return np.asarray(faces, dtype=np.float32) / 255
+
+
+def _sq_distances(vectors):
+    norms = np.einsum('ij,ij->i', vectors, vectors)
+    sq_dist = norms[:, None] + norms[None, :] - 2 * vectors @ vectors.T
+    return np.maximum(sq_dist, 0, out=sq_dist)
+
+
+def most_varied(faces, count):
+    """
+    Pick count captures that cover a person's appearance
+
+    Starts with the capture closest to the person's average and repeatedly
+    adds the capture farthest from all those already picked.
+
+    Returns:
+        np.ndarray: Sorted positions of the picked captures
+    """
+    vectors = _scaled(faces)
+    if len(vectors) <= count:
+        return np.arange(len(vectors))
+    mean = vectors.mean(axis=0)
+    picked = [int(np.argmin(np.einsum('ij,ij->i', vectors - mean, vectors - mean)))]
+    nearest = np.full(len(vectors), np.inf, dtype=np.float32)
+    for _ in range(count - 1):
+        diff = vectors - vectors[picked[-1]]
+        nearest = np.minimum(nearest, np.einsum('ij,ij->i', diff, diff))
+        nearest[picked] = -1
+        picked.append(int(np.argmax(nearest)))
+    return np.sort(picked)
+
+
+def duplicates(faces, min_difference=DUPLICATE_DIFFERENCE):
+    """
+    Captures within min_difference of an earlier capture of the same person
+
+    Returns:
+        np.ndarray: Positions of the later copies
+    """
+    vectors = _scaled(faces)
+    close = _sq_distances(vectors) < (min_difference ** 2) * vectors.shape[1]
+    np.fill_diagonal(close, False)
+    dropped = np.zeros(len(vectors), dtype=bool)
+    for i in range(len(vectors)):
+        if not dropped[i]:
+            later = close[i].copy()
+            later[:i + 1] = False
+            dropped |= later
+    return np.flatnonzero(dropped)
+
+
+def _trim(select, name, gallery_dir, compact):
+    """
+    Delete the captures select(faces) returns for one or every identity
+    """
+    gallery.ensure_gallery(gallery_dir)
+    removed = collections.OrderedDict()
+    with gallery.locked(gallery_dir):
+        snapshot = gallery.open_gallery(gallery_dir)
+        names = [name] if name else list(collections.OrderedDict.fromkeys(snapshot.identities))
+        dropped = []
+        for identity in names:
+            rows = _identity_rows(snapshot, identity)
+            drop = rows[select(snapshot.faces[rows])]
+            if len(drop):
+                removed[identity] = len(drop)
+                dropped.append(drop)
+        if dropped:
+            _delete_rows(snapshot, np.concatenate(dropped), gallery_dir)
+    if compact:
+        schedule_compaction(gallery_dir)
+    return removed
+
+
+def cap_identities(max_captures, name=None, gallery_dir=gallery.GALLERY_DIR, compact=True):
+    """
+    Keep at most max_captures of the most varied captures per identity
+
+    Returns:
+        dict: {name: captures deleted} for the identities that were trimmed
+    """
+    def select(faces):
+        keep = np.zeros(len(faces), dtype=bool)
+        keep[most_varied(faces, max_captures)] = True
+        return np.flatnonzero(~keep)
+    return _trim(select, name, gallery_dir, compact)
+
+
+def dedupe(min_difference=DUPLICATE_DIFFERENCE, name=None, gallery_dir=gallery.GALLERY_DIR, compact=True):
+    """
+    Delete near-identical captures of the same person, keeping the earliest
+
+    Returns:
+        dict: {name: captures deleted} for the identities that had duplicates
+    """
+    return _trim(lambda faces: duplicates(faces, min_difference), name, gallery_dir, compact)
+
+
+def deleted_ratio(gallery_dir=gallery.GALLERY_DIR):
+    """
+    Fraction of committed rows that are deleted and awaiting compaction
+    """
+    rows = gallery.committed_state(gallery_dir)[1]
+    return len(gallery.read_tombstones(gallery_dir)) / rows if rows else 0.0
+
+
+def schedule_compaction(gallery_dir=gallery.GALLERY_DIR, min_ratio=COMPACT_RATIO):
+    """
+    Compact the gallery on a background thread once enough rows are deleted
+
+    At most one compaction runs per process at a time.
+
+    Returns:
+        threading.Thread: The running compaction, or None if none is needed
+    """
+    global _compaction
+    with _compaction_lock:
+        if _compaction is not None and _compaction.is_alive():
+            return _compaction
+        ratio = deleted_ratio(gallery_dir)
+        if ratio == 0 or ratio < min_ratio:
+            return None
+        _compaction = threading.Thread(target=_compact, args=(gallery_dir,), daemon=True)
+        _compaction.start()
+        return _compaction
+
+
+def _compact(gallery_dir):
+    try:
+        # A concurrent deletion makes compact() give up; the next attempt sees it
+        for _ in range(3):
+            if gallery.compact(gallery_dir) is not None:
+                return
+    except Exception as e:
+        print(f"Error compacting gallery: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the face gallery")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="List identities and their capture counts")
+    delete_parser = subparsers.add_parser('delete', help="Delete every capture of identities")
+    delete_parser.add_argument('names', nargs='+')
+    merge_parser = subparsers.add_parser('merge', help="Merge identities into one name (or rename one)")
+    merge_parser.add_argument('names', nargs='+')
+    merge_parser.add_argument('--into', required=True, help="Name the merged identity gets")
+    cap_parser = subparsers.add_parser('cap', help="Keep only the most varied captures per identity")
+    cap_parser.add_argument('--max', type=int, required=True, help="Captures kept per identity")
+    cap_parser.add_argument('--name', help="Only trim this identity")
+    dedupe_parser = subparsers.add_parser('dedupe', help="Delete near-identical captures")
+    dedupe_parser.add_argument('--min-difference', type=float, default=DUPLICATE_DIFFERENCE,
+                               help="RMS difference (0-1) below which captures are duplicates")
+    dedupe_parser.add_argument('--name', help="Only dedupe this identity")
+    subparsers.add_parser('compact', help="Rewrite the gallery without deleted rows now")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        identities = list_identities()
+        for name, count in identities.items():
+            print(f"{count:6d}  {name}")
+        print(f"{sum(identities.values())} captures of {len(identities)} identities, "
+              f"{deleted_ratio():.0%} of rows awaiting compaction")
+        return
+
+    if args.command == 'delete':
+        for name in args.names:
+            print(f"Deleted {delete_identity(name, compact=False)} captures of {name}")
+    elif args.command == 'merge':
+        count = merge_identities(args.names, args.into)
+        print(f"{args.into} now has {count} captures")
+    elif args.command in ('cap', 'dedupe'):
+        if args.command == 'cap':
+            removed = cap_identities(args.max, args.name, compact=False)
+        else:
+            removed = dedupe(args.min_difference, args.name, compact=False)
+        for name, count in removed.items():
+            print(f"Deleted {count} captures of {name}")
+        print(f"Deleted {sum(removed.values())} captures in total")
+
+    if args.command == 'compact':
+        removed = gallery.compact()
+        print("Gallery changed during compaction; run it again" if removed is None
+              else f"Compacted gallery, removed {removed} rows")
+    else:
+        # The process exits right away, so wait for the compaction instead of leaving it behind
+        compaction = schedule_compaction()
+        if compaction is not None:
+            compaction.join()
+            print("Compacted gallery")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Nearest-neighbour indexes over the gallery vectors
+
+BatchRecognizer asks an index for the k nearest gallery rows of each query.
+Two backends are available:
+
+    exact   Brute-force distances against every stored vector
+    ivf     Inverted-file index: vectors are bucketed by their nearest k-means
+            centroid and a query only scans the nprobe closest buckets
+
+The IVF index does not copy the vectors into its own file. Only the centroids
+and the bucket of each row are persisted, in Data/gallery/index_ivf.npz, and
+the vectors themselves are read from the gallery's faces.npy/embeddings.npy.
+Rows appended after the index was built are assigned to buckets on load or
+on insert, so registrations never require a rebuild.
+
+Usage:
+    python gallery_index.py build --nlist 256 --nprobe 8
+    python gallery_index.py remove
+"""
+import argparse
+import os
+
+import numpy as np
+
+import gallery
+
+INDEX_FILE = 'index_ivf.npz'
+
+
+class ExactIndex:
+    """
+    Brute-force index with precomputed squared norms
+
+    Args:
+        vectors (np.ndarray): (N, D) gallery vectors
+        dtype: float32 (default) or float64 for exact distances
+        copy (bool): Convert the vectors to dtype up front. Pass False to keep
+            using the given array (e.g. a read-only memmap shared by several
+            processes) and convert it in chunks at query time
+        chunk_rows (int): Rows converted per chunk when copy is False
+    """
+
+    name = 'exact'
+
+    def __init__(self, vectors, dtype=np.float32, copy=True, chunk_rows=4096):
+        self.dtype = dtype
+        self.chunk_rows = chunk_rows
+        if copy:
+            self.vectors = np.asarray(vectors, dtype=dtype)
+        else:
+            self.vectors = vectors
+        self.sq_norms = self._sq_norms(self.vectors)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _chunks(self, rows):
+        """
+        Yield (start, block) pieces of rows converted to dtype
+        """
+        if rows.dtype == self.dtype:
+            yield 0, rows
+            return
+        for start in range(0, len(rows), self.chunk_rows):
+            yield start, np.asarray(rows[start:start + self.chunk_rows], dtype=self.dtype)
+
+    def _sq_norms(self, rows):
+        norms = np.empty(len(rows), dtype=self.dtype)
+        for start, block in self._chunks(rows):
+            norms[start:start + len(block)] = np.einsum('ij,ij->i', block, block)
+        return norms
+
+    def add(self, vectors):
+        """
+        Append vectors, computing norms only for the new rows
+        """
+        vectors = np.asarray(vectors, dtype=self.vectors.dtype).reshape(len(vectors), -1)
+        self.vectors = np.concatenate([self.vectors, vectors])
+        self.sq_norms = np.concatenate([self.sq_norms, self._sq_norms(vectors)])
+
+    def _sq_distances(self, queries, rows=None):
+        """
+        Squared distances from queries to all rows (or to the given row ids)
+        """
+        if rows is None:
+            sq_dist = np.empty((len(queries), len(self)), dtype=self.dtype)
+            for start, block in self._chunks(self.vectors):
+                np.matmul(queries, block.T, out=sq_dist[:, start:start + len(block)])
+            norms = self.sq_norms
+        else:
+            sq_dist = queries @ np.asarray(self.vectors[rows], dtype=self.dtype).T
+            norms = self.sq_norms[rows]
+        sq_dist *= -2
+        sq_dist += np.einsum('ij,ij->i', queries, queries)[:, None]
+        sq_dist += norms[None, :]
+        np.maximum(sq_dist, 0, out=sq_dist)
+        return sq_dist
+
+    @staticmethod
+    def _top_k(sq_dist, k):
+        """
+        Indices and distances of the k smallest entries per row, nearest first
+        """
+        k = min(k, sq_dist.shape[1])
+        if k < sq_dist.shape[1]:
+            nearest = np.argpartition(sq_dist, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.broadcast_to(np.arange(sq_dist.shape[1]), sq_dist.shape).copy()
+        rows = np.arange(len(sq_dist))[:, None]
+        order = np.argsort(sq_dist[rows, nearest], axis=1, kind='stable')
+        nearest = nearest[rows, order]
+        return np.sqrt(sq_dist[rows, nearest]), nearest
+
+    def search(self, queries, k):
+        """
+        Find the k nearest rows for each query
+
+        Returns:
+            tuple: (distances, indices), both (len(queries), k), nearest first
+        """
+        queries = np.asarray(queries, dtype=self.dtype).reshape(len(queries), -1)
+        return self._top_k(self._sq_distances(queries), k)
+
+
+def _kmeans(sample, nlist, iterations=20, seed=0):
+    """
+    Plain Lloyd's k-means returning (nlist, D) float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    sample_norms = np.einsum('ij,ij->i', sample, sample)
+    for _ in range(iterations):
+        sq_dist = sample_norms[:, None] - 2 * sample @ centroids.T + np.einsum('ij,ij->i', centroids, centroids)
+        assignment = sq_dist.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty buckets from random points so no list stays unused
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), size=len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex(ExactIndex):
+    """
+    Inverted-file index with exact re-ranking inside the probed buckets
+
+    Args:
+        vectors (np.ndarray): (N, D) gallery vectors
+        nlist (int, optional): Number of buckets; default about 4 * sqrt(N)
+        nprobe (int): Buckets scanned per query; higher is slower but more accurate
+        centroids (np.ndarray, optional): Previously trained centroids
+        assignments (np.ndarray, optional): Bucket of each of the first rows
+        train_size (int): Vectors sampled to train the centroids
+        **options: Passed to ExactIndex (dtype, copy, chunk_rows)
+    """
+
+    name = 'ivf'
+
+    def __init__(self, vectors, nlist=None, nprobe=8, centroids=None, assignments=None,
+                 train_size=50000, **options):
+        super().__init__(vectors, **options)
+        self.nprobe = nprobe
+        if centroids is None:
+            nlist = nlist or max(1, int(4 * np.sqrt(len(self))))
+            nlist = min(nlist, len(self))
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(len(self), size=min(train_size, len(self)), replace=False))
+            sample = np.asarray(self.vectors[sample_rows], dtype=np.float32)
+            centroids = _kmeans(sample, nlist)
+        self.centroids = np.asarray(centroids, dtype=self.dtype)
+        self.centroid_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+
+        if assignments is None:
+            assignments = np.empty(0, dtype=np.int32)
+        assignments = np.asarray(assignments, dtype=np.int32)[:len(self)]
+        if len(assignments) < len(self):
+            assignments = np.concatenate([assignments, self._assign(self.vectors[len(assignments):])])
+        self.assignments = assignments
+        self._build_lists()
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def _assign(self, vectors):
+        assignment = np.empty(len(vectors), dtype=np.int32)
+        for start, block in self._chunks(vectors):
+            sq_dist = self.centroid_norms[None, :] - 2 * block @ self.centroids.T
+            assignment[start:start + len(block)] = sq_dist.argmin(axis=1)
+        return assignment
+
+    def _build_lists(self):
+        order = np.argsort(self.assignments, kind='stable')
+        bounds = np.searchsorted(self.assignments[order], np.arange(self.nlist + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.nlist)]
+
+    def add(self, vectors):
+        """
+        Append vectors and drop each into its nearest bucket
+        """
+        start = len(self)
+        super().add(vectors)
+        new_assignments = self._assign(self.vectors[start:])
+        self.assignments = np.concatenate([self.assignments, new_assignments])
+        # Replace rather than mutate the lists, which shallow copies share
+        self.lists = list(self.lists)
+        for bucket in np.unique(new_assignments):
+            rows = start + np.flatnonzero(new_assignments == bucket)
+            self.lists[bucket] = np.concatenate([self.lists[bucket], rows])
+
+    def search(self, queries, k):
+        """
+        Find the k nearest rows among the probed buckets
+
+        When the probed buckets hold fewer than k rows the leftover slots
+        have distance inf and index -1.
+        """
+        queries = np.asarray(queries, dtype=self.dtype).reshape(len(queries), -1)
+        nprobe = min(self.nprobe, self.nlist)
+        coarse = self.centroid_norms[None, :] - 2 * queries @ self.centroids.T
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        k_out = min(k, len(self))
+        distances = np.full((len(queries), k_out), np.inf, dtype=self.dtype)
+        indices = np.full((len(queries), k_out), -1, dtype=np.intp)
+        for i, buckets in enumerate(probes):
+            rows = np.concatenate([self.lists[b] for b in buckets])
+            if len(rows) == 0:
+                continue
+            dist, nearest = self._top_k(self._sq_distances(queries[i:i + 1], rows), k_out)
+            distances[i, :dist.shape[1]] = dist[0]
+            indices[i, :dist.shape[1]] = rows[nearest[0]]
+        return distances, indices
+
+    def state(self):
+        return {'centroids': self.centroids, 'assignments': self.assignments, 'nprobe': self.nprobe}
+
+
+def load_index(vectors, gallery_dir=gallery.GALLERY_DIR, **options):
+    """
+    Build the configured index over the gallery vectors
+
+    Uses the persisted IVF index if there is one whose dimensions match the
+    vectors, otherwise an ExactIndex.
+    """
+    path = os.path.join(gallery_dir, INDEX_FILE)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            centroids = data['centroids']
+            if centroids.shape[1] == np.shape(vectors)[1]:
+                return IVFIndex(vectors, nprobe=int(data['nprobe']), centroids=centroids,
+                                assignments=data['assignments'], **options)
+    return ExactIndex(vectors, **options)
+
+
+def save_index(index, gallery_dir=gallery.GALLERY_DIR):
+    """
+    Persist an IVF index's centroids and bucket assignments next to the gallery
+    """
+    path = os.path.join(gallery_dir, INDEX_FILE)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **index.state())
+    os.replace(tmp_path, path)
+
+
+def keep_rows(keep, gallery_dir=gallery.GALLERY_DIR):
+    """
+    Drop the bucket assignments of deleted gallery rows from a saved IVF index
+
+    Args:
+        keep (np.ndarray): (N,) bool, False for each snapshot row being deleted
+    """
+    path = os.path.join(gallery_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return
+    with np.load(path) as data:
+        state = dict(data)
+    assignments = state['assignments']
+    state['assignments'] = assignments[np.asarray(keep)[:len(assignments)]]
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **state)
+    os.replace(tmp_path, path)
+
+
+def remove_index(gallery_dir=gallery.GALLERY_DIR):
+    path = os.path.join(gallery_dir, INDEX_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def build_index(nlist=None, nprobe=8, gallery_dir=gallery.GALLERY_DIR):
+    """
+    Train an IVF index on the gallery's current vectors and persist it
+
+    Returns:
+        IVFIndex: The trained index
+    """
+    import features
+
+    gallery.ensure_gallery(gallery_dir)
+    with gallery.locked(gallery_dir):
+        snapshot = gallery.open_gallery(gallery_dir)
+        vectors = features.gallery_vectors(snapshot, features.load_extractor(gallery_dir))
+        index = IVFIndex(vectors, nlist=nlist, nprobe=nprobe, copy=False)
+        save_index(index, gallery_dir)
+        gallery.bump_generation(gallery_dir)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the gallery's nearest-neighbour index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Train and save an IVF index")
+    build.add_argument('--nlist', type=int, help="Number of buckets (default about 4 * sqrt(N))")
+    build.add_argument('--nprobe', type=int, default=8, help="Buckets scanned per query")
+    subparsers.add_parser('remove', help="Go back to exact search")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index = build_index(args.nlist, args.nprobe)
+        print(f"Built IVF index over {len(index)} vectors with {index.nlist} buckets (nprobe={index.nprobe})")
+    else:
+        with gallery.locked():
+            remove_index()
+            gallery.bump_generation()
+        print("Removed IVF index; recognition uses exact search")
+
+
+if __name__ == "__main__":
+    main()
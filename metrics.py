@@ -0,0 +1,290 @@
+"""
+Lightweight timing and counter instrumentation for the hot paths
+
+Stages are timed with `with metrics.timed('detect'):` and kept as rolling
+windows of recent durations plus running totals, so recording a sample is a
+perf_counter call and a deque append under a lock. The app's sidebar shows
+the percentiles, and they can be exported in Prometheus text format to a
+file or served over HTTP for scraping.
+
+For deeper digging a session can be profiled with SamplingProfiler, which
+samples the stacks of every thread (capture and recognition workers
+included) and writes collapsed stacks for flame graph tools, or with
+CProfiler, which runs cProfile on the calling thread.
+"""
+import collections
+import contextlib
+import cProfile
+import os
+import sys
+import threading
+import time
+
+METRICS_FILE = 'Data/metrics.prom'
+PROFILE_DIR = 'Data/profiles'
+PREFIX = 'attendance'
+
+PROFILE_OFF = 'Off'
+PROFILE_SAMPLING = 'Sampling (all threads)'
+PROFILE_CPROFILE = 'cProfile (page thread)'
+
+
+def _quantile(ordered, q):
+    """
+    Linearly interpolated quantile of a sorted list (NaN if empty)
+    """
+    if not ordered:
+        return float('nan')
+    position = q * (len(ordered) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class Histogram:
+    """
+    Rolling window of recent observations plus running count and sum
+
+    Args:
+        window (int): Number of recent observations kept for percentiles
+    """
+
+    def __init__(self, window=1024):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        recent = sorted(self.samples)
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'quantiles': {q: _quantile(recent, q) for q in quantiles},
+        }
+
+
+class Registry:
+    """
+    Named stage histograms (seconds) and counters, safe to share across threads
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = collections.Counter()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.window)
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        """
+        Time the body of a with block as one observation of stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        """
+        Copy of every stage summary and counter
+
+        Returns:
+            tuple: ({stage: summary}, {counter: value})
+        """
+        with self._lock:
+            histograms = {stage: Histogram(self.window) for stage in self._histograms}
+            for stage, histogram in self._histograms.items():
+                histograms[stage].samples.extend(histogram.samples)
+                histograms[stage].count = histogram.count
+                histograms[stage].total = histogram.total
+            counters = dict(self._counters)
+        return {stage: h.summary() for stage, h in sorted(histograms.items())}, counters
+
+    def to_prometheus(self):
+        """
+        Render the metrics in the Prometheus text exposition format
+        """
+        stages, counters = self.snapshot()
+        lines = [f"# HELP {PREFIX}_stage_seconds Time spent in each stage of the attendance loop",
+                 f"# TYPE {PREFIX}_stage_seconds summary"]
+        for stage, summary in stages.items():
+            for quantile, value in summary['quantiles'].items():
+                lines.append(f'{PREFIX}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {value:.6g}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {summary["sum"]:.6g}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            lines.append(f"{PREFIX}_{name}_total {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path=METRICS_FILE):
+        """
+        Write the Prometheus text atomically, e.g. for node_exporter's textfile collector
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(path + '.tmp', path)
+        return path
+
+
+REGISTRY = Registry()
+
+observe = REGISTRY.observe
+timed = REGISTRY.timed
+inc = REGISTRY.inc
+snapshot = REGISTRY.snapshot
+to_prometheus = REGISTRY.to_prometheus
+write_prometheus = REGISTRY.write_prometheus
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port, registry=REGISTRY):
+    """
+    Serve /metrics on a background thread; later calls reuse the first server
+
+    Returns:
+        http.server.ThreadingHTTPServer: The running server
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads at a fixed interval
+
+    The result is written as collapsed stacks ("frame;frame;frame count" per
+    line), the input format of flamegraph.pl and speedscope.
+
+    Args:
+        interval (float): Seconds between samples
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path=None):
+        """
+        Write collapsed stacks, by default to Data/profiles/sample-<time>.txt
+        """
+        path = path or os.path.join(PROFILE_DIR, time.strftime("sample-%Y%m%d-%H%M%S.txt"))
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class CProfiler:
+    """
+    cProfile over the thread that starts it, with the same interface as SamplingProfiler
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+        return self
+
+    def stop(self):
+        self.profiler.disable()
+
+    def write(self, path=None):
+        """
+        Dump pstats data, by default to Data/profiles/cprofile-<time>.prof
+        """
+        path = path or os.path.join(PROFILE_DIR, time.strftime("cprofile-%Y%m%d-%H%M%S.prof"))
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.profiler.dump_stats(path)
+        return path
+
+
+def create_profiler(mode):
+    """
+    Started profiler for a PROFILE_* mode, or None for PROFILE_OFF
+    """
+    if mode == PROFILE_SAMPLING:
+        return SamplingProfiler().start()
+    if mode == PROFILE_CPROFILE:
+        return CProfiler().start()
+    return None
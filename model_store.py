@@ -0,0 +1,212 @@
+import copy
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import features
+import gallery
+import gallery_index
+import recognizer as recognizer_module
+
+N_NEIGHBORS = 5
+CALIBRATION_FILE = 'recognition.json'
+
+MODE_KNN = 'knn'
+MODE_CENTROID = 'centroid'
+
+
+def load_calibration(gallery_dir=gallery.GALLERY_DIR):
+    """
+    Open-set settings written by `python evaluate.py calibrate`, or None
+
+    Returns:
+        dict: 'mode' ('knn' or 'centroid'), 'threshold', and the 'extractor'
+        and 'dim' of the features the threshold was calibrated on
+    """
+    try:
+        with open(os.path.join(gallery_dir, CALIBRATION_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_calibration(calibration, gallery_dir=gallery.GALLERY_DIR):
+    """
+    Store open-set settings; the caller holds the gallery lock and bumps the generation
+    """
+    path = os.path.join(gallery_dir, CALIBRATION_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(calibration, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def remove_calibration(gallery_dir=gallery.GALLERY_DIR):
+    path = os.path.join(gallery_dir, CALIBRATION_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class LoadedModel:
+    """
+    A recognizer together with the labels it was built from
+
+    Attributes:
+        recognizer (BatchRecognizer or CentroidRecognizer): Recognizer over the gallery features
+        extractor: Feature extractor applied to face crops before recognition
+        labels (list): Name for each gallery row
+        timings (dict): Seconds spent in 'load' and 'fit' for the last (re)build
+    """
+
+    def __init__(self, recognizer, extractor, labels, timings):
+        self.recognizer = recognizer
+        self.extractor = extractor
+        self.labels = labels
+        self.timings = timings
+
+    def __len__(self):
+        return len(self.labels)
+
+    def recognize(self, samples):
+        """
+        Recognize raw (k, 7500) face crops, returning (names, distances)
+        """
+        return self.recognizer.recognize(self.extractor.transform(samples))
+
+    def predict(self, samples):
+        return np.asarray(self.recognize(samples)[0], dtype=object)
+
+    @property
+    def threshold(self):
+        return self.recognizer.threshold
+
+    def confidences(self, distances):
+        """
+        0-1 confidence for each distance, or None without a calibrated threshold
+        """
+        return recognizer_module.confidences(distances, self.threshold)
+
+
+class ModelStore:
+    """
+    Builds the fitted recognition model once and keeps it cached
+
+    The cache is keyed on the gallery's (generation, committed row count),
+    which is read from the gallery headers without mapping any data, so
+    Streamlit reruns reuse the same fitted model until the gallery changes.
+    Deletions and other rewrites bump the generation, so a larger row count
+    in the same generation means only the new tail rows have to be read.
+    """
+
+    def __init__(self, gallery_dir=gallery.GALLERY_DIR, n_neighbors=N_NEIGHBORS, copy_gallery=True):
+        self.gallery_dir = gallery_dir
+        self.n_neighbors = n_neighbors
+        self.copy_gallery = copy_gallery
+        self._lock = threading.Lock()
+        self._model = None
+        self._state = None
+
+    def _build(self, vectors, labels, extractor):
+        """
+        Build the recognizer selected by the gallery's calibration
+        """
+        calibration = load_calibration(self.gallery_dir) or {}
+        if (calibration.get('extractor'), calibration.get('dim')) != (extractor.name, extractor.dim):
+            # Calibrated on other features, so the threshold does not apply
+            calibration = {}
+        threshold = calibration.get('threshold')
+        if calibration.get('mode') == MODE_CENTROID:
+            return recognizer_module.CentroidRecognizer(vectors, labels, threshold=threshold)
+        index = gallery_index.load_index(vectors, self.gallery_dir, copy=self.copy_gallery)
+        return recognizer_module.BatchRecognizer(vectors, labels, n_neighbors=self.n_neighbors,
+                                                 index=index, threshold=threshold)
+
+    def _load(self, start_row=0):
+        start = time.perf_counter()
+        snapshot = gallery.open_gallery(self.gallery_dir)
+        extractor = self._model.extractor if start_row else features.load_extractor(self.gallery_dir)
+        vectors = features.gallery_vectors(snapshot, extractor, start_row)
+        labels = [snapshot.identities[i] for i in snapshot.label_ids[start_row:]]
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if start_row:
+            # Extend a shallow copy so sessions holding the old model are unaffected
+            recognizer = copy.copy(self._model.recognizer)
+            recognizer.add(vectors, labels)
+            labels = self._model.labels + labels
+        else:
+            recognizer = self._build(vectors, labels, extractor)
+        fit_seconds = time.perf_counter() - start
+
+        model = LoadedModel(recognizer, extractor, labels, {'load': load_seconds, 'fit': fit_seconds})
+        return model, (snapshot.generation, snapshot.rows)
+
+    def get(self):
+        """
+        Return the cached model, rebuilding it only if the gallery changed
+
+        Returns:
+            LoadedModel: The fitted model, or None if the gallery is empty or
+            every capture in it has been deleted
+        """
+        with self._lock:
+            gallery.ensure_gallery(self.gallery_dir)
+            state = gallery.committed_state(self.gallery_dir)
+            if state == self._state:
+                return self._model
+            if state[1] == 0:
+                return None
+
+            same_generation = self._state is not None and state[0] == self._state[0]
+            if self._model is not None and same_generation and state[1] > self._state[1]:
+                self._model, self._state = self._load(start_row=len(self._model))
+            else:
+                self._model, self._state = self._load()
+                if len(self._model) == 0:
+                    self._model = None
+            return self._model
+
+    def refresh(self):
+        """
+        Pick up captures appended since the model was last built
+
+        Only the new tail rows are read from the gallery; the existing rows
+        are reused from memory. Does nothing if no model has been built yet.
+        """
+        with self._lock:
+            if self._model is None:
+                return
+        self.get()
+
+    def invalidate(self):
+        """
+        Drop the cached model so the next get() reloads from disk
+        """
+        with self._lock:
+            self._model = None
+            self._state = None
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Return the process-wide ModelStore shared by all Streamlit sessions
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ModelStore()
+        return _default_store
+
+
+def get_model():
+    """
+    Shortcut for get_store().get()
+    """
+    return get_store().get()
@@ -0,0 +1,126 @@
+"""
+Motion-gated frame scheduling
+
+Most of the time nothing in front of the attendance camera changes. The
+scheduler measures how much of a tiny grayscale copy of each frame changed
+since the last look, which costs a few microseconds, and only passes frames
+on to detection and recognition at a rate that follows that signal: the
+maximum rate as soon as something moves, falling back to the minimum rate
+a little while after the scene goes quiet.
+"""
+import cv2
+import numpy as np
+
+import metrics
+
+
+class MotionDetector:
+    """
+    Fraction of pixels that changed between downsampled grayscale frames
+
+    Args:
+        step (int): Keep every step-th pixel in each direction
+        pixel_threshold (int): Grey-level change that counts a pixel as changed
+        blur (int): Box blur size applied to the small frame to suppress sensor noise
+    """
+
+    def __init__(self, step=8, pixel_threshold=20, blur=3):
+        self.step = step
+        self.pixel_threshold = pixel_threshold
+        self.blur = blur
+        self._previous = None
+
+    def small(self, frame):
+        gray = cv2.cvtColor(np.ascontiguousarray(frame[::self.step, ::self.step]), cv2.COLOR_BGR2GRAY)
+        return cv2.blur(gray, (self.blur, self.blur)) if self.blur > 1 else gray
+
+    def score(self, frame):
+        """
+        Changed fraction (0-1) since the previous frame scored; 1.0 for the first frame
+        """
+        small = self.small(frame)
+        previous, self._previous = self._previous, small
+        if previous is None or previous.shape != small.shape:
+            return 1.0
+        changed = cv2.absdiff(small, previous) > self.pixel_threshold
+        return float(np.count_nonzero(changed)) / changed.size
+
+    def reset(self):
+        self._previous = None
+
+
+class AdaptiveScheduler:
+    """
+    Decides which captured frames are worth processing
+
+    The rate jumps to max_fps when the changed fraction reaches
+    motion_threshold, stays there for hold seconds after the last motion,
+    then halves every decay seconds down to min_fps.
+
+    Args:
+        min_fps (float): Processing rate of a static scene
+        max_fps (float): Processing rate while there is motion; 0 processes every frame
+        motion_threshold (float): Changed fraction of the frame that counts as motion
+        hold (float): Seconds to stay at max_fps after the last motion
+        decay (float): Seconds for each halving of the rate after that
+        detector (MotionDetector, optional): Motion signal; default MotionDetector()
+    """
+
+    def __init__(self, min_fps=1.0, max_fps=15.0, motion_threshold=0.01, hold=2.0, decay=1.0,
+                 detector=None):
+        if min_fps <= 0:
+            raise ValueError("min_fps must be positive")
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.motion_threshold = motion_threshold
+        self.hold = hold
+        self.decay = decay
+        self.detector = detector or MotionDetector()
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.last_score = 0.0
+        self._last_motion = None
+        self._last_processed = None
+
+    def rate(self, now):
+        """
+        Current processing rate in frames per second (inf for every frame)
+        """
+        top = self.max_fps or float('inf')
+        if self._last_motion is None:
+            return self.min_fps
+        quiet = now - self._last_motion - self.hold
+        if quiet <= 0:
+            return top
+        if top == float('inf'):
+            top = 30.0
+        return max(self.min_fps, top * 0.5 ** (quiet / self.decay))
+
+    def should_process(self, frame, now):
+        """
+        Score a frame and say whether it should go on to detection
+
+        Args:
+            frame (np.ndarray): BGR frame
+            now (float): Capture time in seconds (wall clock or video time)
+        """
+        self.frames_seen += 1
+        with metrics.timed('motion'):
+            self.last_score = self.detector.score(frame)
+        if self.last_score >= self.motion_threshold:
+            self._last_motion = now
+        due = (self._last_processed is None
+               or now - self._last_processed >= 1.0 / self.rate(now) - 1e-6)
+        if due:
+            self._last_processed = now
+        else:
+            self.frames_skipped += 1
+            metrics.inc('frames_skipped')
+        return due
+
+    def stats(self, now):
+        return {
+            'motion': self.last_score,
+            'schedule_fps': self.rate(now),
+            'frames_skipped': self.frames_skipped,
+        }
@@ -0,0 +1,460 @@
+"""
+Threaded capture / detect / recognize pipeline
+
+A capture thread reads frames from a source into a small bounded queue that
+drops the oldest frame when full, so workers always see recent frames. An
+optional motion.AdaptiveScheduler lets the capture thread skip frames of a
+static scene before they reach the queue. A pool
+of worker threads shares one FaceProcessor to run detection and
+recognition, publishing each frame's
+recognized names as events and keeping only the newest annotated frame for
+the renderer. Nothing here touches Streamlit, so the pipeline can be run
+headless against a video file or a synthetic frame source.
+"""
+import collections
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import detection
+import metrics
+import recognizer
+import tracking
+
+CASCADE_PATH = detection.CASCADE_PATH
+
+
+class SyntheticSource:
+    """
+    Frame source that replays a list of frames, for tests and benchmarks
+
+    Implements the read()/release()/isOpened() subset of cv2.VideoCapture.
+
+    Args:
+        frames (list): BGR frames to play back
+        fps (float, optional): Pace playback to this rate; None plays as fast as possible
+        loop (bool): Start over when the frames run out instead of ending
+    """
+
+    def __init__(self, frames, fps=None, loop=False):
+        self.frames = list(frames)
+        self.fps = fps
+        self.loop = loop
+        self._index = 0
+        self._next_time = None
+
+    def isOpened(self):
+        return bool(self.frames)
+
+    def read(self):
+        if self._index >= len(self.frames):
+            if not self.loop:
+                return False, None
+            self._index = 0
+        if self.fps:
+            now = time.perf_counter()
+            if self._next_time is not None and now < self._next_time:
+                time.sleep(self._next_time - now)
+            self._next_time = max(now, self._next_time or now) + 1.0 / self.fps
+        frame = self.frames[self._index]
+        self._index += 1
+        return True, frame
+
+    def release(self):
+        self._index = len(self.frames)
+        self.loop = False
+
+
+def open_source(source):
+    """
+    Open a frame source
+
+    Args:
+        source: Camera index (int or digit string), video file path or URL,
+            or an object that already has read()/release()
+
+    Returns:
+        An opened source with the cv2.VideoCapture read interface
+    """
+    if hasattr(source, 'read'):
+        return source
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    return cv2.VideoCapture(source)
+
+
+class LatestQueue:
+    """
+    Bounded FIFO that drops the oldest item instead of blocking the producer
+
+    Args:
+        maxsize (int): Items held before the oldest is dropped
+        drop (bool): Block the producer instead of dropping when full, e.g. when
+            replaying a video file where every frame should be processed
+    """
+
+    def __init__(self, maxsize=2, drop=True):
+        self._items = collections.deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.drop = drop
+        self.dropped = 0
+
+    def put(self, item, stop=None):
+        with self._cond:
+            if not self.drop:
+                while len(self._items) == self._items.maxlen and not (stop and stop.is_set()):
+                    self._cond.wait(0.1)
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Pop the oldest item, or return None if nothing arrives within timeout
+        """
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RateCounter:
+    """
+    Events per second over a sliding time window
+    """
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self.total = 0
+        self._times = collections.deque()
+        self._lock = threading.Lock()
+
+    def tick(self):
+        now = time.perf_counter()
+        with self._lock:
+            self.total += 1
+            self._times.append(now)
+            while self._times and now - self._times[0] > self.window:
+                self._times.popleft()
+
+    def rate(self):
+        now = time.perf_counter()
+        with self._lock:
+            while self._times and now - self._times[0] > self.window:
+                self._times.popleft()
+            if len(self._times) < 2:
+                return 0.0
+            return (len(self._times) - 1) / max(self._times[-1] - self._times[0], 1e-9)
+
+
+class FrameResult:
+    """
+    Outcome of processing one frame
+
+    Attributes:
+        seq (int): Capture sequence number
+        timestamp (float): time.time() when the frame was captured
+        frame (np.ndarray): Annotated RGB frame, or None if annotation is off
+        boxes (list): (x, y, w, h) face boxes
+        names (list): Recognized name for each box (recognizer.UNKNOWN if rejected)
+        distances (np.ndarray): Recognition distance for each box
+    """
+
+    def __init__(self, seq, timestamp, frame, boxes, names, distances):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.frame = frame
+        self.boxes = boxes
+        self.names = names
+        self.distances = distances
+
+
+def annotate(frame, boxes, names):
+    """
+    Convert a BGR frame to RGB and draw labelled face boxes on it
+
+    Unknown faces are drawn in grey.
+    """
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    for (x, y, w, h), name in zip(boxes, names):
+        color = (128, 128, 128) if name == recognizer.UNKNOWN else (50, 50, 255)
+        cv2.rectangle(frame_rgb, (x, y), (x+w, y+h), color, 2)
+        cv2.rectangle(frame_rgb, (x, y-40), (x+w, y), color, -1)
+        cv2.putText(frame_rgb, name, (x, y-15),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+    return frame_rgb
+
+
+class FaceProcessor:
+    """
+    Detection + recognition step shared by the pipeline workers
+
+    All workers call the same instance, so detect_every counts every frame
+    the pipeline processes and the identity cache sees every face. The
+    detector keeps tracked boxes between frames and runs under a lock;
+    recognition and annotation run in parallel.
+
+    Args:
+        model: Object with recognize(samples) -> (names, distances); None
+            reports every face as UNKNOWN (an empty gallery)
+        cascade_path (str): Haar cascade used for detection
+        annotate_frames (bool): Produce an annotated RGB frame for display
+        identity_ttl (float): Seconds to reuse a tracked face's label before
+            recognizing it again; 0 recognizes every face on every frame
+        **detector_options: Passed to detection.FaceDetector (downscale, detect_every, ...)
+    """
+
+    def __init__(self, model, cascade_path=CASCADE_PATH, annotate_frames=True, identity_ttl=0,
+                 **detector_options):
+        self.model = model
+        self.annotate_frames = annotate_frames
+        self.detector = detection.FaceDetector(cascade_path, **detector_options)
+        self.tracked = tracking.TrackedRecognizer(model, ttl=identity_ttl) if identity_ttl > 0 else None
+        self._detect_lock = threading.Lock()
+
+    def detect(self, frame):
+        with self._detect_lock:
+            return self.detector.detect(frame)
+
+    def set_model(self, model):
+        """
+        Switch to a model rebuilt after the gallery changed
+        """
+        self.model = model
+        if self.tracked is not None:
+            self.tracked.set_model(model)
+
+    def recognize(self, frame, boxes):
+        if self.model is None:
+            return [recognizer.UNKNOWN] * len(boxes), np.full(len(boxes), np.inf, dtype=np.float32)
+        if self.tracked is not None:
+            names, distances, _ = self.tracked.recognize_frame(frame, boxes)
+            return names, distances
+        return self.model.recognize(recognizer.crops_from_frame(frame, boxes))
+
+    def __call__(self, frame):
+        with metrics.timed('detect'):
+            boxes = self.detect(frame)
+        with metrics.timed('recognize'):
+            names, distances = self.recognize(frame, boxes)
+        frame_rgb = None
+        if self.annotate_frames:
+            with metrics.timed('annotate'):
+                frame_rgb = annotate(frame, boxes, names)
+        metrics.inc('frames_processed')
+        metrics.inc('faces_detected', len(boxes))
+        return frame_rgb, boxes, names, distances
+
+    def stats(self):
+        return self.tracked.stats() if self.tracked is not None else {}
+
+
+class AttendancePipeline:
+    """
+    Capture thread + worker pool + newest-frame slot for the renderer
+
+    Args:
+        source: Anything accepted by open_source()
+        processor_factory (callable): Returns a new frame -> (frame_rgb, boxes,
+            names, distances) callable; called once per start() and shared
+            by every worker, so it must be thread safe (FaceProcessor is)
+        workers (int): Number of detection/recognition threads
+        queue_size (int): Frames buffered between capture and workers
+        drop_frames (bool): Drop stale frames when workers fall behind (live
+            cameras); False makes capture wait instead (video file replay)
+        scheduler (motion.AdaptiveScheduler, optional): Skips frames while the
+            scene is static; None processes every frame
+    """
+
+    def __init__(self, source, processor_factory, workers=2, queue_size=2, drop_frames=True,
+                 scheduler=None):
+        self.source = source
+        self.processor_factory = processor_factory
+        self.workers = workers
+        self.scheduler = scheduler
+        self.frames = LatestQueue(queue_size, drop=drop_frames)
+        self.events = queue.Queue()
+        self.error = None
+
+        self.capture_rate = RateCounter()
+        self.process_rate = RateCounter()
+        self.render_rate = RateCounter()
+
+        self._cap = None
+        self._processors = []
+        self._threads = []
+        self._stop = threading.Event()
+        self._capture_done = threading.Event()
+        self._latest = None
+        self._latest_lock = threading.Lock()
+        self._rendered_seq = -1
+        self._active_workers = 0
+
+    def start(self):
+        """
+        Open the source and start the capture and worker threads
+
+        Returns:
+            bool: False if the source could not be opened
+        """
+        # Build the processor up front so setup errors surface in the caller.
+        # One processor serves every worker: frames alternate between workers,
+        # so separate detectors would each see every other frame and split
+        # the identity cache
+        processor = self.processor_factory()
+        self._processors = [processor]
+        self._active_workers = self.workers
+
+        self._cap = open_source(self.source)
+        if not self._cap.isOpened():
+            self.error = f"Could not open video source {self.source!r}"
+            return False
+
+        self._threads = [threading.Thread(target=self._capture_loop, daemon=True)]
+        for _ in range(self.workers):
+            self._threads.append(threading.Thread(target=self._worker_loop, args=(processor,), daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return True
+
+    def _capture_loop(self):
+        seq = 0
+        try:
+            while not self._stop.is_set():
+                with metrics.timed('capture'):
+                    ret, frame = self._cap.read()
+                if not ret:
+                    break
+                self.capture_rate.tick()
+                timestamp = time.time()
+                if self.scheduler is None or self.scheduler.should_process(frame, timestamp):
+                    self.frames.put((seq, timestamp, frame), self._stop)
+                seq += 1
+        except Exception as e:
+            self.error = f"Capture failed: {e}"
+        finally:
+            self._capture_done.set()
+
+    def _worker_loop(self, processor):
+        try:
+            while not self._stop.is_set():
+                item = self.frames.get(timeout=0.1)
+                if item is None:
+                    if self._capture_done.is_set() and len(self.frames) == 0:
+                        break
+                    continue
+                seq, timestamp, frame = item
+                frame_rgb, boxes, names, distances = processor(frame)
+                result = FrameResult(seq, timestamp, frame_rgb, boxes, names, distances)
+                self.process_rate.tick()
+
+                if any(name != recognizer.UNKNOWN for name in names):
+                    self.events.put(result)
+                with self._latest_lock:
+                    if self._latest is None or seq > self._latest.seq:
+                        self._latest = result
+        except Exception as e:
+            self.error = f"Processing failed: {e}"
+        finally:
+            with self._latest_lock:
+                self._active_workers -= 1
+
+    def latest(self):
+        """
+        Return the newest processed frame if it has not been rendered yet
+
+        Returns:
+            FrameResult or None
+        """
+        with self._latest_lock:
+            result = self._latest
+            if result is None or result.seq <= self._rendered_seq:
+                return None
+            self._rendered_seq = result.seq
+        self.render_rate.tick()
+        return result
+
+    def drain_events(self):
+        """
+        Return every frame result with recognized faces since the last call
+        """
+        results = []
+        while True:
+            try:
+                results.append(self.events.get_nowait())
+            except queue.Empty:
+                return results
+
+    @property
+    def finished(self):
+        """
+        True once the source has ended and every worker has exited
+        """
+        return self._capture_done.is_set() and self._active_workers == 0
+
+    def stats(self):
+        """
+        Per-stage throughput and queue depth counters
+        """
+        stats = {
+            'capture_fps': self.capture_rate.rate(),
+            'process_fps': self.process_rate.rate(),
+            'render_fps': self.render_rate.rate(),
+            'frames_captured': self.capture_rate.total,
+            'frames_processed': self.process_rate.total,
+            'frames_dropped': self.frames.dropped,
+            'queue_depth': len(self.frames),
+            'pending_events': self.events.qsize(),
+        }
+        if self.scheduler is not None:
+            stats.update(self.scheduler.stats(time.time()))
+        # Sum counters reported by the processors, e.g. identity cache hits
+        for processor in self._processors:
+            for key, value in getattr(processor, 'stats', dict)().items():
+                if key.endswith('_rate'):
+                    continue
+                stats[key] = stats.get(key, 0) + value
+        if 'cache_hits' in stats:
+            lookups = stats['cache_hits'] + stats['cache_misses']
+            stats['cache_hit_rate'] = stats['cache_hits'] / lookups if lookups else 0.0
+        return stats
+
+    def stop(self):
+        """
+        Stop all threads and release the source
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        if self._cap is not None:
+            self._cap.release()
+
+    def run(self, timeout=None):
+        """
+        Run headless until the source is exhausted, e.g. for a video file
+
+        Returns:
+            list: Every FrameResult that had recognized faces
+        """
+        if not self.start():
+            raise IOError(self.error)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        try:
+            while not self.finished:
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+                time.sleep(0.01)
+        finally:
+            self.stop()
+        return self.drain_events()
@@ -0,0 +1,133 @@
+"""
+Reduced-bandwidth frame preview for the Streamlit pages
+
+Pushing every full-resolution RGB frame through st.image saturates the
+browser websocket for remote viewers, and Streamlit re-encodes each array as
+a quality-100 JPEG on the server. FramePreview instead downscales the
+annotated frame, JPEG-encodes it and sends it at a capped frame rate that is
+independent of the recognition rate, measuring bytes sent and render time.
+AttendanceList appends new entries to the page instead of redrawing the
+whole list.
+"""
+import collections
+import time
+
+import cv2
+
+import metrics
+
+
+class FramePreview:
+    """
+    Rate-capped, downscaled JPEG preview in a Streamlit placeholder
+
+    Args:
+        placeholder: st.empty() slot the preview is drawn into
+        max_width (int): Frames wider than this are downscaled; 0 keeps full size
+        quality (int): JPEG quality, 1-100
+        max_fps (float): Most frames sent per second; 0 sends every frame
+        compress (bool): Send JPEG bytes; False sends the RGB array as before
+            (its byte count is then the array size, before Streamlit encodes it)
+    """
+
+    def __init__(self, placeholder, max_width=640, quality=70, max_fps=10.0, compress=True):
+        self.placeholder = placeholder
+        self.max_width = max_width
+        self.quality = quality
+        self.max_fps = max_fps
+        self.compress = compress
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self._last_sent = 0.0
+        self._recent = collections.deque()
+        self._render_times = collections.deque(maxlen=100)
+
+    def encode(self, frame_rgb):
+        """
+        Downscale an RGB frame and encode it as JPEG bytes
+        """
+        height, width = frame_rgb.shape[:2]
+        if self.max_width and width > self.max_width:
+            scale = self.max_width / width
+            frame_rgb = cv2.resize(frame_rgb, (self.max_width, int(height * scale)),
+                                   interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR),
+                                  [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError("Could not encode preview frame")
+        return buffer.tobytes()
+
+    def due(self, now=None):
+        """
+        True once enough time has passed since the last frame to send another
+        """
+        now = time.monotonic() if now is None else now
+        return not self.max_fps or now - self._last_sent >= 1.0 / self.max_fps
+
+    def show(self, frame_rgb):
+        """
+        Send a frame to the placeholder, recording its size and render time
+        """
+        now = time.monotonic()
+        self._last_sent = now
+        start = time.perf_counter()
+        if self.compress:
+            data = self.encode(frame_rgb)
+            size = len(data)
+            self.placeholder.image(data, use_column_width=True)
+        else:
+            size = frame_rgb.nbytes
+            self.placeholder.image(frame_rgb, channels="RGB", use_column_width=True)
+        elapsed = time.perf_counter() - start
+
+        metrics.observe('render', elapsed)
+        metrics.inc('preview_bytes', size)
+        self._render_times.append(elapsed)
+        self._recent.append((now, size))
+        self.frames_sent += 1
+        self.bytes_sent += size
+
+    def stats(self, window=2.0):
+        """
+        Recent bytes/sec and frames/sec sent, and mean render time in ms
+        """
+        now = time.monotonic()
+        while self._recent and now - self._recent[0][0] > window:
+            self._recent.popleft()
+        recent_bytes = sum(size for _, size in self._recent)
+        return {
+            'bytes_per_sec': recent_bytes / window,
+            'preview_fps': len(self._recent) / window,
+            'render_ms': 1000 * sum(self._render_times) / len(self._render_times) if self._render_times else 0.0,
+            'frames_sent': self.frames_sent,
+            'bytes_sent': self.bytes_sent,
+        }
+
+
+class AttendanceList:
+    """
+    Attendance entries appended to a container as they arrive
+
+    Each new entry adds one small element instead of rewriting the list.
+
+    Args:
+        container: st.container() the list is drawn into
+        title (str): Heading shown above the first entry
+        empty_text (str): Shown until the first entry arrives
+    """
+
+    def __init__(self, container, title="### Today's Attendance:", empty_text="No attendance records yet"):
+        self.container = container
+        self.title = title
+        self.entries = []
+        self._empty = self.container.empty()
+        self._empty.info(empty_text)
+
+    def add(self, entry):
+        if not self.entries:
+            self._empty.markdown(self.title)
+        self.entries.append(entry)
+        self.container.markdown(f"- {entry}")
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,256 @@
+"""
+Vectorized k-nearest-neighbour face recognition
+
+All faces detected in a frame are stacked into one (k, 7500) matrix and
+classified with a single distance computation and vote, instead of one
+sklearn predict call per face.
+
+Recognition is open-set when a distance threshold is given: faces farther
+than the threshold from their best match are reported as UNKNOWN instead of
+the nearest registered name. Thresholds are calibrated on the gallery with
+`python evaluate.py calibrate`.
+"""
+import copy
+
+import cv2
+import numpy as np
+
+import gallery_index
+
+FACE_SIZE = (50, 50)
+N_NEIGHBORS = 5
+UNKNOWN = 'Unknown'
+
+
+def crops_from_frame(frame, boxes, size=FACE_SIZE):
+    """
+    Crop, resize and stack every detected face in a frame
+
+    Args:
+        frame (np.ndarray): BGR frame
+        boxes: Iterable of (x, y, w, h) face boxes
+        size (tuple): Crop size fed to the recognizer
+
+    Returns:
+        np.ndarray: (k, size[0] * size[1] * 3) uint8 matrix, one row per box
+    """
+    boxes = list(boxes)
+    crops = np.empty((len(boxes), size[0] * size[1] * frame.shape[2]), dtype=np.uint8)
+    for i, (x, y, w, h) in enumerate(boxes):
+        crops[i] = cv2.resize(frame[y:y+h, x:x+w, :], size).reshape(-1)
+    return crops
+
+
+def _open_set(names, distances, threshold):
+    """
+    Replace names whose distance exceeds threshold with UNKNOWN
+    """
+    if threshold is None:
+        return [str(name) for name in names]
+    return [str(name) if distance <= threshold else UNKNOWN for name, distance in zip(names, distances)]
+
+
+def confidences(distances, threshold):
+    """
+    Map match distances to a 0-1 confidence, reaching 0 at the threshold
+
+    Returns None when there is no threshold to scale against.
+    """
+    if threshold is None or threshold <= 0:
+        return None
+    return np.clip(1.0 - np.asarray(distances, dtype=np.float32) / threshold, 0.0, 1.0)
+
+
+class BatchRecognizer:
+    """
+    KNN over the gallery, voting over the neighbours found by an index
+
+    Matches KNeighborsClassifier(n_neighbors=k) with uniform weights and
+    euclidean distance: the label with most votes among the k nearest
+    captures wins, ties going to the label that sorts first. With the default
+    exact index the neighbours are the true nearest captures; an IVF index
+    from gallery_index trades a little recall for much faster search on
+    large galleries.
+
+    Args:
+        faces (np.ndarray): (N, D) gallery vectors
+        labels (list): Name for each gallery row
+        n_neighbors (int): Number of neighbours that vote
+        dtype: float32 (default, faster) or float64 for exact distances
+        copy_gallery (bool): Convert the gallery to dtype up front. Pass False
+            to keep using the given array (e.g. a read-only memmap shared by
+            several processes) and convert it in chunks at query time
+        chunk_rows (int): Gallery rows converted per chunk when copy_gallery is False
+        index (gallery_index.ExactIndex, optional): Prebuilt index over faces;
+            by default an ExactIndex is built
+        threshold (float, optional): Report faces whose distance to the
+            winning label exceeds this as UNKNOWN; None accepts every match
+    """
+
+    def __init__(self, faces, labels, n_neighbors=N_NEIGHBORS, dtype=np.float32, copy_gallery=True,
+                 chunk_rows=4096, index=None, threshold=None):
+        self.n_neighbors = n_neighbors
+        self.dtype = dtype
+        self.threshold = threshold
+        self.classes = np.empty(0, dtype=object)
+        self.label_idx = np.empty(0, dtype=np.intp)
+        self._add_labels(labels)
+        if index is None:
+            index = gallery_index.ExactIndex(faces, dtype=dtype, copy=copy_gallery, chunk_rows=chunk_rows)
+        self.index = index
+
+    def __len__(self):
+        return len(self.label_idx)
+
+    @property
+    def gallery(self):
+        return self.index.vectors
+
+    def add(self, faces, labels):
+        """
+        Append captures to the gallery, computing norms only for the new rows
+        """
+        if len(labels) == 0:
+            return
+        self._add_labels(labels)
+        # Extend a copy of the index so copies of this recognizer keep theirs
+        self.index = copy.copy(self.index)
+        self.index.add(np.asarray(faces).reshape(len(labels), -1))
+
+    def _add_labels(self, labels):
+        labels = np.asarray(labels, dtype=object)
+        classes = np.union1d(self.classes, labels).astype(object)
+        if len(classes) != len(self.classes):
+            # Re-index existing rows so class indices stay in sorted order
+            if len(self.label_idx):
+                self.label_idx = np.searchsorted(classes, self.classes[self.label_idx])
+            self.classes = classes
+        self.label_idx = np.concatenate([self.label_idx, np.searchsorted(self.classes, labels)])
+
+    def kneighbors(self, samples):
+        """
+        Find the nearest gallery rows for each sample
+
+        Returns:
+            tuple: (distances, indices), both (k, n_neighbors), nearest first
+        """
+        return self.index.search(samples, self.n_neighbors)
+
+    def recognize(self, samples):
+        """
+        Classify a batch of face vectors
+
+        Args:
+            samples (np.ndarray): (k, D) face vectors, e.g. from crops_from_frame
+
+        Returns:
+            tuple: (names, distances) where names is a list of k labels
+            (UNKNOWN for rejected faces) and distances holds the distance to
+            the closest capture of each predicted label
+        """
+        if len(samples) == 0:
+            return [], np.empty(0, dtype=self.dtype)
+
+        distances, nearest = self.kneighbors(samples)
+        # An IVF index pads slots it could not fill with index -1; they get no vote
+        found = nearest >= 0
+        votes_idx = self.label_idx[np.where(found, nearest, 0)]
+        counts = np.zeros((len(samples), len(self.classes)), dtype=np.intp)
+        np.add.at(counts, (np.arange(len(samples))[:, None], votes_idx), found.astype(np.intp))
+        winners = counts.argmax(axis=1)
+
+        # Neighbours are sorted nearest first, so the first match is the closest
+        first_match = ((votes_idx == winners[:, None]) & found).argmax(axis=1)
+        winner_distances = distances[np.arange(len(samples)), first_match]
+        names = _open_set(self.classes[winners], winner_distances, self.threshold)
+        # Faces with no neighbour at all have distance inf and no name
+        names = [name if any_found else UNKNOWN for name, any_found in zip(names, found.any(axis=1))]
+        return names, winner_distances
+
+    def predict(self, samples):
+        """
+        sklearn-style predict returning only the labels
+        """
+        return np.asarray(self.recognize(samples)[0], dtype=object)
+
+
+class CentroidRecognizer:
+    """
+    Nearest-centroid classifier over per-identity mean vectors
+
+    Each face is compared against one centroid per identity instead of
+    every capture, so the cost per face grows with the number of people
+    rather than the number of captures. Centroids are kept as running sums,
+    so appended captures only update the identities they belong to.
+
+    Args:
+        faces (np.ndarray): (N, D) gallery vectors
+        labels (list): Name for each gallery row
+        dtype: float32 (default) or float64 for exact distances
+        chunk_rows (int): Gallery rows read per chunk when summing
+        threshold (float, optional): Report faces farther than this from the
+            nearest centroid as UNKNOWN; None accepts every match
+    """
+
+    def __init__(self, faces, labels, dtype=np.float32, chunk_rows=4096, threshold=None):
+        self.dtype = dtype
+        self.chunk_rows = chunk_rows
+        self.threshold = threshold
+        self.classes = np.empty(0, dtype=object)
+        self.sums = np.zeros((0, np.shape(faces)[1]))
+        self.counts = np.zeros(0, dtype=np.intp)
+        self.add(faces, labels)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    @property
+    def gallery(self):
+        return self.index.vectors
+
+    def add(self, faces, labels):
+        """
+        Fold captures into the running per-identity sums
+        """
+        if len(labels) == 0 and len(self.classes):
+            return
+        labels = np.asarray(labels, dtype=object)
+        classes = np.union1d(self.classes, labels).astype(object)
+        # Build new arrays so copies of this recognizer keep theirs
+        sums = np.zeros((len(classes), self.sums.shape[1]))
+        counts = np.zeros(len(classes), dtype=np.intp)
+        existing = np.searchsorted(classes, self.classes)
+        sums[existing] = self.sums
+        counts[existing] = self.counts
+
+        label_idx = np.searchsorted(classes, labels)
+        for start in range(0, len(labels), self.chunk_rows):
+            block = np.asarray(faces[start:start + self.chunk_rows], dtype=np.float64)
+            np.add.at(sums, label_idx[start:start + self.chunk_rows], block.reshape(len(block), -1))
+        counts += np.bincount(label_idx, minlength=len(classes))
+
+        self.classes, self.sums, self.counts = classes, sums, counts
+        centroids = sums / np.maximum(counts, 1)[:, None]
+        self.index = gallery_index.ExactIndex(centroids, dtype=self.dtype)
+
+    def kneighbors(self, samples, n_neighbors=1):
+        """
+        Nearest centroids for each sample, as (distances, class indices)
+        """
+        return self.index.search(samples, n_neighbors)
+
+    def recognize(self, samples):
+        """
+        Classify a batch of face vectors against the identity centroids
+
+        Returns:
+            tuple: (names, distances to the nearest centroid)
+        """
+        if len(samples) == 0:
+            return [], np.empty(0, dtype=self.dtype)
+        distances, nearest = self.kneighbors(samples)
+        distances = distances[:, 0]
+        return _open_set(self.classes[nearest[:, 0]], distances, self.threshold), distances
+
+    def predict(self, samples):
+        return np.asarray(self.recognize(samples)[0], dtype=object)
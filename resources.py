@@ -0,0 +1,300 @@
+"""
+Shared camera and cascade resources
+
+Parsing the Haar cascade and opening the camera used to happen on every
+visit to Register Face or Take Attendance. Opening a webcam takes close to
+a second, and fails outright while a previous run still holds the device.
+
+Cascades are kept in a pool: a detector borrows a parsed cascade for each
+detectMultiScale call, so no cascade is used by two threads at once and
+each thread that detects concurrently has its own, while none is parsed
+again after the first use.
+
+Each camera is opened once by a CameraReader, whose thread keeps the
+newest frame. Pages, pipelines and other consumers subscribe to it and
+read frames through the cv2.VideoCapture read()/isOpened()/release()
+interface. The camera is closed once nobody has been subscribed for
+idle_timeout seconds, so switching pages reuses the open device.
+Subscriptions that stop reading for stale_after seconds (a run that was
+interrupted before releasing) are dropped, and attach again if they
+resume. Time to first frame is recorded as the first_frame metric.
+"""
+import collections
+import contextlib
+import threading
+import time
+
+import cv2
+
+import metrics
+
+CASCADE_PATH = 'Data/haarcascade_frontalface_default.xml'
+IDLE_TIMEOUT = 15.0
+STALE_AFTER = 30.0
+
+_cascades = collections.defaultdict(list)
+_cascades_lock = threading.Lock()
+
+
+def load_cascade(path=CASCADE_PATH):
+    """
+    Parse a cascade file
+
+    Raises:
+        IOError: If the file is missing or not a valid cascade
+    """
+    with metrics.timed('cascade_load'):
+        cascade = cv2.CascadeClassifier(path)
+    if cascade.empty():
+        raise IOError(f"Face detection model not found or invalid: {path}")
+    return cascade
+
+
+@contextlib.contextmanager
+def cascade(path=CASCADE_PATH):
+    """
+    Borrow a parsed cascade for the duration of the with block
+    """
+    with _cascades_lock:
+        idle = _cascades[path]
+        borrowed = idle.pop() if idle else None
+    if borrowed is None:
+        borrowed = load_cascade(path)
+    try:
+        yield borrowed
+    finally:
+        with _cascades_lock:
+            _cascades[path].append(borrowed)
+
+
+def warm_cascade(path=CASCADE_PATH):
+    """
+    Parse a cascade ahead of the first detection, if none is pooled yet
+    """
+    with _cascades_lock:
+        if _cascades[path]:
+            return
+    with cascade(path):
+        pass
+
+
+class Subscription:
+    """
+    One consumer's view of a CameraReader, usable in place of cv2.VideoCapture
+
+    read() returns the next frame the reader captured after the one this
+    subscriber saw last, so a slow consumer skips frames instead of
+    falling behind. Frames are shared between subscribers and read-only.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.subscribed_at = time.perf_counter()
+        self.first_frame_seconds = None
+        self.last_read = time.monotonic()
+        self.released = False
+        self._seq = -1
+
+    def isOpened(self):
+        return not self.released and self.reader.opened
+
+    def read(self, timeout=5.0):
+        if self.released:
+            return False, None
+        self.last_read = time.monotonic()
+        ret, seq, frame = self.reader.next_frame(self, self._seq, timeout)
+        if not ret:
+            return False, None
+        self._seq = seq
+        if self.first_frame_seconds is None:
+            self.first_frame_seconds = time.perf_counter() - self.subscribed_at
+            metrics.observe('first_frame', self.first_frame_seconds)
+        return True, frame
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.reader.unsubscribe(self)
+
+    def __del__(self):
+        try:
+            self.release()
+        except Exception:
+            pass
+
+
+class CameraReader:
+    """
+    Keeps one camera open and shares its newest frame with every subscriber
+
+    Args:
+        source: Camera index, video path or URL, as for pipeline.open_source()
+        idle_timeout (float): Seconds without subscribers before the camera is closed
+        stale_after (float): Seconds without a read() after which a subscriber
+            no longer keeps the camera open
+        opener (callable, optional): source -> capture object; default pipeline.open_source
+    """
+
+    def __init__(self, source=0, idle_timeout=IDLE_TIMEOUT, stale_after=STALE_AFTER, opener=None):
+        self.source = source
+        self.idle_timeout = idle_timeout
+        self.stale_after = stale_after
+        self.opener = opener
+        self.open_seconds = None
+        self.error = None
+        self._condition = threading.Condition()
+        self._subscribers = set()
+        self._cap = None
+        self._thread = None
+        self._frame = None
+        self._seq = -1
+        self._idle_since = None
+
+    @property
+    def opened(self):
+        with self._condition:
+            return self._cap is not None
+
+    @property
+    def subscribers(self):
+        with self._condition:
+            return len(self._subscribers)
+
+    def _open(self):
+        """
+        Open the device and start the reader thread; the caller holds the condition
+        """
+        if self._cap is not None:
+            return True
+        opener = self.opener
+        if opener is None:
+            import pipeline
+            opener = pipeline.open_source
+        start = time.perf_counter()
+        with metrics.timed('camera_open'):
+            cap = opener(self.source)
+        if not cap.isOpened():
+            cap.release()
+            self.error = f"Could not open video source {self.source!r}"
+            return False
+        self.open_seconds = time.perf_counter() - start
+        self.error = None
+        self._cap = cap
+        # The sequence keeps counting across reopens, so a subscriber that
+        # attaches again only waits for frames from the new session
+        self._frame = None
+        self._idle_since = None
+        self._thread = threading.Thread(target=self._run, args=(cap,), name='camera-reader', daemon=True)
+        self._thread.start()
+        return True
+
+    def subscribe(self):
+        """
+        Add a consumer, opening the camera if it is closed
+
+        Returns:
+            Subscription: Check isOpened() before reading
+        """
+        subscription = Subscription(self)
+        with self._condition:
+            if self._open():
+                self._subscribers.add(subscription)
+                self._idle_since = None
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._condition:
+            self._subscribers.discard(subscription)
+            if not self._subscribers and self._idle_since is None:
+                self._idle_since = time.monotonic()
+            self._condition.notify_all()
+
+    def next_frame(self, subscription, after_seq, timeout=5.0):
+        """
+        Wait for a frame newer than after_seq
+
+        Returns:
+            tuple: (ret, seq, frame); ret is False once the camera has failed
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if subscription not in self._subscribers:
+                # Dropped as stale or the camera closed meanwhile; attach again
+                if not self._open():
+                    return False, after_seq, None
+                self._subscribers.add(subscription)
+                self._idle_since = None
+            while self._frame is None or self._seq <= after_seq:
+                remaining = deadline - time.monotonic()
+                if self._cap is None or remaining <= 0:
+                    return False, after_seq, None
+                self._condition.wait(remaining)
+            return True, self._seq, self._frame
+
+    def _drop_stale(self, now):
+        stale = [s for s in self._subscribers if now - s.last_read > self.stale_after]
+        for subscription in stale:
+            self._subscribers.discard(subscription)
+        if not self._subscribers and self._idle_since is None:
+            self._idle_since = now
+
+    def _run(self, cap):
+        try:
+            while True:
+                with metrics.timed('camera_read'):
+                    ret, frame = cap.read()
+                now = time.monotonic()
+                with self._condition:
+                    if not ret:
+                        self.error = f"Could not read from video source {self.source!r}"
+                        break
+                    frame.flags.writeable = False
+                    self._frame, self._seq = frame, self._seq + 1
+                    self._condition.notify_all()
+                    self._drop_stale(now)
+                    if self._idle_since is not None and now - self._idle_since >= self.idle_timeout:
+                        break
+        except Exception as e:
+            self.error = f"Camera reader failed: {e}"
+        finally:
+            # Release under the lock so a new subscriber cannot reopen the
+            # device before this handle lets go of it
+            with self._condition:
+                cap.release()
+                self._cap = None
+                self._subscribers.clear()
+                self._condition.notify_all()
+
+    def close(self, timeout=2.0):
+        """
+        Close the camera now, whatever the subscribers
+        """
+        with self._condition:
+            self._idle_since = time.monotonic() - self.idle_timeout
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+
+_cameras = {}
+_cameras_lock = threading.Lock()
+
+
+def get_camera(source=0):
+    """
+    Return the process-wide CameraReader for a source
+    """
+    with _cameras_lock:
+        if source not in _cameras:
+            _cameras[source] = CameraReader(source)
+        return _cameras[source]
+
+
+def open_camera(source=0):
+    """
+    Subscribe to the shared reader of a camera
+
+    Returns:
+        Subscription: Drop-in for cv2.VideoCapture(source); release() when done
+    """
+    return get_camera(source).subscribe()
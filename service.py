@@ -0,0 +1,320 @@
+"""
+Headless multi-camera attendance service
+
+Runs one worker process per camera source (device index, RTSP URL or video
+file). Every worker maps the same gallery files read-only and runs the
+detection/recognition pipeline without Streamlit. Recognized people are sent
+to the parent process, which merges the events from all sources in timestamp
+order and records them through one AttendanceWriter. The sink also appends
+each new mark to an event log and keeps a status file with per-source
+throughput, which the app's Live Monitor page displays.
+
+Usage:
+    python service.py --source 0 --source rtsp://camera-2/stream --source lecture.mp4
+"""
+import argparse
+import heapq
+import json
+import multiprocessing as mp
+import os
+import queue
+import time
+from datetime import datetime
+
+import attendance_writer
+
+SERVICE_DIR = 'Data/service'
+EVENTS_FILE = 'events.jsonl'
+STATUS_FILE = 'status.json'
+
+
+def _source_worker(label, source, gallery_dir, options, events, stop):
+    """
+    Worker process: run the pipeline on one source and forward recognitions
+
+    The model is checked against the gallery every second, so faces
+    registered or deleted while the service runs are picked up without a
+    restart.
+    """
+    import model_store
+    import pipeline
+    import recognizer
+
+    # copy_gallery=False keeps the read-only memmap, so the page cache is
+    # shared between all worker processes instead of each holding a copy
+    store = model_store.ModelStore(gallery_dir, copy_gallery=False)
+    model = store.get()
+    processor = pipeline.FaceProcessor(model, annotate_frames=False,
+                                       identity_ttl=options.get('identity_ttl', 5.0),
+                                       downscale=options.get('downscale', 0.5),
+                                       detect_every=options.get('detect_every', 2))
+
+    attendance_pipeline = pipeline.AttendancePipeline(
+        source,
+        lambda: processor,
+        workers=options.get('threads', 1),
+        queue_size=options.get('queue_size', 2),
+        # Live cameras drop stale frames; recorded files are processed in full
+        drop_frames=not os.path.isfile(str(source)))
+
+    if not attendance_pipeline.start():
+        events.put(('status', label, {'error': attendance_pipeline.error}))
+        return
+
+    sent = {}
+
+    def forward(results):
+        for result in results:
+            day = datetime.fromtimestamp(result.timestamp).date()
+            for name in result.names:
+                # Only forward the first sighting per person per day
+                if name != recognizer.UNKNOWN and sent.get(name) != day:
+                    sent[name] = day
+                    events.put(('event', label, (result.timestamp, name)))
+
+    last_status = 0.0
+    try:
+        while not stop.is_set() and not attendance_pipeline.finished:
+            forward(attendance_pipeline.drain_events())
+            now = time.monotonic()
+            if now - last_status >= 1.0:
+                events.put(('status', label, attendance_pipeline.stats()))
+                last_status = now
+                # Only reads the gallery headers unless the gallery changed
+                latest = store.get()
+                if latest is not model:
+                    model = latest
+                    processor.set_model(model)
+            time.sleep(0.02)
+    finally:
+        attendance_pipeline.stop()
+        forward(attendance_pipeline.drain_events())
+        stats = attendance_pipeline.stats()
+        stats['error'] = attendance_pipeline.error
+        stats['finished'] = True
+        events.put(('status', label, stats))
+
+
+class AttendanceSink:
+    """
+    Orders events from all sources by timestamp and records them
+
+    Events are held for reorder_window seconds so that a slightly late event
+    from one source is still written before newer events from another.
+
+    Args:
+        writer (AttendanceWriter): Where attendance rows are written
+        service_dir (str): Folder for the event log and status file
+        reorder_window (float): Seconds to hold events before emitting them
+    """
+
+    def __init__(self, writer, service_dir=SERVICE_DIR, reorder_window=1.0):
+        self.writer = writer
+        self.service_dir = service_dir
+        self.reorder_window = reorder_window
+        self.marked = 0
+        self.received = 0
+        self.status = {}
+        self._pending = []
+        self._seq = 0
+        os.makedirs(service_dir, exist_ok=True)
+        self._log = open(os.path.join(service_dir, EVENTS_FILE), 'a', encoding='utf-8')
+
+    def add(self, label, timestamp, name):
+        self.received += 1
+        heapq.heappush(self._pending, (timestamp, self._seq, label, name))
+        self._seq += 1
+
+    def emit(self, force=False):
+        """
+        Record every held event older than the reorder window
+
+        Returns:
+            int: Number of new attendance rows written
+        """
+        cutoff = float('inf') if force else time.time() - self.reorder_window
+        written = 0
+        while self._pending and self._pending[0][0] <= cutoff:
+            timestamp, _, label, name = heapq.heappop(self._pending)
+            when = datetime.fromtimestamp(timestamp)
+            if self.writer.write(name, when):
+                written += 1
+                self._log.write(json.dumps({
+                    'timestamp': timestamp,
+                    'date': when.strftime("%d-%m-%Y"),
+                    'time': when.strftime("%H:%M:%S"),
+                    'name': name,
+                    'source': label,
+                }) + '\n')
+        if written:
+            self._log.flush()
+            self.writer.flush()
+        self.marked += written
+        return written
+
+    def write_status(self, started_at):
+        status = {
+            'updated': time.time(),
+            'started': started_at,
+            'events_received': self.received,
+            'attendance_marked': self.marked,
+            'sources': self.status,
+        }
+        path = os.path.join(self.service_dir, STATUS_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(status, f)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        self.emit(force=True)
+        self._log.close()
+        self.writer.flush()
+
+
+def run_service(sources, duration=None, gallery_dir=None, writer=None,
+                service_dir=SERVICE_DIR, **options):
+    """
+    Run one worker process per source until they finish or duration elapses
+
+    Args:
+        sources (list): Camera indices, RTSP URLs or video file paths
+        duration (float, optional): Stop after this many seconds
+        gallery_dir (str, optional): Defaults to gallery.GALLERY_DIR
+        writer (AttendanceWriter, optional): Defaults to the shared daily writer
+        **options: identity_ttl, downscale, detect_every, threads, queue_size
+
+    Returns:
+        dict: Final status, including per-source stats and total frames/sec
+    """
+    # Imported here so the Live Monitor page can read status without NumPy
+    import gallery
+
+    gallery_dir = gallery_dir or gallery.GALLERY_DIR
+    if gallery.ensure_gallery(gallery_dir) == 0:
+        raise RuntimeError("No face data found. Please register faces first.")
+
+    writer = writer or attendance_writer.get_writer()
+    sink = AttendanceSink(writer, service_dir)
+    ctx = mp.get_context('spawn')
+    events = ctx.Queue()
+    stop = ctx.Event()
+
+    labels = [f"{i}:{source}" for i, source in enumerate(sources)]
+    workers = [ctx.Process(target=_source_worker,
+                           args=(label, source, gallery_dir, options, events, stop),
+                           daemon=True)
+               for label, source in zip(labels, sources)]
+    started_at = time.time()
+    for worker in workers:
+        worker.start()
+
+    deadline = None if duration is None else time.monotonic() + duration
+    last_status = 0.0
+    try:
+        while True:
+            try:
+                kind, label, payload = events.get(timeout=0.2)
+                if kind == 'event':
+                    sink.add(label, *payload)
+                else:
+                    sink.status[label] = payload
+            except queue.Empty:
+                pass
+            sink.emit()
+
+            if time.monotonic() - last_status >= 1.0:
+                sink.write_status(started_at)
+                last_status = time.monotonic()
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if not any(worker.is_alive() for worker in workers) and events.empty():
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join(timeout=5)
+        while True:
+            try:
+                kind, label, payload = events.get(timeout=0.5)
+            except queue.Empty:
+                break
+            if kind == 'event':
+                sink.add(label, *payload)
+            else:
+                sink.status[label] = payload
+        sink.close()
+        sink.write_status(started_at)
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    elapsed = time.time() - started_at
+    frames = sum(s.get('frames_processed', 0) for s in sink.status.values())
+    return {
+        'elapsed': elapsed,
+        'frames_processed': frames,
+        'fps': frames / elapsed if elapsed else 0.0,
+        'attendance_marked': sink.marked,
+        'sources': sink.status,
+    }
+
+
+def read_status(service_dir=SERVICE_DIR):
+    """
+    Latest status written by a running (or finished) service, or None
+    """
+    try:
+        with open(os.path.join(service_dir, STATUS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_events(date=None, service_dir=SERVICE_DIR, limit=200):
+    """
+    Most recent attendance marks from the service event log
+
+    Args:
+        date (str, optional): Only events for this dd-mm-YYYY date
+        limit (int): Maximum events returned, newest last
+    """
+    path = os.path.join(service_dir, EVENTS_FILE)
+    if not os.path.exists(path):
+        return []
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if date is None or event.get('date') == date:
+                events.append(event)
+    return events[-limit:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless multi-camera attendance service")
+    parser.add_argument('--source', action='append', required=True,
+                        help="Camera index, RTSP URL or video file; repeat for each room")
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds")
+    parser.add_argument('--identity-ttl', type=float, default=5.0,
+                        help="Seconds to reuse a tracked face's identity")
+    parser.add_argument('--downscale', type=float, default=0.5, help="Detection scale")
+    parser.add_argument('--detect-every', type=int, default=2, help="Full-frame detection interval")
+    parser.add_argument('--threads', type=int, default=1, help="Recognition threads per source")
+    args = parser.parse_args()
+
+    result = run_service(args.source, duration=args.duration, identity_ttl=args.identity_ttl,
+                         downscale=args.downscale, detect_every=args.detect_every, threads=args.threads)
+    print(f"Processed {result['frames_processed']} frames in {result['elapsed']:.1f}s "
+          f"({result['fps']:.1f} fps), marked {result['attendance_marked']} attendances")
+    for label, stats in result['sources'].items():
+        error = f" error: {stats['error']}" if stats.get('error') else ""
+        print(f"  {label}: {stats.get('frames_processed', 0)} frames{error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,26 @@
 import streamlit as st
-import cv2
-import pickle
-import numpy as np
-import os
 import time
 from datetime import datetime
-import csv
-import threading
+import announcer
+import attendance_writer
+import metrics
+import model_store
+import motion
+import pipeline
+import preview
+import recognizer
+import resources
 
-def play_audio_message(message):
-    """Play an audio message using text-to-speech"""
-    try:
-        from win32com.client import Dispatch
-        speaker = Dispatch("SAPI.SpVoice")
-        speaker.Speak(message)
-    except Exception as e:
-        st.warning(f"Audio feedback couldn't be played: {e}")
+def schedule_text(fps):
+    """Describe the motion scheduler's current target rate"""
+    return "every frame" if fps == float('inf') else f"{fps:.1f} fps target"
+
+def show_audio_errors(speaker):
+    """Show announcer failures, which are only reported back to the page thread"""
+    error = speaker.pop_error()
+    while error is not None:
+        st.warning(error)
+        error = speaker.pop_error()
 
 def take_attendance():
     """
@@ -25,22 +30,20 @@ def take_attendance():
     """
     st.header("Take Attendance")
     
-    if not os.path.exists('Data/faces_data.pkl') or not os.path.exists('Data/names.pkl'):
-        st.error("No face data found. Please register faces first.")
-        return
-    
     try:
-        with open('Data/names.pkl', 'rb') as w:
-            LABELS = pickle.load(w)
-        with open('Data/faces_data.pkl', 'rb') as f:
-            FACES = pickle.load(f)
-            
-        from sklearn.neighbors import KNeighborsClassifier
-        
-        knn = KNeighborsClassifier(n_neighbors=5)
-        knn.fit(FACES, LABELS)
+        # Usually already loaded by the app's background preload
+        with st.spinner("Loading face recognition model..."):
+            model = model_store.get_model()
+        if model is None:
+            st.error("No face data found. Please register faces first.")
+            return
+        LABELS = model.labels
         
         st.success("Face recognition model loaded successfully!")
+        st.caption(f"Gallery load: {model.timings['load'] * 1000:.1f} ms, "
+                   f"model fit: {model.timings['fit'] * 1000:.1f} ms"
+                   + (f", unknown faces rejected above distance {model.threshold:.2f}"
+                      if model.threshold is not None else ""))
     except Exception as e:
         st.error(f"Error loading face data: {e}")
         return
@@ -72,147 +75,229 @@ def take_attendance():
                                             min_value=10, 
                                             max_value=300, 
                                             value=60)
+        
+        with st.expander("Detection Settings"):
+            downscale = st.slider("Detection scale", 
+                                  min_value=0.25, 
+                                  max_value=1.0, 
+                                  value=0.5, 
+                                  step=0.25,
+                                  help="Resize frames by this factor before running face detection")
+            detect_every = st.number_input("Full-frame detection every N frames", 
+                                           min_value=1, 
+                                           max_value=10, 
+                                           value=2,
+                                           help="Frames in between only search around faces already found")
+            identity_ttl = st.number_input("Reuse recognized identities for (seconds)", 
+                                           min_value=0.0, 
+                                           max_value=60.0, 
+                                           value=5.0,
+                                           help="Faces tracked across frames keep their name for this long "
+                                                "before being recognized again (0 = recognize every frame)")
+            idle_when_static = st.checkbox("Slow down when nothing moves", 
+                                           value=True,
+                                           help="Skip detection on frames where the scene has not changed")
+            rate_cols = st.columns(2)
+            min_fps = rate_cols[0].number_input("Idle frames per second", 
+                                                min_value=0.2, 
+                                                max_value=10.0, 
+                                                value=1.0,
+                                                disabled=not idle_when_static)
+            max_fps = rate_cols[1].number_input("Active frames per second (0 = every frame)", 
+                                                min_value=0.0, 
+                                                max_value=60.0, 
+                                                value=15.0,
+                                                disabled=not idle_when_static)
+        
+        with st.expander("Preview Settings"):
+            compress_preview = st.checkbox("Reduced-bandwidth preview", 
+                                           value=True,
+                                           help="Send downscaled JPEG frames instead of full-size images")
+            preview_width = st.slider("Preview width (pixels)", 
+                                      min_value=320, 
+                                      max_value=1280, 
+                                      value=640, 
+                                      step=160)
+            preview_quality = st.slider("JPEG quality", 
+                                        min_value=30, 
+                                        max_value=95, 
+                                        value=70, 
+                                        step=5)
+            preview_fps = st.number_input("Maximum preview frames per second", 
+                                          min_value=1.0, 
+                                          max_value=30.0, 
+                                          value=10.0,
+                                          help="Recognition keeps running at full speed; only the display is capped")
     
         start_attendance = st.button("Start Attendance Taking")
         
         if start_attendance:
+            # The camera is shared with other pages and sessions and stays open
+            # for a while after the last one lets go, so revisits start at once
+            camera = resources.open_camera(0)
             try:
-                facedetect = cv2.CascadeClassifier('Data/haarcascade_frontalface_default.xml')
-                if facedetect.empty():
-                    st.error("Error: Face detection model not found or invalid")
-                    st.info("Please make sure 'haarcascade_frontalface_default.xml' is in the Data folder")
-                    return
+                scheduler = motion.AdaptiveScheduler(min_fps, max_fps) if idle_when_static else None
+                attendance_pipeline = pipeline.AttendancePipeline(
+                    camera, 
+                    lambda: pipeline.FaceProcessor(model, identity_ttl=identity_ttl, 
+                                                   downscale=downscale, detect_every=detect_every), 
+                    workers=2,
+                    scheduler=scheduler)
+                started = attendance_pipeline.start()
             except Exception as e:
+                camera.release()
                 st.error(f"Error loading face detection model: {e}")
+                st.info("Please make sure 'haarcascade_frontalface_default.xml' is in the Data folder")
                 return
             
-            cap = cv2.VideoCapture(0)
-            if not cap.isOpened():
+            if not started:
+                camera.release()
                 st.error("Error: Could not open webcam")
                 return
             
-            ts = time.time()
-            date = datetime.fromtimestamp(ts).strftime("%d-%m-%Y")
-            timestamp = datetime.fromtimestamp(ts).strftime("%H:%M:%S")
-            
-            attendance_file = f"Attendance/Attendance_{date}.csv"
-            file_exists = os.path.isfile(attendance_file)
+            writer = attendance_writer.get_writer()
+            speaker = announcer.get_announcer()
             
             attendance_taken = {}  
+            # People the writer had already recorded today; recognized, but not marked again
+            already_marked = set()
             status_text = st.empty()
             progress_bar = st.progress(0)
             
-            attendance_list = st.empty()
-            today_attendance = []
+            attendance_list = preview.AttendanceList(st.container())
+            frame_preview = preview.FramePreview(frame_placeholder, 
+                                                 max_width=preview_width if compress_preview else 0,
+                                                 quality=preview_quality,
+                                                 max_fps=preview_fps,
+                                                 compress=compress_preview)
+            
+            stats_text = st.empty()
             
             stop_placeholder = st.empty()
             stop_button = stop_placeholder.button("Stop Attendance Taking", key="stop_main")
             
             start_time = time.time()
             
-            while not stop_button:
-                current_time = time.time()
-                elapsed_time = current_time - start_time
-                
-                auto_stop = False
-                
-                if auto_stop_mode == "After all registered users" and len(attendance_taken) >= total_registered_users:
-                    auto_stop = True
-                    status_message = "All registered users detected!"
-                elif auto_stop_mode == "After specific users" and len(attendance_taken) >= min_users:
-                    auto_stop = True
-                    status_message = f"Detected {len(attendance_taken)} users as requested!"
-                elif auto_stop_mode == "After time limit" and elapsed_time >= time_limit:
-                    auto_stop = True
-                    status_message = f"Time limit of {time_limit} seconds reached!"
-                
-                if auto_stop:
-                    status_text.info(status_message)
-                    break
-                
-                if auto_stop_mode == "After all registered users":
-                    progress = min(len(attendance_taken) / total_registered_users, 1.0)
-                    progress_text = f"Detected {len(attendance_taken)}/{total_registered_users} registered users"
-                elif auto_stop_mode == "After specific users":
-                    progress = min(len(attendance_taken) / min_users, 1.0)
-                    progress_text = f"Detected {len(attendance_taken)}/{min_users} users"
-                elif auto_stop_mode == "After time limit":
-                    progress = min(elapsed_time / time_limit, 1.0)
-                    progress_text = f"Time: {int(elapsed_time)}/{time_limit} seconds"
-                
-                progress_bar.progress(progress)
-                status_text.text(progress_text)
-                
-                ret, frame = cap.read()
-                if not ret:
-                    st.error("Error: Could not read from webcam")
-                    break
-                
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = facedetect.detectMultiScale(gray, 1.3, 5)
-                
-                for (x, y, w, h) in faces:
-                    crop_img = frame[y:y+h, x:x+w, :]
-                    resized_img = cv2.resize(crop_img, (50, 50)).flatten().reshape(1, -1)
+            profiler = metrics.create_profiler(st.session_state.get('profile_mode', metrics.PROFILE_OFF))
+            metrics_panel = st.session_state.get('metrics_panel')
+            
+            try:
+                iteration = 0
+                while not stop_button:
+                    iteration += 1
+                    current_time = time.time()
+                    elapsed_time = current_time - start_time
                     
-                    output = knn.predict(resized_img)
-                    person_name = str(output[0])
+                    auto_stop = False
+                    detected = len(attendance_taken) + len(already_marked)
                     
-                    cv2.rectangle(frame_rgb, (x, y), (x+w, y+h), (50, 50, 255), 2)
-                    cv2.rectangle(frame_rgb, (x, y-40), (x+w, y), (50, 50, 255), -1)
-                    cv2.putText(frame_rgb, person_name, (x, y-15), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+                    if auto_stop_mode == "After all registered users" and detected >= total_registered_users:
+                        auto_stop = True
+                        status_message = "All registered users detected!"
+                    elif auto_stop_mode == "After specific users" and detected >= min_users:
+                        auto_stop = True
+                        status_message = f"Detected {detected} users as requested!"
+                    elif auto_stop_mode == "After time limit" and elapsed_time >= time_limit:
+                        auto_stop = True
+                        status_message = f"Time limit of {time_limit} seconds reached!"
                     
-                    if person_name not in attendance_taken:
-                        current_time = datetime.now().strftime("%H:%M:%S")
-                        attendance_data = [person_name, current_time]
-                        
-                        with open(attendance_file, "a", newline="") as csvfile:
-                            writer = csv.writer(csvfile)
-                            if not file_exists and csvfile.tell() == 0:
-                                writer.writerow(['NAME', 'TIME'])
-                                file_exists = True
-                            writer.writerow(attendance_data)
-                        
-                        attendance_taken[person_name] = current_time
-                        today_attendance.append(f"{person_name} - {current_time}")
-                        
-                        feedback_thread = threading.Thread(
-                            target=play_audio_message, 
-                            args=(f"Attendance marked for {person_name}",)
-                        )
-                        feedback_thread.start()
-                        
-                        status_text.success(f"Attendance marked for {person_name}")
-                
-                frame_placeholder.image(frame_rgb, channels="RGB", use_column_width=True)
-                
-                if today_attendance:
-                    attendance_list.markdown("### Today's Attendance:")
-                    for entry in today_attendance:
-                        attendance_list.markdown(f"- {entry}")
-                else:
-                    attendance_list.info("No attendance records yet")
-                
-                stop_button = stop_placeholder.button("Stop Attendance Taking", key=f"stop_{int(time.time()*10)}")
-                
-                time.sleep(0.05)
+                    if auto_stop:
+                        status_text.info(status_message)
+                        break
+                    
+                    if auto_stop_mode == "After all registered users":
+                        progress = min(detected / total_registered_users, 1.0)
+                        progress_text = f"Detected {detected}/{total_registered_users} registered users"
+                    elif auto_stop_mode == "After specific users":
+                        progress = min(detected / min_users, 1.0)
+                        progress_text = f"Detected {detected}/{min_users} users"
+                    elif auto_stop_mode == "After time limit":
+                        progress = min(elapsed_time / time_limit, 1.0)
+                        progress_text = f"Time: {int(elapsed_time)}/{time_limit} seconds"
+                    
+                    progress_bar.progress(progress)
+                    status_text.text(progress_text)
+                    
+                    if attendance_pipeline.error or attendance_pipeline.finished:
+                        st.error(f"Error: {attendance_pipeline.error or 'Could not read from webcam'}")
+                        break
+                    
+                    for result in attendance_pipeline.drain_events():
+                        for person_name in result.names:
+                            if (person_name == recognizer.UNKNOWN or person_name in attendance_taken
+                                    or person_name in already_marked):
+                                continue
+                            
+                            seen_at = datetime.fromtimestamp(result.timestamp)
+                            current_time = seen_at.strftime("%H:%M:%S")
+                            # The writer is shared by every session, so people marked
+                            # earlier today (another tab, a rerun) are not marked again
+                            with metrics.timed('attendance_write'):
+                                marked = writer.write(person_name, seen_at)
+                            if not marked:
+                                already_marked.add(person_name)
+                                attendance_list.add(f"{person_name} - already marked today")
+                                continue
+                            attendance_taken[person_name] = current_time
+                            metrics.inc('attendance_marked')
+                            
+                            attendance_list.add(f"{person_name} - {current_time}")
+                            
+                            speaker.mark(person_name)
+                            
+                            status_text.success(f"Attendance marked for {person_name}")
+                    
+                    show_audio_errors(speaker)
+                    
+                    if frame_preview.due():
+                        result = attendance_pipeline.latest()
+                        if result is not None:
+                            frame_preview.show(result.frame)
+                    
+                    stats = attendance_pipeline.stats()
+                    preview_stats = frame_preview.stats()
+                    stats_text.caption(
+                        f"Capture {stats['capture_fps']:.1f} fps · "
+                        f"Recognition {stats['process_fps']:.1f} fps · "
+                        f"Display {stats['render_fps']:.1f} fps · "
+                        f"Queue {stats['queue_depth']} · Dropped {stats['frames_dropped']} · "
+                        + (f"First frame {camera.first_frame_seconds * 1000:.0f} ms · "
+                           if camera.first_frame_seconds is not None else "")
+                        + (f"Idle-skipped {stats['frames_skipped']} ({schedule_text(stats['schedule_fps'])}) · "
+                           if 'frames_skipped' in stats else "")
+                        + f"Preview {preview_stats['bytes_per_sec'] / 1024:.0f} KB/s, "
+                        f"{preview_stats['render_ms']:.1f} ms/frame"
+                        + (f" · Identity cache {stats['cache_hits']} hits / {stats['cache_misses']} misses"
+                           if 'cache_hits' in stats else "")
+                    )
+                    
+                    if metrics_panel is not None:
+                        metrics_panel.refresh()
+                    
+                    stop_button = stop_placeholder.button("Stop Attendance Taking", key=f"stop_{iteration}")
+                    
+                    time.sleep(0.05)
+            finally:
+                attendance_pipeline.stop()
+                writer.flush()
+                if profiler is not None:
+                    profiler.stop()
+                    st.caption(f"Profile written to {profiler.write()}")
+                if metrics_panel is not None:
+                    metrics_panel.refresh(force=True)
             
-            cap.release()
             progress_bar.progress(1.0)
             
             if attendance_taken:
                 success_message = f"Attendance completed! Recorded {len(attendance_taken)} students."
                 st.success(success_message)
                 
-                completion_thread = threading.Thread(
-                    target=play_audio_message, 
-                    args=(success_message,)
-                )
-                completion_thread.start()
-            else:
+                speaker.say(success_message)
+                show_audio_errors(speaker)
+            elif not already_marked:
                 st.warning("No attendance was recorded.")
+            if already_marked:
+                st.info(f"{len(already_marked)} students were already marked today and were not recorded again.")
     
     with col2:
         st.subheader("Instructions")
@@ -0,0 +1,175 @@
+"""
+Track faces across frames and cache their identities
+
+Once a face has been recognized there is no need to classify it again on
+every frame while it stays in view. FaceTracker gives each detected box a
+track id by matching it to the previous frame's boxes on IoU, and
+TrackedRecognizer reuses a track's confirmed label until its confidence
+decays (after a configurable TTL), only running the recognizer for new or
+stale tracks.
+"""
+import threading
+import time
+
+import numpy as np
+
+import recognizer
+from detection import iou
+
+
+class Track:
+    """
+    A face followed across frames
+
+    Attributes:
+        track_id (int): Stable id for as long as the face stays matched
+        box (tuple): Latest (x, y, w, h) box
+        label (str): Latest recognized name, or None before the first recognition
+        distance (float): Recognition distance for label
+        agreeing (int): Consecutive recognitions that returned label
+        recognized_at (float): Monotonic time of the last recognition
+        last_seen (float): Monotonic time the track was last matched to a box
+    """
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.label = None
+        self.distance = float('inf')
+        self.agreeing = 0
+        self.recognized_at = None
+        self.last_seen = now
+
+
+class FaceTracker:
+    """
+    Greedy IoU matcher that assigns track ids to detected boxes
+
+    Args:
+        iou_threshold (float): Minimum overlap for a box to continue a track
+        max_age (float): Seconds a track survives without being matched
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=1.0):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks = []
+        self._next_id = 0
+
+    def update(self, boxes, now=None):
+        """
+        Match boxes to existing tracks, starting new tracks for the rest
+
+        Returns:
+            list: The Track for each box, in the same order as boxes
+        """
+        now = time.monotonic() if now is None else now
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_age]
+
+        pairs = sorted(((iou(box, track.box), i, j)
+                        for i, box in enumerate(boxes)
+                        for j, track in enumerate(self.tracks)), reverse=True)
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for overlap, i, j in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if assigned[i] is not None or j in used_tracks:
+                continue
+            assigned[i] = self.tracks[j]
+            used_tracks.add(j)
+
+        for i, box in enumerate(boxes):
+            if assigned[i] is None:
+                assigned[i] = Track(self._next_id, box, now)
+                self._next_id += 1
+                self.tracks.append(assigned[i])
+            assigned[i].box = box
+            assigned[i].last_seen = now
+        return assigned
+
+
+class TrackedRecognizer:
+    """
+    Recognizer wrapper that skips classification for confirmed tracks
+
+    A track's label is confirmed once confirm_hits consecutive recognitions
+    agree on it. Confidence in a confirmed label decays linearly from 1 to 0
+    over ttl seconds; when it reaches 0 the face is recognized again. Safe
+    to share between threads: the tracks are updated under a lock, while
+    the recognizer itself runs outside it.
+
+    Args:
+        model: Object with recognize(samples) -> (names, distances)
+        ttl (float): Seconds a confirmed label is reused before re-checking
+        confirm_hits (int): Agreeing recognitions needed to confirm a label
+        iou_threshold (float): Passed to FaceTracker
+        max_age (float): Passed to FaceTracker
+    """
+
+    def __init__(self, model, ttl=5.0, confirm_hits=1, iou_threshold=0.3, max_age=1.0):
+        self.model = model
+        self.ttl = ttl
+        self.confirm_hits = confirm_hits
+        self.tracker = FaceTracker(iou_threshold, max_age)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def confidence(self, track, now):
+        """
+        How much the cached label for a track can still be trusted, 0 to 1
+        """
+        if track.label is None or track.agreeing < self.confirm_hits or self.ttl <= 0:
+            return 0.0
+        return max(0.0, 1.0 - (now - track.recognized_at) / self.ttl)
+
+    def recognize_frame(self, frame, boxes, now=None):
+        """
+        Recognize the faces in a frame, reusing cached labels where possible
+
+        Returns:
+            tuple: (names, distances, track_ids), one entry per box
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tracks = self.tracker.update(boxes, now)
+            stale = [i for i, track in enumerate(tracks) if self.confidence(track, now) <= 0]
+            self.misses += len(stale)
+            self.hits += len(tracks) - len(stale)
+
+        if stale:
+            crops = recognizer.crops_from_frame(frame, [boxes[i] for i in stale])
+            names, distances = self.model.recognize(crops)
+        with self._lock:
+            if stale:
+                for i, name, distance in zip(stale, names, distances):
+                    track = tracks[i]
+                    track.agreeing = track.agreeing + 1 if name == track.label else 1
+                    track.label = name
+                    track.distance = float(distance)
+                    track.recognized_at = now
+
+            names = [track.label for track in tracks]
+            distances = np.asarray([track.distance for track in tracks], dtype=np.float32)
+            return names, distances, [track.track_id for track in tracks]
+
+    def set_model(self, model):
+        """
+        Recognize with another model from now on, forgetting every cached label
+        """
+        with self._lock:
+            self.model = model
+            self.tracker = FaceTracker(self.tracker.iou_threshold, self.tracker.max_age)
+
+    def stats(self):
+        """
+        Cache hit/miss counters
+        """
+        lookups = self.hits + self.misses
+        return {
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+            'cache_hit_rate': self.hits / lookups if lookups else 0.0,
+            'active_tracks': len(self.tracker.tracks),
+        }
@@ -1,7 +1,5 @@
 import os
-import cv2
-import numpy as np
-import pickle
+from contextlib import contextmanager
 from datetime import datetime
 import time
 
@@ -38,6 +36,34 @@ def download_cascade_if_needed():
             return False
     return True
 
+@contextmanager
+def file_lock(lock_path):
+    """
+    Hold an exclusive lock on a lock file across processes
+    
+    Uses msvcrt on Windows and flock elsewhere; the file is created if missing.
+    
+    Args:
+        lock_path (str): Path of the lock file
+    """
+    with open(lock_path, 'a+b') as lock_file:
+        if os.name == 'nt':
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
 def get_current_datetime():
     """
     Get the current date and time formatted as strings
@@ -53,61 +79,58 @@ def save_attendance(name, timestamp, file_path=None):
     """
     Save attendance to a CSV file
     
+    Rows go through the shared buffered writer, which keeps the file open
+    and skips names already recorded in it.
+    
     Args:
         name (str): Name of the person
         timestamp (str): Time of attendance
         file_path (str, optional): Path to the attendance file. If None, uses the current date.
-    """
-    if file_path is None:
-        date, _, _ = get_current_datetime()
-        file_path = f"Attendance/Attendance_{date}.csv"
-    
     
-    file_exists = os.path.isfile(file_path)
-    
- 
-    if not os.path.exists(os.path.dirname(file_path)):
-        os.makedirs(os.path.dirname(file_path))
+    Returns:
+        bool: True if a new row was recorded, False if the name was already present
+    """
+    import attendance_writer
     
+    if file_path is None:
+        writer = attendance_writer.get_writer()
+    else:
+        writer = attendance_writer.get_writer(path=file_path)
     
-    import csv
-    with open(file_path, "a", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        if not file_exists:
-            writer.writerow(['NAME', 'TIME'])
-        writer.writerow([name, timestamp])
-        
-    return True
+    return writer.write(name, time_text=timestamp)
 
 def load_face_data():
     """
-    Load face data and labels from pickle files
+    Load face data and labels from the gallery
+    
+    The face vectors are memory-mapped read-only, so no copy of the
+    gallery is made. Legacy pickles are migrated on first use.
     
     Returns:
         tuple: (faces_data, labels) if successful, (None, None) otherwise
     """
     try:
-        with open('Data/names.pkl', 'rb') as w:
-            labels = pickle.load(w)
-        with open('Data/faces_data.pkl', 'rb') as f:
-            faces = pickle.load(f)
-        return faces, labels
+        import gallery
+        gallery.ensure_gallery()
+        snapshot = gallery.open_gallery()
+        return snapshot.faces, snapshot.labels
     except Exception as e:
         print(f"Error loading face data: {e}")
         return None, None
 
 def text_to_speech(text):
     """
-    Convert text to speech (simplified version)
+    Queue text to be spoken by the shared announcer, without blocking
     
     Args:
         text (str): Text to convert to speech
+    
+    Returns:
+        bool: True if the text was queued
     """
     try:
-        from win32com.client import Dispatch
-        speaker = Dispatch("SAPI.SpVoice")
-        speaker.Speak(text)
-        return True
+        import announcer
+        return announcer.get_announcer().say(text)
     except Exception as e:
         print(f"Error with text-to-speech: {e}")
-        return False
\ No newline at end of file
+        return False